@@ -1,41 +1,40 @@
 import socket
-from flask import Flask, jsonify, request, send_from_directory, render_template_string
+import signal
+from flask import Flask, Response, jsonify, request, send_from_directory, render_template_string
 import os
 import json
 import time
 import threading
 import subprocess
+import sys
 import base64
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-import qrcode
 from datetime import datetime
 import logging
-
-# Setup logger
-logger = logging.getLogger('label_printer.config')
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('/home/odroid/label_printer_web/app.log')
-file_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# Try importing label_printer modules
-try:
-    from label_printer.routes import init_routes
-    from label_printer.printing import print_qr_code
-    from label_printer.history import ensure_history_file
-    from label_printer.utils import resolve_usb_conflicts
-except ImportError as e:
-    logger.error(f"Failed to import label_printer modules: {str(e)}")
-    init_routes = lambda x: None
-    print_qr_code = lambda x: subprocess.CompletedProcess(args=['mock'], returncode=1, stdout='', stderr=str(e))
-    ensure_history_file = lambda: None
-    resolve_usb_conflicts = lambda: None
+from label_printer.logs import setup_logging
+from label_printer.routes import init_routes
+from label_printer.api import init_api
+from label_printer.printing import print_qr_code, qr_code_red
+from label_printer.history import ensure_history_file
+from label_printer.backends import printer_backend
+from label_printer.print_queue import print_queue
+from label_printer.status import status_monitor
+from label_printer.service import print_service
+from label_printer.render_pool import render_pool, render_qr_png, warm_up
+from label_printer.startup import startup_jobs
+from label_printer.fonts import load_font_families
+from label_printer.qr import qr_image
+from label_printer.config import SERVICE_ADDRESS
+from label_printer.settings import settings
+
+logger = logging.getLogger('label_printer.app')
+
+submit_print_job = print_queue.submit
 
 app = Flask(__name__)
 
+SSE_KEEPALIVE = 15  # Seconds between keepalive comments on idle event streams
+
 def clear_qr_code_directory():
     """
     Delete all files in the static/qr_codes directory on startup.
@@ -47,7 +46,7 @@ def clear_qr_code_directory():
         for filename in os.listdir(save_dir):
             file_path = os.path.join(save_dir, filename)
             if os.path.isfile(file_path):
-                os.unlink=(file_path)
+                os.unlink(file_path)
                 logger.info(f"Deleted QR code file: {file_path}")
     except Exception as e:
         logger.error(f"Failed to clear QR code directory: {str(e)}")
@@ -147,6 +146,7 @@ def save_qr_code(data, filename_prefix):
     Generate a QR code with the given data, add the data text below it, and save as a PNG in static/qr_codes.
     Returns the filename (relative to static/qr_codes) or None if saving fails.
     """
+    from PIL import Image, ImageDraw, ImageFont
     logger.debug(f"Saving QR code for data: {data}, prefix: {filename_prefix}")
     try:
         # Define save directory
@@ -158,18 +158,8 @@ def save_qr_code(data, filename_prefix):
             logger.error(f"No write permission for {save_dir}")
             return None
 
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-
-        # Create QR code image
-        qr_img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+        # Generate QR code: 10px modules with the standard 4-module quiet zone
+        qr_img = qr_image(data, module_size=10, border=4).convert('RGB')
         qr_width, qr_height = qr_img.size
         logger.debug(f"QR code image created, size: {qr_width}x{qr_height}")
 
@@ -221,21 +211,6 @@ def save_qr_code(data, filename_prefix):
         logger.error(f"Failed to save QR code for {filename_prefix}: {str(e)}")
         return None
 
-def load_default_settings():
-    logger.debug("Loading default settings")
-    settings_file = "/home/odroid/label_printer_web/settings.txt"
-    defaults = {}
-    try:
-        if os.path.exists(settings_file):
-            with open(settings_file, "r") as f:
-                defaults = json.load(f)
-            logger.debug(f"Loaded default settings: {defaults}")
-        else:
-            logger.debug(f"Settings file {settings_file} does not exist")
-    except Exception as e:
-        logger.error(f"Error loading settings.txt: {str(e)}")
-    return defaults
-
 @app.route('/qr_codes/<filename>')
 def serve_qr_code(filename):
     """
@@ -349,22 +324,9 @@ def check_and_update_ip_port():
                     logger.info(f"{interface.capitalize()} URL QR code saved as {url_qr_filename}, accessible at /qr_codes/{url_qr_filename}")
                 else:
                     logger.error(f"Failed to save URL QR code for {interface}")
-                for attempt in range(3):
-                    try:
-                        result = print_qr_code(url)
-                        if "Printing was successful" in result.stdout:
-                            logger.info(f"{interface.capitalize()} URL QR code printed successfully")
-                            break
-                        else:
-                            logger.error(f"Failed to print {interface} URL QR code (attempt {attempt + 1}/3): {result.stderr}")
-                            resolve_usb_conflicts()
-                            time.sleep(2)
-                    except Exception as e:
-                        logger.error(f"Error printing {interface} URL QR code (attempt {attempt + 1}/3): {e}")
-                        resolve_usb_conflicts()
-                        time.sleep(2)
-                else:
-                    logger.error(f"Failed to print {interface} URL QR code after 3 attempts")
+                # Printed from the print queue, so a missing printer doesn't hold up startup
+                submit_print_job(print_qr_code, render_pool.run(render_qr_png, url), red=qr_code_red(), description=f"{interface} URL QR code")
+                logger.info(f"Queued {interface} URL QR code for printing")
 
                 # Save and print Wi-Fi QR code (only for Wi-Fi interface)
                 if interface == "wifi":
@@ -375,22 +337,8 @@ def check_and_update_ip_port():
                         logger.info(f"Wi-Fi QR code saved as {wifi_qr_filename}, accessible at /qr_codes/{wifi_qr_filename}")
                     else:
                         logger.error("Failed to save Wi-Fi QR code")
-                    for attempt in range(3):
-                        try:
-                            result = print_qr_code(wifi_qr_string)
-                            if "Printing was successful" in result.stdout:
-                                logger.info("Wi-Fi QR code printed successfully")
-                                break
-                            else:
-                                logger.error(f"Failed to print Wi-Fi QR code (attempt {attempt + 1}/3): {result.stderr}")
-                                resolve_usb_conflicts()
-                                time.sleep(2)
-                        except Exception as e:
-                            logger.error(f"Error printing Wi-Fi QR code (attempt {attempt + 1}/3): {e}")
-                            resolve_usb_conflicts()
-                            time.sleep(2)
-                    else:
-                        logger.error("Failed to print Wi-Fi QR code after 3 attempts")
+                    submit_print_job(print_qr_code, render_pool.run(render_qr_png, wifi_qr_string), red=qr_code_red(), description="Wi-Fi QR code")
+                    logger.info("Queued Wi-Fi QR code for printing")
         else:
             logger.debug("Addresses unchanged, no QR codes generated")
     except Exception as e:
@@ -421,15 +369,49 @@ def restart():
 
 @app.route('/printer_status', methods=['GET'])
 def printer_status():
+    """
+    Return the cached printer status snapshot (online, state, current_job, queued, media, errors).
+    """
     try:
-        result = subprocess.run(['lsusb'], capture_output=True, text=True)
-        online = '04f9:209c' in result.stdout
-        logger.debug(f"Printer status check: {'online' if online else 'offline'}")
-        return jsonify({'online': online})
+        snapshot, _ = print_service.status()
+        return jsonify(snapshot)
     except Exception as e:
         logger.error(f"Error checking printer status: {str(e)}")
         return jsonify({'online': False}), 500
 
+@app.route('/printer_status/stream', methods=['GET'])
+def printer_status_stream():
+    """
+    Server-sent events stream pushing the printer status snapshot whenever it changes.
+    """
+    def generate():
+        version = None
+        while True:
+            snapshot, new_version = print_service.wait_for_status(version, SSE_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(snapshot)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Which startup jobs have finished (usb, qr_codes, render_pool, fonts), with their state and timings.
+    200 once none is pending or running and the print service answers, 503 before; a failed job is reported
+    but does not hold readiness back.
+    """
+    subsystems = startup_jobs.status()
+    try:
+        # Under the WSGI front end the printer side starts up in the print service process
+        subsystems.update(print_service.startup_status())
+    except Exception as e:
+        subsystems['print_service'] = {'state': 'unavailable', 'error': str(e)}
+    is_ready = all(job['state'] in ('ready', 'failed') for job in subsystems.values())
+    return jsonify({'ready': is_ready, 'subsystems': subsystems}), 200 if is_ready else 503
+
 @app.route('/save_template', methods=['POST'])
 def save_template():
     logger.debug("Processing save_template request")
@@ -477,6 +459,7 @@ def save_template():
             if template_preview and template_preview.startswith('data:image/png;base64,'):
                 base64_string = template_preview.split(',')[1]
                 img_data = base64.b64decode(base64_string)
+                from PIL import Image
                 img = Image.open(BytesIO(img_data))
                 img.save(preview_path, 'PNG')
             else:
@@ -684,47 +667,106 @@ def update_codebase():
         logger.error(f"Unexpected error in update_codebase: {str(e)}")
         return jsonify({'message': f'Unexpected error: {str(e)}'}), 500
 
-if __name__ == "__main__":
-    logger.info("Starting Flask application")
-    try:
-        logger.debug("Executing clear_qr_code_directory")
-        clear_qr_code_directory()
+def resolve_usb_conflicts_at_startup():
+    """USB recovery from a startup job; holds the printer so queued jobs wait for it to finish."""
+    with print_queue.device_lock:
+        printer_backend.recover()
 
-        logger.debug("Executing ensure_history_file")
-        ensure_history_file()
+def start_printer_services():
+    """
+    Start everything that owns the printer or the print directory: the status monitor, the startup
+    QR code and the directory watcher. Runs in exactly one process.
+    """
+    logger.debug("Executing clear_qr_code_directory")
+    clear_qr_code_directory()
 
-        logger.debug("Executing resolve_usb_conflicts")
-        resolve_usb_conflicts()
+    logger.debug("Executing ensure_history_file")
+    ensure_history_file()
 
-        logger.debug("Executing load_default_settings")
-        defaults = load_default_settings()
-        app.config['DEFAULTS'] = defaults
+    # QR prints read the saved tape type
+    settings.watch()
 
-        logger.debug("Executing check_and_update_ip_port")
-        check_and_update_ip_port()
+    logger.debug("Starting printer status monitor")
+    status_monitor.start()
 
-        logger.debug("Executing init_routes")
-        init_routes(app)
+    # Slow work runs in the background so the web server binds at once; /ready reports on it
+    startup_jobs.run('usb', resolve_usb_conflicts_at_startup)
+    # The startup QR codes are queued only after USB recovery, as before
+    startup_jobs.run('qr_codes', check_and_update_ip_port, after='usb')
+    if render_pool.workers > 0:
+        startup_jobs.run('render_pool', render_pool.run, warm_up)
 
-        logger.debug("Attempting to import watch_print_directory")
+    logger.debug("Attempting to import watch_print_directory")
+    try:
+        from watch_print_dir import watch_print_directory
+        logger.info("Successfully imported watch_print_directory")
+    except ImportError as e:
+        logger.error(f"Failed to import watch_print_directory: {str(e)}")
+        watch_print_directory = None
+
+    if watch_print_directory:
         try:
-            from watch_print_dir import watch_print_directory
-            logger.info("Successfully imported watch_print_directory")
-        except ImportError as e:
-            logger.error(f"Failed to import watch_print_directory: {str(e)}")
-            watch_print_directory = None
+            logger.debug("Starting directory watcher thread")
+            watcher_thread = threading.Thread(target=watch_print_directory, daemon=True)
+            watcher_thread.start()
+            logger.info("Started directory watcher thread")
+        except Exception as e:
+            logger.error(f"Failed to start directory watcher: {str(e)}")
 
-        if watch_print_directory:
-            try:
-                logger.debug("Starting directory watcher thread")
-                watcher_thread = threading.Thread(target=watch_print_directory, daemon=True)
-                watcher_thread.start()
-                logger.info("Started directory watcher thread")
-            except Exception as e:
-                logger.error(f"Failed to start directory watcher: {str(e)}")
+def create_app(service_address=None):
+    """
+    Finish setting up the app: saved default settings, routes and the API. With service_address, as under
+    the WSGI front end, print jobs and printer status go to the print service process listening there,
+    and previews render in the web worker itself since the workers already spread them over the cores.
+    """
+    if app.config.get('CONFIGURED'):
+        return app
+    # Logs go through a background writer to app.log; see label_printer.logs. Not at import, so importing app starts no threads
+    setup_logging()
+    # Every web worker keeps its own copy of the saved defaults and follows changes to the file
+    settings.watch()
+
+    if service_address:
+        print_service.connect(service_address)
+        render_pool.workers = 0
+    startup_jobs.run('fonts', load_font_families)
+
+    logger.debug("Executing init_routes")
+    init_routes(app)
+    init_api(app)
+    app.config['CONFIGURED'] = True
+    return app
+
+def exit_on_sigterm(signum, frame):
+    """SIGTERM as SystemExit, so a stopped process runs its cleanup (render pool, service socket) like on Ctrl-C."""
+    logger.info("Received SIGTERM, shutting down")
+    sys.exit(0)
+
+def run_print_service():
+    """The service process of the production setup: owns the printer and answers the web workers (see wsgi.py)."""
+    setup_logging()
+    logger.info("Starting print service")
+    start_printer_services()
+    try:
+        print_service.serve(SERVICE_ADDRESS)
+    finally:
+        render_pool.shutdown()
 
-        logger.debug("Starting Flask app.run")
-        app.run(host='0.0.0.0', port=5001)
-    except Exception as e:
-        logger.error(f"Fatal error starting Flask application: {str(e)}")
-        raise
+if __name__ == "__main__":
+    setup_logging()
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    if '--service' in sys.argv:
+        run_print_service()
+    else:
+        # Development server: printer services and web requests share this one process
+        logger.info("Starting Flask application")
+        try:
+            start_printer_services()
+            create_app()
+            logger.debug("Starting Flask app.run")
+            app.run(host='0.0.0.0', port=5001)
+        except Exception as e:
+            logger.error(f"Fatal error starting Flask application: {str(e)}")
+            raise
+        finally:
+            render_pool.shutdown()
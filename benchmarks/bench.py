@@ -0,0 +1,278 @@
+"""
+Benchmarks for label rendering, print file preparation, QR codes, font scanning and the label history.
+
+    python -m benchmarks.bench                     # run everything and print a table
+    python -m benchmarks.bench -k label            # only cases whose name contains "label"
+    python -m benchmarks.bench --save baseline     # also store the results as benchmarks/results/baseline.json
+    python -m benchmarks.bench --compare baseline  # compare with a stored run; exits 1 on a regression
+
+Run from the repository root. Every case runs once to warm up (fonts, QR and barcode caches), then
+repeatedly for at least --min-time seconds; medians are compared, since they shrug off the odd
+scheduler hiccup. Results are JSON with the machine and commit they were measured on.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from label_printer import fonts, history
+from label_printer.config import FONT_DIR
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SYSTEM_FONT_DIR = "/usr/share/fonts/truetype/"
+HISTORY_SIZES = (1000, 10000, 100000)
+
+CASES = {}
+
+def case(name):
+    """Register a benchmark. The decorated function does the setup and returns (run, before): run is timed, before (or None) runs untimed ahead of every run."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+# Label rendering, on the inputs the web form produces
+
+def label_params(**fields):
+    from label_printer.routes import label_params_from_form
+    return label_params_from_form(fields, {'length_mm': 100, 'orientation': 'rotated', 'tape_type': 'black'})
+
+LABELS = {
+    'short': label_params(text1="A-01"),
+    'multiline': label_params(text1="Shelf 12\nBin 4\nScrews M4x20", text2="Stainless\nDIN 912", size1=40, size2=32),
+    'markup': label_params(text1="[[DANGER]] [[[high voltage]]] [[keep out]]\n[[[Authorised]]] [[staff only]]", text2="[[Call]] 555-0100 [[[now]]]", tape_type="red_black", bg2="black"),
+    'mixed_fonts': label_params(text1="Serif bold", face1="DejaVuSerif", bold1="on", text2="Mono", face2="DejaVuSansMono", text3="Sans italic underlined", italic3="on", underline3="on", justify2="center", justify3="right"),
+    'standard': label_params(text1="Standard orientation", text2="second line", orientation="standard", length_mm=60),
+    'long_tape': label_params(text1="A label one metre long " * 8, size1=96, length_mm=1000),
+    'barcode': label_params(text1="Part 4711", barcode_type="code128", barcode_data="PART-4711-0042"),
+}
+
+for label_name, params in LABELS.items():
+    def label_case(params=params):
+        from label_printer.image import generate_label_image
+        return (lambda: generate_label_image(**params)), None
+    case(f"label[{label_name}]")(label_case)
+
+# QR codes
+
+@case("qr[cached]")
+def qr_cached():
+    from label_printer.image import render_qr_label
+    return (lambda: render_qr_label("https://example.com/assets/000042")), None
+
+@case("qr[uncached]")
+def qr_uncached():
+    from label_printer.image import render_qr_label
+    from label_printer.qr import qr_matrix
+    return (lambda: render_qr_label("https://example.com/assets/000042")), qr_matrix.cache_clear
+
+@case("qr[matrix_long_url]")
+def qr_matrix_long():
+    from label_printer.qr import qr_matrix
+    return (lambda: qr_matrix("https://example.com/" + "x" * 600, 'M')), qr_matrix.cache_clear
+
+# Print file preparation (prepare_print_file is the CPU-bound part of print_file)
+
+def sample_image(size):
+    """A photo-like image: gradients with noise, so it dithers and compresses like real input."""
+    from PIL import Image, ImageChops
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    return Image.merge('RGB', (gradient, ImageChops.add(gradient, noise, scale=2), noise.rotate(90, expand=False)))
+
+def sample_file(workdir, name, fmt, size=(2000, 1400)):
+    path = os.path.join(workdir, name)
+    image = sample_image(size)
+    if fmt == 'PDF':
+        image.save(path, fmt, resolution=150.0, save_all=True, append_images=[sample_image(size)])
+    else:
+        image.save(path, fmt)
+    return path
+
+PRINT_FILES = {
+    'png': ('sample.png', 'PNG'),
+    'jpeg': ('sample.jpg', 'JPEG'),
+    'png_no_dither': ('sample-gs.png', 'PNG'),
+    'png_width_300': ('sample|w=300|.png', 'PNG'),
+    'pdf': ('sample.pdf', 'PDF'),
+}
+
+for file_kind, (file_name, file_format) in PRINT_FILES.items():
+    def file_case(file_name=file_name, file_format=file_format):
+        from label_printer.printing import prepare_print_file
+        if file_format == 'PDF' and shutil.which('pdftoppm') is None:
+            raise Skip("pdftoppm is not installed")
+        path = sample_file(workdir(), file_name, file_format)
+        return (lambda: prepare_print_file(path)), None
+    case(f"print_file[{file_kind}]")(file_case)
+
+# Fonts
+
+@case("fonts[scan]")
+def font_scan():
+    return fonts.scan_fonts, None
+
+@case("fonts[load_uncached]")
+def font_load():
+    path = fonts.get_font_path("DejaVuSans", False, False)
+    return (lambda: fonts.load_font(path, 48)), fonts.load_font.cache_clear
+
+# Label history, in a scratch file rather than the real one
+
+def history_entries(count):
+    entry = dict(LABELS['multiline'], timestamp="2024-01-01 12:00:00")
+    return [dict(entry, text1=f"Label {n}") for n in range(count)]
+
+def use_scratch_history(count):
+    path = os.path.join(workdir(), f"history_{count}.json")
+    seed = f"{path}.seed"
+    with open(seed, 'w') as f:
+        json.dump(history_entries(count), f)
+    history.HISTORY_FILE = path
+    history.HISTORY_LOCK_FILE = f"{path}.lock"
+    return lambda: shutil.copyfile(seed, path)
+
+for history_size in HISTORY_SIZES:
+    def history_load_case(count=history_size):
+        reset = use_scratch_history(count)
+        reset()
+        return history.load_history, None
+
+    def history_save_case(count=history_size):
+        reset = use_scratch_history(count)
+        entry = history_entries(1)[0]
+        return (lambda: history.save_history(entry)), reset
+
+    case(f"history_load[{history_size}]")(history_load_case)
+    case(f"history_save[{history_size}]")(history_save_case)
+
+# Running and comparing
+
+class Skip(Exception):
+    """Raised by a case setup that cannot run on this machine."""
+
+scratch_dir = None
+
+def workdir():
+    global scratch_dir
+    if scratch_dir is None:
+        scratch_dir = tempfile.mkdtemp(prefix="label_printer_bench_")
+    return scratch_dir
+
+def measure(run, before=None, min_time=1.0, min_runs=5, max_runs=1000):
+    """Seconds per call of run: one warm-up call, then at least min_runs and min_time seconds of timed calls."""
+    if before:
+        before()
+    run()
+    times = []
+    while len(times) < max_runs and (len(times) < min_runs or sum(times) < min_time):
+        if before:
+            before()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'runs': len(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'min': times[0],
+        'p95': times[min(len(times) - 1, int(len(times) * 0.95))],
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+def machine_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def run_cases(names, min_time):
+    results = {}
+    for name in names:
+        try:
+            run, before = CASES[name]()
+            results[name] = measure(run, before, min_time=min_time)
+            print(f"{name:32} {results[name]['median'] * 1000:10.3f} ms  ({results[name]['runs']} runs)", flush=True)
+        except Skip as e:
+            print(f"{name:32} skipped: {e}", flush=True)
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each case against the baseline; returns the names of cases slower by more than threshold (0.1 is 10%)."""
+    regressions = []
+    print(f"\n{'case':32} {'baseline ms':>12} {'now ms':>12} {'change':>8}")
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:32} {'-':>12} {result['median'] * 1000:12.3f}      new")
+            continue
+        change = result['median'] / old['median'] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:32} {old['median'] * 1000:12.3f} {result['median'] * 1000:12.3f} {change:+8.1%}{flag}")
+    return regressions
+
+def results_path(name):
+    return name if name.endswith('.json') else os.path.join(RESULTS_DIR, f"{name}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark label rendering, file preparation, QR codes, fonts and history.")
+    parser.add_argument('-k', dest='pattern', default='', help="only run cases whose name contains this")
+    parser.add_argument('--list', action='store_true', help="list the cases and exit")
+    parser.add_argument('--min-time', type=float, default=1.0, help="seconds to spend timing each case (default 1)")
+    parser.add_argument('--save', metavar='NAME', help="store the results as benchmarks/results/NAME.json (or a .json path)")
+    parser.add_argument('--compare', metavar='NAME', help="compare with stored results NAME and exit 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=0.10, help="slowdown of the median that counts as a regression (default 0.10)")
+    parser.add_argument('--font-dir', default=FONT_DIR if os.path.isdir(FONT_DIR) else SYSTEM_FONT_DIR,
+                        help="fonts to scan and render with (default: the configured font directory if it exists, else the system fonts)")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.pattern in name]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    fonts.FONT_DIR = args.font_dir
+    try:
+        results = run_cases(names, args.min_time)
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {'machine': machine_info(), 'font_dir': args.font_dir, 'results': results}
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(results_path(args.save), 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {results_path(args.save)}")
+    if args.compare:
+        with open(results_path(args.compare), 'r') as f:
+            baseline = json.load(f)
+        print(f"Baseline: commit {baseline['machine']['commit']} from {baseline['machine']['date']} on {baseline['machine']['platform']}")
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
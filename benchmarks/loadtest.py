@@ -0,0 +1,341 @@
+"""
+End-to-end load test of a running server: browser users, API clients and hot-folder bursts at once.
+
+    LABEL_PRINTER_BACKEND=simulator LABEL_PRINTER_SIMULATOR_SPEED=10 python app.py   # or the service + gunicorn
+    python -m benchmarks.loadtest --users 20 --api-clients 4 --duration 60
+    python -m benchmarks.loadtest --users 50 --bursts 10 --burst-interval 15 --save mixed_50
+
+Browser users load the page, preview a label and now and then print it, pausing between clicks like
+a person would; API clients print through /api/v1/labels; bursts drop files into the print directory,
+so they need to run on the server machine. Every request is timed, every hot-folder file from the
+moment it is written until the watcher moves it to done/ or failed/. The print queue is sampled
+throughout. The report has throughput, p50/p95/p99 latency and error rates per endpoint and the
+queue depth over time.
+
+Printed labels go into the label history like any other. The test refuses to run unless the server
+prints to the simulator; --real-printer overrides that, and uses up tape.
+"""
+import argparse
+import collections
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench import RESULTS_DIR, machine_info, results_path
+
+PRINT_DIR = "/home/odroid/label_printer_web/print"  # watch_print_dir.PRINT_DIR
+FILE_PREFIX = "loadtest"
+PERCENTILES = (50, 95, 99)
+
+# What browser users type; a few markup and barcode labels keep the renderer honest
+BROWSER_LABELS = [
+    {'text1': "Shelf {n}", 'text2': "Bin {i}"},
+    {'text1': "[[Caution]] hot surface", 'text2': "Station {n}", 'tape_type': "red_black"},
+    {'text1': "Cable {n}-{i}", 'size1': "32", 'orientation': "standard", 'length': "60"},
+    {'text1': "Part {n}", 'barcode_type': "code128", 'barcode_data': "PART-{n}-{i}"},
+]
+
+class Results:
+    """Timings of every request and file, and the queue depth samples, from all load threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.samples = collections.defaultdict(list)  # endpoint -> [seconds] of the successful ones
+        self.errors = collections.defaultdict(collections.Counter)  # endpoint -> Counter of error descriptions
+        self.queue_depth = []  # [(seconds since start, jobs queued or printing)]
+
+    def record(self, endpoint, seconds, error=None):
+        with self.lock:
+            if error is None:
+                self.samples[endpoint].append(seconds)
+            else:
+                self.errors[endpoint][error] += 1
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.queue_depth.append((round(time.perf_counter() - self.started, 3), depth))
+
+def percentile(times, p):
+    """Nearest-rank percentile of sorted times."""
+    return times[max(0, min(len(times) - 1, math.ceil(len(times) * p / 100) - 1))]
+
+# HTTP
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip('/')
+        self.results = Results()
+        self.stopped = threading.Event()
+        self.run_id = time.strftime('%Y%m%d%H%M%S')
+        self.pending_files = {}  # file name -> time it was written
+        self.files_lock = threading.Lock()
+
+    def request(self, method, path, form=None, payload=None):
+        """(status, body) of one request; HTTP errors are returned, connection errors raised."""
+        headers = {}
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif payload is not None:
+            data = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def timed(self, endpoint, method, path, check, **kwargs):
+        """Time one request and record it under endpoint; check(status, body) returns an error description or None."""
+        start = time.perf_counter()
+        try:
+            status, body = self.request(method, path, **kwargs)
+            error = check(status, body)
+        except (OSError, ValueError) as e:
+            error = type(e).__name__ if not str(e) else f"{type(e).__name__}: {str(e)[:80]}"
+        self.results.record(endpoint, time.perf_counter() - start, error)
+
+    def think(self, seconds):
+        """Pause like a user would, 50% to 150% of seconds; False once the test is over."""
+        return not self.stopped.wait(seconds * random.uniform(0.5, 1.5))
+
+    # Load generators
+
+    def browser_user(self, n):
+        """Load the page, preview a label, sometimes print it; repeat until the test ends."""
+        i = 0
+        while not self.stopped.is_set():
+            i += 1
+            template = random.choice(BROWSER_LABELS)
+            form = {key: value.format(n=n, i=i) for key, value in template.items()}
+            self.timed('GET /', 'GET', '/', check_page)
+            if not self.think(self.args.think_time):
+                break
+            self.timed('POST /preview', 'POST', '/preview', check_page, form=form)
+            if random.random() < self.args.print_ratio:
+                if not self.think(self.args.think_time):
+                    break
+                self.timed('POST / (print)', 'POST', '/', check_page, form=dict(form, action="Print Label"))
+            if not self.think(self.args.think_time):
+                break
+
+    def api_client(self, n):
+        """Print labels through the JSON API, waiting for each to print when --api-wait is given."""
+        i = 0
+        while not self.stopped.is_set():
+            i += 1
+            payload = {'lines': [{'text': f"API client {n}"}, {'text': f"Label {i}", 'size': 32}], 'length_mm': 50,
+                       'wait': self.args.api_wait}
+            self.timed('POST /api/v1/labels', 'POST', '/api/v1/labels', check_api, payload=payload)
+            if not self.think(self.args.api_interval):
+                break
+
+    def hot_folder(self):
+        """Drop --burst-size files into the print directory every --burst-interval seconds, --bursts times."""
+        image = burst_image()
+        for burst in range(self.args.bursts):
+            if burst and self.stopped.wait(self.args.burst_interval):
+                break
+            for n in range(self.args.burst_size):
+                name = f"{FILE_PREFIX}-{self.run_id}-{burst}-{n}.png"
+                with self.files_lock:
+                    self.pending_files[name] = time.perf_counter()
+                with open(os.path.join(self.args.print_dir, name), 'wb') as f:
+                    f.write(image)
+
+    def follow_files(self):
+        """Record each dropped file once the watcher has moved it to done/ or failed/."""
+        while True:
+            with self.files_lock:
+                pending = dict(self.pending_files)
+            if not pending and self.stopped.is_set():
+                return
+            for outcome in ('done', 'failed'):
+                try:
+                    names = os.listdir(os.path.join(self.args.print_dir, outcome))
+                except FileNotFoundError:
+                    continue
+                now = time.perf_counter()
+                for name in set(names) & set(pending):
+                    with self.files_lock:
+                        del self.pending_files[name]
+                    self.results.record('hot folder file', now - pending.pop(name), None if outcome == 'done' else "moved to failed/")
+            time.sleep(0.05)
+
+    def sample_queue(self):
+        """Record how many jobs are queued or printing every --sample-interval seconds."""
+        while True:
+            try:
+                status, body = self.request('GET', '/api/v1/jobs')
+                if status == 200:
+                    self.results.record_depth(len(json.loads(body)['jobs']))
+            except (OSError, ValueError) as e:
+                print(f"Cannot sample the print queue: {str(e)}", file=sys.stderr)
+            if self.stopped.wait(self.args.sample_interval):
+                return
+
+    def run(self):
+        threads = [threading.Thread(target=self.sample_queue, daemon=True)]
+        threads += [threading.Thread(target=self.browser_user, args=(n,), daemon=True) for n in range(self.args.users)]
+        threads += [threading.Thread(target=self.api_client, args=(n,), daemon=True) for n in range(self.args.api_clients)]
+        if self.args.bursts:
+            threads += [threading.Thread(target=self.hot_folder, daemon=True)]
+        follower = threading.Thread(target=self.follow_files, daemon=True)
+        follower.start()
+        # Users arrive spread over the ramp-up rather than all in the same millisecond
+        for index, thread in enumerate(threads):
+            thread.start()
+            if index and self.args.ramp_up:
+                time.sleep(self.args.ramp_up / len(threads))
+        self.stopped.wait(self.args.duration)
+        self.stopped.set()
+        deadline = time.monotonic() + self.args.drain
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        # Files still unprinted by the end of the drain time count as errors
+        follower.join(max(0, deadline - time.monotonic()))
+        with self.files_lock:
+            for name in self.pending_files:
+                self.results.record('hot folder file', 0, "not printed before the drain timeout")
+            self.pending_files.clear()
+        return time.perf_counter() - self.results.started
+
+def check_page(status, body):
+    if status >= 400:
+        return f"HTTP {status}"
+    if b'Error: ' in body:
+        return "error message on the page"
+    return None
+
+def check_api(status, body):
+    return f"HTTP {status}" if status >= 400 else None
+
+def burst_image():
+    """A 62mm-wide PNG with some text-like bars, as a scanner or another program would drop it."""
+    from PIL import Image, ImageDraw
+    image = Image.new('L', (696, 300), 255)
+    draw = ImageDraw.Draw(image)
+    for row in range(4):
+        for column in range(12):
+            draw.rectangle((20 + column * 55, 30 + row * 65, 60 + column * 55, 70 + row * 65), fill=random.randrange(0, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+# Reporting
+
+def summarize(results, seconds):
+    endpoints = {}
+    for endpoint in sorted(set(results.samples) | set(results.errors)):
+        times = sorted(results.samples[endpoint])
+        errors = sum(results.errors[endpoint].values())
+        total = len(times) + errors
+        summary = {
+            'requests': total,
+            'errors': errors,
+            'error_rate': errors / total if total else 0.0,
+            'throughput': total / seconds,
+            'error_kinds': dict(results.errors[endpoint]),
+        }
+        if times:
+            summary.update({f"p{p}": percentile(times, p) for p in PERCENTILES})
+            summary.update({'mean': statistics.fmean(times), 'max': times[-1]})
+        endpoints[endpoint] = summary
+    depths = [depth for _, depth in results.queue_depth]
+    queue = {
+        'mean': statistics.fmean(depths) if depths else 0.0,
+        'max': max(depths, default=0),
+        'samples': results.queue_depth,
+    }
+    return {'seconds': seconds, 'endpoints': endpoints, 'queue_depth': queue}
+
+def print_report(summary, timeline_step):
+    print(f"\n{'endpoint':22} {'requests':>8} {'errors':>7} {'err %':>6} {'req/s':>7} "
+          + " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES) + f" {'max ms':>9}")
+    for endpoint, result in summary['endpoints'].items():
+        latencies = " ".join(f"{result[f'p{p}'] * 1000:9.1f}" if f"p{p}" in result else f"{'-':>9}" for p in PERCENTILES)
+        longest = f"{result['max'] * 1000:9.1f}" if 'max' in result else f"{'-':>9}"
+        print(f"{endpoint:22} {result['requests']:8} {result['errors']:7} {result['error_rate']:6.1%} "
+              f"{result['throughput']:7.2f} {latencies} {longest}")
+    for endpoint, result in summary['endpoints'].items():
+        for error, count in sorted(result['error_kinds'].items(), key=lambda item: -item[1]):
+            print(f"  {endpoint}: {count} x {error}")
+
+    queue = summary['queue_depth']
+    print(f"\nQueue depth: mean {queue['mean']:.1f}, max {queue['max']}")
+    buckets = collections.defaultdict(list)
+    for offset, depth in queue['samples']:
+        buckets[int(offset // timeline_step)].append(depth)
+    for bucket, depths in sorted(buckets.items()):
+        start = bucket * timeline_step
+        print(f"  {start:6.0f}s-{start + timeline_step:.0f}s  max {max(depths):3}  mean {statistics.fmean(depths):5.1f}  {'#' * max(depths)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running label printer server with browser users, API clients and hot-folder bursts.")
+    parser.add_argument('--url', default="http://127.0.0.1:5001", help="server to test (default http://127.0.0.1:5001)")
+    parser.add_argument('--users', type=int, default=10, help="concurrent browser users (default 10)")
+    parser.add_argument('--think-time', type=float, default=2.0, help="mean seconds a browser user pauses between clicks (default 2)")
+    parser.add_argument('--print-ratio', type=float, default=0.3, help="share of previews a browser user goes on to print (default 0.3)")
+    parser.add_argument('--api-clients', type=int, default=2, help="concurrent API clients (default 2)")
+    parser.add_argument('--api-interval', type=float, default=5.0, help="mean seconds between an API client's labels (default 5)")
+    parser.add_argument('--api-wait', action='store_true', help="API clients wait for each label to print")
+    parser.add_argument('--bursts', type=int, default=0, help="hot-folder bursts to drop (default 0; needs the print directory)")
+    parser.add_argument('--burst-size', type=int, default=10, help="files per burst (default 10)")
+    parser.add_argument('--burst-interval', type=float, default=20.0, help="seconds between bursts (default 20)")
+    parser.add_argument('--print-dir', default=PRINT_DIR, help=f"the watched print directory (default {PRINT_DIR})")
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds to generate load for (default 60)")
+    parser.add_argument('--ramp-up', type=float, default=5.0, help="seconds over which users and clients start (default 5)")
+    parser.add_argument('--drain', type=float, default=120.0, help="seconds to wait for requests and files still in flight at the end (default 120)")
+    parser.add_argument('--timeout', type=float, default=120.0, help="seconds before a request counts as failed (default 120)")
+    parser.add_argument('--sample-interval', type=float, default=0.5, help="seconds between print queue samples (default 0.5)")
+    parser.add_argument('--timeline-step', type=float, default=5.0, help="seconds per line of the queue depth timeline (default 5)")
+    parser.add_argument('--save', metavar='NAME', help="store the results as benchmarks/results/NAME.json (or a .json path)")
+    parser.add_argument('--real-printer', action='store_true', help="run even if the server prints to a real printer")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    try:
+        status, body = test.request('GET', '/api/v1/backend')
+        backend = json.loads(body) if status == 200 else {}
+    except (OSError, ValueError) as e:
+        print(f"Cannot reach {args.url}: {str(e)}", file=sys.stderr)
+        return 2
+    if backend.get('backend') != 'simulator' and not args.real_printer:
+        print(f"{args.url} prints to {backend.get('backend', 'an unknown backend')}; start it with LABEL_PRINTER_BACKEND=simulator "
+              "or pass --real-printer", file=sys.stderr)
+        return 2
+    if args.bursts and not os.path.isdir(args.print_dir):
+        print(f"Print directory {args.print_dir} does not exist; run on the server or pass --print-dir", file=sys.stderr)
+        return 2
+
+    print(f"Load testing {args.url} ({backend.get('backend')}, speed {backend.get('speed', 1)}) for {args.duration:.0f}s: "
+          f"{args.users} browser users, {args.api_clients} API clients, {args.bursts} bursts of {args.burst_size} files", flush=True)
+    seconds = test.run()
+    summary = summarize(test.results, seconds)
+    print_report(summary, args.timeline_step)
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        report = dict(summary, machine=machine_info(), backend=backend, options=vars(args))
+        with open(results_path(args.save), 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {results_path(args.save)}")
+    return 1 if any(result['errors'] for result in summary['endpoints'].values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
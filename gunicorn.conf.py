@@ -0,0 +1,10 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+# The print service (python app.py --service) must be running; it owns the printer, the queue and the watcher.
+import multiprocessing
+
+bind = "0.0.0.0:5001"
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 16  # Each open status or job event stream holds a thread
+timeout = 120  # Renders and print waits stay well below this
+graceful_timeout = 10
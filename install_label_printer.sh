@@ -136,6 +136,7 @@ else
         PyPDF2 \
         attrs \
         watchdog \
+        gunicorn \
         || {
         echo "Failed to install core Python packages" | tee -a "$LOG_FILE"
         exit 1
@@ -291,17 +292,39 @@ systemctl start dnsmasq || {
     exit 1
 }
 
-# Create systemd service file
-echo "Creating systemd service..."
+# Create systemd service files: the print service owns the printer, print queue and print
+# directory watcher; the web interface runs as several gunicorn workers that talk to it.
+# Restarting $SERVICE_NAME restarts both.
+echo "Creating systemd services..."
+cat > /etc/systemd/system/$SERVICE_NAME-print.service <<EOF
+[Unit]
+Description=ameriDroid Label Printer Print Service
+After=network.target
+PartOf=$SERVICE_NAME.service
+
+[Service]
+User=odroid
+WorkingDirectory=$INSTALL_DIR
+ExecStart=$PYTHON_EXEC $INSTALL_DIR/app.py --service
+Restart=always
+RestartSec=5
+StandardOutput=journal
+StandardError=journal
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 cat > /etc/systemd/system/$SERVICE_NAME.service <<EOF
 [Unit]
 Description=ameriDroid Label Printer Web Interface
-After=network.target
+After=network.target $SERVICE_NAME-print.service
+Wants=$SERVICE_NAME-print.service
 
 [Service]
 User=odroid
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$PYTHON_EXEC $INSTALL_DIR/app.py
+ExecStart=$PYTHON_EXEC -m gunicorn -c $INSTALL_DIR/gunicorn.conf.py wsgi:app
 Restart=always
 RestartSec=5
 StandardOutput=journal
@@ -313,7 +336,8 @@ EOF
 
 # Enable and start the service
 echo "Enabling and starting $SERVICE_NAME service..."
-systemctl enable "$SERVICE_NAME" || {
+systemctl daemon-reload
+systemctl enable "$SERVICE_NAME-print" "$SERVICE_NAME" || {
     echo "Failed to enable service" | tee -a "$LOG_FILE"
     exit 1
 }
@@ -0,0 +1,59 @@
+"""
+Maintenance commands: python -m label_printer <command>
+
+    imports [--module app] [--top 25] [--budget SECONDS]
+        Cold-import the module in a fresh interpreter and list the slowest imports. With --budget,
+        exit with status 1 when the total exceeds it, so a check script or CI job can fail on it.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET = 1.0  # Seconds; the web process should come back well under a second after a restart
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def import_timings(module):
+    """Import module in a fresh interpreter with -X importtime. Returns [(name, self_us, cumulative_us, depth)] in import order."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()[-2000:]}")
+    timings = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            timings.append((match.group(4), int(match.group(1)), int(match.group(2)), depth))
+    return timings
+
+def imports_command(args):
+    timings = import_timings(args.module)
+    total = sum(cumulative for _, _, cumulative, depth in timings if depth == 0) / 1e6
+    print(f"Cold import of {args.module}: {total:.3f}s, {len(timings)} modules")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for name, self_us, cumulative, depth in sorted(timings, key=lambda timing: timing[2], reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {'  ' * depth}{name}")
+    if args.budget is not None and total > args.budget:
+        print(f"Import budget exceeded: {total:.3f}s > {args.budget:.3f}s")
+        return 1
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m label_printer", description="Label printer maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imports = commands.add_parser("imports", help="Profile the cold import time of the web process")
+    imports.add_argument("--module", default="app", help="Module to import (default: app, the web process)")
+    imports.add_argument("--top", type=int, default=25, help="Number of modules to list")
+    imports.add_argument("--budget", type=float, nargs="?", const=IMPORT_BUDGET, default=None,
+                         help=f"Fail when the total exceeds this many seconds (default {IMPORT_BUDGET})")
+    imports.set_defaults(func=imports_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,497 @@
+import base64
+import binascii
+import io
+import json
+import logging
+import os
+import re
+from flask import Blueprint, Response, jsonify, request
+from label_printer.barcode import SYMBOLOGIES, BarcodeError, encode
+from label_printer.fonts import load_font_families
+from label_printer.logs import LEVELS, LOG_LEVEL, log_levels, set_levels
+from label_printer.print_queue import PRINT_WAIT_TIMEOUT
+from label_printer.profiling import list_profiles, folded_stacks, top_functions
+from label_printer.printing import print_label, print_qr_code, print_barcode, print_prepared_image, prepare_print_file, qr_code_red
+from label_printer.render_pool import render_pool, render_label_png, render_qr_png, render_barcode_png, label_preview, prepare_upload
+from label_printer.routes import label_params_from_form
+from label_printer.sequence import LAYOUTS, MAX_SEQUENCE_COUNT, SequenceError
+from label_printer.service import print_service, ServiceUnavailable
+from label_printer.settings import settings
+from label_printer.simulator import FAULTS
+from label_printer.workspace import job_workspace
+
+logger = logging.getLogger(__name__)
+
+LABELS_DIR = "/home/odroid/label_printer_web/labels"
+FILE_TYPES = ('.png', '.jpg', '.jpeg', '.bmp', '.pdf')
+LABEL_DEFAULTS = {'length_mm': 100, 'orientation': 'rotated', 'tape_type': 'black'}  # Same as the web form
+UPLOAD_SPOOL_SIZE = 8 * 1024 * 1024  # Uploads up to this size stay in memory, larger ones spill to a file in a job workspace
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024
+UPLOAD_CHUNK = 64 * 1024
+CONTENT_TYPES = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/bmp': '.bmp', 'application/pdf': '.pdf'}
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+# Schemas map field -> (type, default, allowed values). A default of None means the field
+# falls back to the saved printer defaults; allowed values are a tuple of choices or a range.
+LINE_SCHEMA = {
+    'text': (str, '', None),
+    'size': (int, 48, range(6, 1001)),
+    'font': (str, 'DejaVuSans', None),
+    'bold': (bool, False, None),
+    'italic': (bool, False, None),
+    'underline': (bool, False, None),
+    'background': (str, 'white', ('white', 'red', 'black')),
+    'justify': (str, 'left', ('left', 'center', 'right')),
+}
+
+LABEL_SCHEMA = {
+    'lines': (list, [], None),
+    'length_mm': (int, None, range(1, 1001)),
+    'orientation': (str, None, ('standard', 'rotated')),
+    'tape_type': (str, None, ('black', 'red_black')),
+    'spacing': (list, [10, 10], None),
+    'barcode': (dict, {}, None),
+    'wait': (bool, False, None),
+}
+
+# A barcode below the text of a label, or on a label of its own with /barcodes
+BARCODE_SCHEMA = {
+    'type': (str, None, SYMBOLOGIES),
+    'data': (str, None, None),
+    'height': (int, 100, range(10, 697)),
+}
+
+BARCODE_LABEL_SCHEMA = {
+    'type': (str, None, SYMBOLOGIES),
+    'data': (str, None, None),
+    'exclude_text': (bool, False, None),
+    'tape_type': (str, None, ('black', 'red_black')),
+    'wait': (bool, False, None),
+}
+
+QR_SCHEMA = {
+    'text': (str, None, None),
+    'exclude_text': (bool, False, None),
+    'wait': (bool, False, None),
+}
+
+TEMPLATE_SCHEMA = {
+    'fields': (dict, {}, None),
+    'wait': (bool, False, None),
+}
+
+FILE_SCHEMA = {
+    'filename': (str, None, None),
+    'data': (str, None, None),
+    'crop': (bool, True, None),
+    'width': (int, 0, range(0, 10001)),
+    'height': (int, 0, range(0, 10001)),
+    'dither': (bool, True, None),
+    'wait': (bool, False, None),
+}
+
+# Simulator faults, see label_printer.simulator
+FAULT_SCHEMA = {
+    'fault': (str, None, FAULTS),
+    'count': (int, 1, range(1, 1001)),
+}
+
+UPLOAD_SCHEMA = {
+    'filename': (str, '', None),
+    'crop': (bool, True, None),
+    'width': (int, 0, range(0, 10001)),
+    'height': (int, 0, range(0, 10001)),
+    'dither': (bool, True, None),
+    'wait': (bool, False, None),
+}
+
+SEQUENCE_SCHEMA = {
+    'name': (str, None, None),
+    'format': (str, '{n}', None),
+    'start': (int, 1, range(0, 10 ** 12)),
+    'count': (int, 0, range(0, MAX_SEQUENCE_COUNT + 1)),
+    'step': (int, 1, range(1, 10 ** 6)),
+    'layout': (str, 'qr_text', LAYOUTS),
+    'label': (dict, {}, None),
+    'resume': (bool, False, None),
+}
+
+class ValidationError(Exception):
+    pass
+
+def check_barcode(symbology, data, path):
+    """Encode the barcode now (the encoding is cached for the render) so bad data is a 400 rather than a failed job."""
+    try:
+        encode(symbology, data)
+    except BarcodeError as e:
+        raise ValidationError(f"{path}data: {str(e)}")
+
+def validate(payload, schema, defaults=None, path=''):
+    """Check payload against schema and return it with defaults filled in. Raises ValidationError."""
+    if not isinstance(payload, dict):
+        raise ValidationError(f"{path.rstrip('.') or 'body'} must be an object")
+    unknown = set(payload) - set(schema)
+    if unknown:
+        raise ValidationError(f"Unknown field(s): {', '.join(path + name for name in sorted(unknown))}")
+    values = {}
+    for name, (kind, default, allowed) in schema.items():
+        if name in payload:
+            value = payload[name]
+        elif default is None and defaults and name in defaults:
+            value = defaults[name]
+        elif default is None:
+            raise ValidationError(f"{path}{name} is required")
+        else:
+            value = default
+        # bool is a subclass of int, so check it explicitly
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise ValidationError(f"{path}{name} must be of type {kind.__name__}")
+        if isinstance(allowed, range) and value not in allowed:
+            raise ValidationError(f"{path}{name} must be between {allowed.start} and {allowed.stop - 1}")
+        if isinstance(allowed, tuple) and value not in allowed:
+            raise ValidationError(f"{path}{name} must be one of {', '.join(allowed)}")
+        values[name] = value
+    return values
+
+def label_params(payload):
+    """Validate a label payload and turn it into keyword arguments for render_label_png and label_preview."""
+    label = validate(payload, LABEL_SCHEMA, dict(LABEL_DEFAULTS, **settings.get()))
+    if len(label['lines']) > 3:
+        raise ValidationError("lines can hold at most 3 entries")
+    lines = [validate(line, LINE_SCHEMA, path=f"lines[{index}].") for index, line in enumerate(label['lines'])]
+    lines += [validate({}, LINE_SCHEMA)] * (3 - len(lines))
+    for index, line in enumerate(lines):
+        if line['font'] not in load_font_families() and line['font'] != 'DejaVuSans':
+            raise ValidationError(f"lines[{index}].font: unknown font family {line['font']}")
+    spacing = label['spacing']
+    if len(spacing) > 2 or any(not isinstance(value, int) or isinstance(value, bool) or value not in range(0, 1001) for value in spacing):
+        raise ValidationError("spacing must be a list of at most 2 integers between 0 and 1000")
+    spacing = spacing + [10] * (2 - len(spacing))
+    params = {'length_mm': label['length_mm'], 'orientation': label['orientation'], 'tape_type': label['tape_type'],
+              'spacing1': spacing[0], 'spacing2': spacing[1]}
+    if label['barcode']:
+        barcode = validate(label['barcode'], BARCODE_SCHEMA, path='barcode.')
+        check_barcode(barcode['type'], barcode['data'], 'barcode.')
+        params.update(barcode_type=barcode['type'], barcode_data=barcode['data'], barcode_height=barcode['height'])
+    for number, line in enumerate(lines, 1):
+        params.update({
+            f'text{number}': line['text'],
+            f'size{number}': line['size'],
+            f'face{number}': line['font'],
+            f'bold{number}': line['bold'],
+            f'italic{number}': line['italic'],
+            f'underline{number}': line['underline'],
+            f'bg{number}': line['background'],
+            f'justify{number}': line['justify'],
+        })
+    return params, label['wait']
+
+def query_options(schema):
+    """Convert query string parameters to the types in schema, then validate them."""
+    options = {}
+    for name, value in request.args.items():
+        kind = schema.get(name, (str,))[0]
+        if kind is bool:
+            if value.lower() not in ('1', 'true', 'yes', 'on', '0', 'false', 'no', 'off'):
+                raise ValidationError(f"{name} must be true or false")
+            options[name] = value.lower() in ('1', 'true', 'yes', 'on')
+        elif kind is int:
+            try:
+                options[name] = int(value)
+            except ValueError:
+                raise ValidationError(f"{name} must be an integer")
+        else:
+            options[name] = value
+    return validate(options, schema)
+
+def json_payload():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        raise ValidationError("Request body must be JSON with Content-Type: application/json")
+    return payload
+
+def job_response(job, wait):
+    """202 with the job id, or with wait the job's outcome once it has printed."""
+    if wait and print_service.status()[0]['online'] and job.wait(PRINT_WAIT_TIMEOUT):
+        outcome = job.outcome()
+        body = {'job_id': job.id, 'status': outcome}
+        if outcome != 'success' and job.message():
+            body['message'] = job.message()
+        return jsonify(body), 200 if outcome == 'success' else 502
+    return jsonify({'job_id': job.id, 'status': 'queued'}), 202
+
+@api.errorhandler(ValidationError)
+def validation_error(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@api.errorhandler(SequenceError)
+def sequence_error(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@api.errorhandler(ServiceUnavailable)
+def service_unavailable(e):
+    logger.error(str(e))
+    return jsonify({'status': 'error', 'message': str(e)}), 503
+
+@api.route('/labels', methods=['POST'])
+def print_label_job():
+    """Print a label described as up to 3 lines of text plus label settings."""
+    params, wait = label_params(json_payload())
+    png = render_pool.run(render_label_png, **params)
+    job = print_service.submit(print_label, png, red=params['tape_type'] == 'red_black', description="API label")
+    return job_response(job, wait)
+
+@api.route('/labels/preview', methods=['POST'])
+def preview_label():
+    """Render a label without printing; returns the PNG as base64."""
+    params, _ = label_params(json_payload())
+    return jsonify({'image': label_preview(**params)})
+
+@api.route('/qr', methods=['POST'])
+def print_qr_job():
+    qr = validate(json_payload(), QR_SCHEMA)
+    if not qr['text']:
+        raise ValidationError("text must not be empty")
+    png = render_pool.run(render_qr_png, qr['text'], qr['exclude_text'])
+    job = print_service.submit(print_qr_code, png, red=qr_code_red(), description="API QR code")
+    return job_response(job, qr['wait'])
+
+@api.route('/barcodes', methods=['POST'])
+def print_barcode_job():
+    """Print a Code 128, EAN-13, Data Matrix or QR code on a label of its own, with the data below it unless exclude_text."""
+    barcode = validate(json_payload(), BARCODE_LABEL_SCHEMA, dict(LABEL_DEFAULTS, **settings.get()))
+    check_barcode(barcode['type'], barcode['data'], '')
+    png = render_pool.run(render_barcode_png, barcode['type'], barcode['data'], barcode['exclude_text'])
+    job = print_service.submit(print_barcode, png, barcode['type'], red=barcode['tape_type'] == 'red_black', description=f"API {barcode['type']} barcode")
+    return job_response(job, barcode['wait'])
+
+@api.route('/templates', methods=['GET'])
+def list_templates():
+    """Names and configurations of the saved templates, without their preview images."""
+    templates = []
+    if os.path.isdir(LABELS_DIR):
+        for filename in sorted(os.listdir(LABELS_DIR), key=str.lower):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(LABELS_DIR, filename), 'r') as f:
+                    template = json.load(f)
+                templates.append({'name': template['name'], 'config': template['config']})
+            except Exception as e:
+                logger.error(f"Error reading template {filename}: {str(e)}")
+    return jsonify({'templates': templates})
+
+@api.route('/templates/<name>/print', methods=['POST'])
+def print_template_job(name):
+    """Print a saved template; 'fields' overrides its form fields, e.g. {"fields": {"text1": "A-01-03"}}."""
+    body = validate(request.get_json(silent=True) or {}, TEMPLATE_SCHEMA)
+    if not re.match(r'^[a-zA-Z0-9\s_-]+$', name):
+        raise ValidationError("Invalid template name")
+    json_path = os.path.join(LABELS_DIR, f"{name}.json")
+    if not os.path.exists(json_path):
+        return jsonify({'status': 'error', 'message': f"Template '{name}' not found"}), 404
+    with open(json_path, 'r') as f:
+        config = json.load(f)['config']
+    config = dict(config, **body['fields'])
+    # Templates store the form fields, with 'length' saved as 'length_mm'
+    config.setdefault('length', config.get('length_mm', 100))
+    try:
+        params = label_params_from_form(config, settings.get())
+    except (TypeError, ValueError) as e:
+        raise ValidationError(f"Invalid template fields: {str(e)}")
+    png = render_pool.run(render_label_png, **params)
+    job = print_service.submit(print_label, png, red=params['tape_type'] == 'red_black', description=f"API template '{name}'")
+    return job_response(job, body['wait'])
+
+@api.route('/files', methods=['POST'])
+def print_file_job():
+    """Print an image or PDF sent as base64 in 'data', with the crop, scale and dither options of the hot folder."""
+    options = validate(json_payload(), FILE_SCHEMA)
+    filename = os.path.basename(options['filename'])
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in FILE_TYPES:
+        raise ValidationError(f"filename must end in one of {', '.join(FILE_TYPES)}")
+    try:
+        data = base64.b64decode(options['data'], validate=True)
+    except (binascii.Error, ValueError):
+        raise ValidationError("data must be base64")
+    return submit_file(filename, options, data=data)
+
+@api.route('/files/upload', methods=['POST', 'PUT'])
+def upload_file_job():
+    """
+    Print the raw request body, an image or PDF, e.g.
+    curl --data-binary @pick.pdf -H 'Content-Type: application/pdf' http://printer:5001/api/v1/files/upload?crop=false
+    Query parameters: filename (its extension sets the type, otherwise Content-Type does), crop, width, height, dither, wait.
+    """
+    options = query_options(UPLOAD_SCHEMA)
+    filename = os.path.basename(options['filename'])
+    extension = os.path.splitext(filename)[1].lower() or CONTENT_TYPES.get(request.mimetype, '')
+    if extension not in FILE_TYPES:
+        raise ValidationError(f"Send a filename ending in one of {', '.join(FILE_TYPES)} or a Content-Type of {', '.join(CONTENT_TYPES)}")
+    filename = filename if filename.lower().endswith(extension) else f"upload{extension}"
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE:
+        return jsonify({'status': 'error', 'message': f"Upload exceeds {MAX_UPLOAD_SIZE // (1024 * 1024)} MB"}), 413
+    # Small bodies stay in memory; larger ones spill to a file in a job workspace that the render worker reads directly
+    with job_workspace(prefix="upload_") as workspace:
+        spool_path = os.path.join(workspace, filename)
+        buffer = io.BytesIO()
+        spool = None
+        size = 0
+        try:
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    return jsonify({'status': 'error', 'message': f"Upload exceeds {MAX_UPLOAD_SIZE // (1024 * 1024)} MB"}), 413
+                if spool is None and size > UPLOAD_SPOOL_SIZE:
+                    spool = open(spool_path, 'wb')
+                    spool.write(buffer.getvalue())
+                    buffer = None
+                (spool or buffer).write(chunk)
+        finally:
+            if spool is not None:
+                spool.close()
+        if not size:
+            raise ValidationError("Request body is empty")
+        logger.debug("Received upload %s, %s bytes%s", filename, size, ' (spooled to disk)' if spool is not None else '')
+        if spool is not None:
+            return submit_file(filename, options, file_path=spool_path)
+        return submit_file(filename, options, data=buffer.getvalue())
+
+def decode_errors():
+    """Exceptions that mean the file itself cannot be read, as opposed to the server failing to prepare it."""
+    from PIL import Image, UnidentifiedImageError
+    from PyPDF2.errors import PdfReadError
+    return (UnidentifiedImageError, Image.DecompressionBombError, PdfReadError)
+
+def submit_file(filename, options, data=None, file_path=None):
+    """Prepare an uploaded file in a render worker, from data or from file_path if it was spooled, and queue the prepared image for printing."""
+    prepare_options = {'crop': options['crop'], 'target_width': options['width'] or None,
+                       'target_height': options['height'] or None, 'dither': options['dither']}
+    try:
+        if file_path is not None:
+            img = render_pool.run(prepare_print_file, file_path, **prepare_options)
+        else:
+            img = render_pool.run(prepare_upload, filename, data, **prepare_options)
+    except decode_errors() as e:
+        logger.warning(f"Cannot read upload {filename}: {str(e)}")
+        raise ValidationError(f"Cannot read {filename}: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error preparing upload {filename}: {str(e)}")
+        return jsonify({'status': 'error', 'message': f"Cannot prepare {filename}: {str(e)}"}), 500
+    if img is None:
+        raise ValidationError("Unsupported file")
+    job = print_service.submit(print_prepared_image, img, filename, description=filename)
+    return job_response(job, options['wait'])
+
+@api.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': print_service.snapshot()})
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """State of a queued, running or recently finished job."""
+    entry = print_service.find(job_id)
+    if entry is not None:
+        return jsonify({key: entry[key] for key in ('job_id', 'description', 'stage', 'position')})
+    events = print_service.events_since(0, job_id, 0)
+    if not events:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    last = events[-1]
+    body = {'job_id': job_id, 'description': last['description'], 'stage': last['stage']}
+    for key in ('outcome', 'message'):
+        if key in last:
+            body[key] = last[key]
+    return jsonify(body)
+
+@api.route('/sequences', methods=['POST'])
+def start_sequence():
+    """
+    Print a numbered run, e.g. {"name": "assets", "format": "ASSET-{n:06d}", "start": 1, "count": 5000}.
+    layout is qr_text (QR code with the value below), qr, or text (the value as the first line of 'label',
+    a label payload as for POST /labels). {"name": "assets", "resume": true} continues a stored run after its
+    last printed value.
+    """
+    body = validate(json_payload(), SEQUENCE_SCHEMA)
+    if not re.match(r'^[a-zA-Z0-9\s_-]+$', body['name']):
+        raise ValidationError("name may only contain letters, digits, spaces, _ and -")
+    if body['resume']:
+        return jsonify(print_service.start_sequence(body['name'], None, True)), 202
+    if not body['count']:
+        raise ValidationError("count is required")
+    label, _ = label_params(body['label'])
+    spec = {key: body[key] for key in ('format', 'start', 'count', 'step', 'layout')}
+    spec['label'] = label
+    return jsonify(print_service.start_sequence(body['name'], spec)), 202
+
+@api.route('/sequences', methods=['GET'])
+def list_sequences():
+    return jsonify({'sequences': print_service.sequences()})
+
+@api.route('/sequences/<name>/cancel', methods=['POST'])
+def cancel_sequence(name):
+    """Stop a run once the labels already in the print queue have printed."""
+    return jsonify(print_service.cancel_sequence(name))
+
+@api.route('/logging', methods=['GET'])
+def get_log_levels():
+    """The default log level and the per-subsystem levels set on top of it."""
+    return jsonify({'default': LOG_LEVEL, 'levels': log_levels.get()})
+
+@api.route('/logging', methods=['PUT'])
+def put_log_levels():
+    """Change log levels in every process, e.g. {"levels": {"print_queue": "DEBUG", "device": null}}; null restores the default."""
+    changes = validate(json_payload(), {'levels': (dict, None, None)})['levels']
+    for subsystem, level in changes.items():
+        if not re.match(r'^[a-z_.]*$', subsystem):
+            raise ValidationError(f"levels: invalid subsystem {subsystem}")
+        if level is not None and level not in LEVELS:
+            raise ValidationError(f"levels.{subsystem} must be one of {', '.join(LEVELS)} or null")
+    return jsonify({'default': LOG_LEVEL, 'levels': set_levels(changes)})
+
+@api.route('/profiles', methods=['GET'])
+def get_profiles():
+    """Saved profiles of requests sent with an X-Profile header and of hot-folder files flagged "+prof"."""
+    return jsonify({'profiles': list_profiles()})
+
+@api.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """The functions a profile spent most samples in; ?limit= sets how many."""
+    profile = next((profile for profile in list_profiles() if profile['id'] == profile_id), None)
+    if profile is None:
+        return jsonify({'status': 'error', 'message': 'Unknown profile'}), 404
+    return jsonify(dict(profile, top=top_functions(profile_id, request.args.get('limit', 25, type=int))))
+
+@api.route('/profiles/<profile_id>/folded', methods=['GET'])
+def get_profile_folded(profile_id):
+    """The stacks of a profile as folded text, for flamegraph.pl or speedscope."""
+    stacks = folded_stacks(profile_id)
+    if stacks is None:
+        return jsonify({'status': 'error', 'message': 'Unknown profile'}), 404
+    return Response(stacks, mimetype='text/plain')
+
+@api.route('/backend', methods=['GET'])
+def get_backend():
+    """The printer backend in use; the simulator adds its counters, pending faults and last printed label."""
+    return jsonify(print_service.backend_status())
+
+@api.route('/backend/faults', methods=['POST'])
+def inject_backend_fault():
+    """Make the simulator fail its next print attempts, e.g. {"fault": "usb_reset", "count": 1}."""
+    body = validate(json_payload(), FAULT_SCHEMA)
+    try:
+        return jsonify(print_service.inject_fault(body['fault'], body['count']))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@api.route('/status', methods=['GET'])
+def printer_status():
+    snapshot, _ = print_service.status()
+    return jsonify(snapshot)
+
+def init_api(app):
+    app.register_blueprint(api)
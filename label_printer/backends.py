@@ -0,0 +1,50 @@
+import logging
+from label_printer.config import PRINTER_BACKEND, PRINTER_MODEL, PRINTER_LABEL, PRINTER_VENDOR_ID, PRINTER_PRODUCT_ID
+from label_printer.device import find_printer_device, query_printer_status
+from label_printer.utils import resolve_usb_conflicts
+
+logger = logging.getLogger(__name__)
+
+# A printer backend is what the print paths talk to:
+#   find_device()         the printer's device dict (see device.find_printer_device), or None when it is not connected
+#   print(image, red)     one print attempt of a file path or PNG bytes; returns a CompletedProcess whose stderr says
+#                         "Printing was successful", raises PrinterOffline or PrintError like printing.run_brother_ql
+#   query_status(timeout) the printer's status reply as brother_ql.reader.interpret_response returns it
+#   recover()             the next USB recovery step between attempts; True if one was performed
+#   describe()            a dict about the backend for /api/v1/backend
+#   inject_fault(fault, count)  make the next count attempts fail with fault; only the simulator can
+
+class BrotherQLBackend:
+    """The QL-810W on USB: presence from sysfs, status over pyusb, printing through the brother_ql command line tool."""
+
+    name = 'brother_ql'
+
+    def find_device(self):
+        return find_printer_device()
+
+    def print(self, image, red=False):
+        from label_printer.printing import run_brother_ql
+        return run_brother_ql(image, red=red)
+
+    def query_status(self, timeout=1.0):
+        return query_printer_status(timeout)
+
+    def recover(self):
+        return resolve_usb_conflicts()
+
+    def describe(self):
+        return {'backend': self.name, 'model': PRINTER_MODEL, 'label': PRINTER_LABEL, 'printer': f"usb://0x{PRINTER_VENDOR_ID}:0x{PRINTER_PRODUCT_ID}"}
+
+    def inject_fault(self, fault, count=1):
+        raise ValueError("Faults can only be injected into the simulator backend")
+
+def create_backend(name=PRINTER_BACKEND):
+    if name == 'simulator':
+        from label_printer.simulator import PrinterSimulator
+        logger.warning("Printing to the printer simulator, not the USB printer")
+        return PrinterSimulator()
+    if name != 'brother_ql':
+        logger.error(f"Unknown printer backend {name}, using brother_ql")
+    return BrotherQLBackend()
+
+printer_backend = create_backend()
@@ -0,0 +1,338 @@
+import functools
+import logging
+from label_printer.metrics import counted_cache
+from label_printer.qr import qr_matrix, matrix_image
+
+logger = logging.getLogger(__name__)
+
+SYMBOLOGIES = ('code128', 'ean13', 'datamatrix', 'qr')
+BARCODE_CACHE_SIZE = 1024
+QUIET_ZONE = {'code128': (10, 10), 'ean13': (11, 7), 'datamatrix': 1, 'qr': 4}  # Modules of white around the symbol
+
+class BarcodeError(ValueError):
+    """Data that the symbology cannot encode."""
+
+# Code 128: bar and space widths of symbol values 0-106 (103-105 are Start A/B/C, 106 is Stop)
+CODE128_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+)
+CODE128_START = {'A': 103, 'B': 104, 'C': 105}
+CODE128_SWITCH = {'A': 101, 'B': 100, 'C': 99}  # Code A/B/C symbol values, the same in every set that has them
+CODE128_STOP = 106
+
+# EAN-13: left-hand odd parity (L) digit patterns; G is R reversed, R is L inverted
+EAN_L = ("0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011")
+EAN_R = tuple("".join("1" if bit == "0" else "0" for bit in code) for code in EAN_L)
+EAN_G = tuple(code[::-1] for code in EAN_R)
+EAN_PARITY = ("LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL")
+
+# Data Matrix ECC 200 square symbols: (size, data region size, regions per side, data codewords, error codewords)
+DATAMATRIX_SIZES = (
+    (10, 8, 1, 3, 5), (12, 10, 1, 5, 7), (14, 12, 1, 8, 10), (16, 14, 1, 12, 12), (18, 16, 1, 18, 14),
+    (20, 18, 1, 22, 18), (22, 20, 1, 30, 20), (24, 22, 1, 36, 24), (26, 24, 1, 44, 28), (32, 14, 2, 62, 36),
+    (36, 16, 2, 86, 42), (40, 18, 2, 114, 48), (44, 20, 2, 144, 56), (48, 22, 2, 174, 68),
+)
+
+def code128_set_for(char):
+    return 'A' if ord(char) < 32 else 'B'
+
+def digit_run(data, index):
+    run = 0
+    while index + run < len(data) and data[index + run].isdigit():
+        run += 1
+    return run
+
+@counted_cache('barcode', maxsize=BARCODE_CACHE_SIZE)
+def encode_code128(data):
+    """
+    Code 128 symbol values for data, start to check character. Digit runs go in code set C two at a time
+    (4 or more digits at either end, 6 or more in between); everything else in set B, or A for control characters.
+    """
+    if not data or any(ord(char) > 127 for char in data):
+        raise BarcodeError("Code 128 takes 1 or more ASCII characters")
+    values = []
+    code_set = None
+    index = 0
+    while index < len(data):
+        run = digit_run(data, index)
+        at_edge = index == 0 or index + run == len(data)
+        if code_set != 'C' and run >= (4 if at_edge else 6):
+            if run % 2:
+                # Odd run: the first digit goes in the current set (or B at the start), the rest as pairs
+                if code_set is None:
+                    code_set = 'B'
+                    values.append(CODE128_START['B'])
+                values.append(ord(data[index]) - 32)
+                index += 1
+            values.append(CODE128_START['C'] if code_set is None else CODE128_SWITCH['C'])
+            code_set = 'C'
+        if code_set == 'C':
+            if run >= 2:
+                values.append(int(data[index:index + 2]))
+                index += 2
+                continue
+            code_set_next = code128_set_for(data[index])
+            values.append(CODE128_SWITCH[code_set_next])
+            code_set = code_set_next
+        char = data[index]
+        if code_set is None:
+            wanted = code128_set_for(char)
+        elif ord(char) < 32 and code_set != 'A':
+            wanted = 'A'
+        elif char >= '`' and code_set == 'A':
+            wanted = 'B'  # Lower case is only in set B
+        else:
+            wanted = code_set
+        if wanted != code_set:
+            values.append(CODE128_START[wanted] if code_set is None else CODE128_SWITCH[wanted])
+            code_set = wanted
+        values.append(ord(char) + 64 if ord(char) < 32 else ord(char) - 32)
+        index += 1
+    checksum = (values[0] + sum(position * value for position, value in enumerate(values[1:], 1))) % 103
+    return tuple(values + [checksum])
+
+def ean13_digits(data):
+    """The 13 digits of an EAN-13 from 12 digits (check digit added) or 13 (check digit verified)."""
+    if not data.isdigit() or len(data) not in (12, 13):
+        raise BarcodeError("EAN-13 takes 12 digits, or 13 with the check digit")
+    check = (10 - sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(data[:12])) % 10) % 10
+    if len(data) == 13 and int(data[12]) != check:
+        raise BarcodeError(f"EAN-13 check digit should be {check}")
+    return data[:12] + str(check)
+
+@counted_cache('barcode', maxsize=BARCODE_CACHE_SIZE)
+def encode_linear(symbology, data):
+    """Modules of a linear barcode, without quiet zone, as a tuple of booleans (True is a bar)."""
+    if symbology == 'code128':
+        widths = "".join(CODE128_PATTERNS[value] for value in encode_code128(data)) + CODE128_PATTERNS[CODE128_STOP]
+        modules = []
+        for position, width in enumerate(widths):
+            modules += [position % 2 == 0] * int(width)
+        return tuple(modules)
+    if symbology == 'ean13':
+        digits = ean13_digits(data)
+        parity = EAN_PARITY[int(digits[0])]
+        bits = "101"
+        for digit, side in zip(digits[1:7], parity):
+            bits += (EAN_L if side == 'L' else EAN_G)[int(digit)]
+        bits += "01010"
+        for digit in digits[7:]:
+            bits += EAN_R[int(digit)]
+        bits += "101"
+        return tuple(bit == "1" for bit in bits)
+    raise BarcodeError(f"Not a linear symbology: {symbology}")
+
+# Reed-Solomon over GF(256) with the Data Matrix polynomial x^8 + x^5 + x^3 + x^2 + 1
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    GF_EXP[_power] = _value
+    GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x12D
+for _power in range(255, 512):
+    GF_EXP[_power] = GF_EXP[_power - 255]
+
+def gf_multiply(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+@functools.lru_cache(maxsize=None)
+def rs_generator(count):
+    """Coefficients of (x - a^1)(x - a^2)...(x - a^count), highest power first."""
+    generator = [1]
+    for power in range(1, count + 1):
+        generator = [a ^ gf_multiply(b, GF_EXP[power]) for a, b in zip(generator + [0], [0] + generator)]
+    return tuple(generator)
+
+def rs_encode(data, count):
+    generator = rs_generator(count)
+    remainder = [0] * count
+    for codeword in data:
+        factor = codeword ^ remainder[0]
+        remainder = remainder[1:] + [0]
+        for index in range(count):
+            remainder[index] ^= gf_multiply(generator[index + 1], factor)
+    return remainder
+
+def datamatrix_codewords(data):
+    """ASCII-mode data codewords: digit pairs packed into one codeword, bytes above 127 behind an Upper Shift."""
+    try:
+        raw = data.encode('latin-1') if isinstance(data, str) else data
+    except UnicodeEncodeError:
+        raise BarcodeError("Data Matrix ASCII mode only encodes Latin-1 text")
+    codewords = []
+    index = 0
+    while index < len(raw):
+        if index + 1 < len(raw) and chr(raw[index]).isdigit() and chr(raw[index + 1]).isdigit():
+            codewords.append(130 + int(raw[index:index + 2]))
+            index += 2
+            continue
+        if raw[index] > 127:
+            codewords += [235, raw[index] - 127]
+        else:
+            codewords.append(raw[index] + 1)
+        index += 1
+    return codewords
+
+def datamatrix_placement(nrow, ncol):
+    """ECC 200 module placement: for every module of the mapping matrix, 10 * codeword number + bit (1 is the MSB), or 1/0 for the fixed corner."""
+    array = [[0] * ncol for _ in range(nrow)]
+
+    def module(row, col, chr_, bit):
+        if row < 0:
+            row += nrow
+            col += 4 - ((nrow + 4) % 8)
+        if col < 0:
+            col += ncol
+            row += 4 - ((ncol + 4) % 8)
+        array[row][col] = 10 * chr_ + bit
+
+    def place(chr_, positions):
+        for bit, (row, col) in enumerate(positions, 1):
+            module(row, col, chr_, bit)
+
+    def utah(row, col, chr_):
+        place(chr_, [(row - 2, col - 2), (row - 2, col - 1), (row - 1, col - 2), (row - 1, col - 1),
+                     (row - 1, col), (row, col - 2), (row, col - 1), (row, col)])
+
+    corners = {
+        1: lambda: [(nrow - 1, 0), (nrow - 1, 1), (nrow - 1, 2), (0, ncol - 2), (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)],
+        2: lambda: [(nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 4), (0, ncol - 3), (0, ncol - 2), (0, ncol - 1), (1, ncol - 1)],
+        3: lambda: [(nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 2), (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)],
+        4: lambda: [(nrow - 1, 0), (nrow - 1, ncol - 1), (0, ncol - 3), (0, ncol - 2), (0, ncol - 1), (1, ncol - 3), (1, ncol - 2), (1, ncol - 1)],
+    }
+    chr_, row, col = 1, 4, 0
+    while True:
+        for corner, condition in ((1, row == nrow and col == 0),
+                                  (2, row == nrow - 2 and col == 0 and ncol % 4),
+                                  (3, row == nrow - 2 and col == 0 and ncol % 8 == 4),
+                                  (4, row == nrow + 4 and col == 2 and not ncol % 8)):
+            if condition:
+                place(chr_, corners[corner]())
+                chr_ += 1
+        # Sweep up and to the right, then down and to the left
+        while True:
+            if row < nrow and col >= 0 and not array[row][col]:
+                utah(row, col, chr_)
+                chr_ += 1
+            row -= 2
+            col += 2
+            if not (row >= 0 and col < ncol):
+                break
+        row += 1
+        col += 3
+        while True:
+            if row >= 0 and col < ncol and not array[row][col]:
+                utah(row, col, chr_)
+                chr_ += 1
+            row += 2
+            col -= 2
+            if not (row < nrow and col >= 0):
+                break
+        row += 3
+        col += 1
+        if not (row < nrow or col < ncol):
+            break
+    if not array[nrow - 1][ncol - 1]:
+        array[nrow - 1][ncol - 1] = array[nrow - 2][ncol - 2] = 1
+    return array
+
+@counted_cache('barcode', maxsize=BARCODE_CACHE_SIZE)
+def encode_datamatrix(data):
+    """Module matrix of the smallest square ECC 200 Data Matrix holding data, without quiet zone, as rows of booleans."""
+    codewords = datamatrix_codewords(data)
+    for size, region, regions, data_count, error_count in DATAMATRIX_SIZES:
+        if len(codewords) <= data_count:
+            break
+    else:
+        raise BarcodeError(f"Too much data for a Data Matrix symbol ({len(codewords)} codewords, at most {DATAMATRIX_SIZES[-1][3]})")
+    # Pad: 129 first, then pseudo-random pad values so long runs don't form patterns
+    if len(codewords) < data_count:
+        codewords.append(129)
+    while len(codewords) < data_count:
+        pad = 129 + (149 * (len(codewords) + 1)) % 253 + 1
+        codewords.append(pad - 254 if pad > 254 else pad)
+    codewords += rs_encode(codewords, error_count)
+
+    mapping_size = region * regions
+    placement = datamatrix_placement(mapping_size, mapping_size)
+    matrix = [[False] * size for _ in range(size)]
+    block = region + 2
+    # Finder and clock pattern around every data region: solid left and bottom, alternating top and right
+    for top in range(0, size, block):
+        for left in range(0, size, block):
+            for offset in range(block):
+                matrix[top + block - 1][left + offset] = True
+                matrix[top + offset][left] = True
+                matrix[top][left + offset] = offset % 2 == 0
+                matrix[top + offset][left + block - 1] = offset % 2 == 1
+    for row in range(mapping_size):
+        for col in range(mapping_size):
+            value = placement[row][col]
+            dark = value == 1 if value < 10 else bool(codewords[value // 10 - 1] & (1 << (8 - value % 10)))
+            matrix[row + 2 * (row // region) + 1][col + 2 * (col // region) + 1] = dark
+    logger.debug("Encoded Data Matrix %sx%s, %s data codewords", size, size, data_count)
+    return tuple(tuple(row) for row in matrix)
+
+def encode(symbology, data):
+    """The cached modules of a barcode: a tuple of booleans for linear symbologies, rows of them for 2D ones. Raises BarcodeError."""
+    if symbology == 'qr':
+        return qr_matrix(data)
+    if symbology == 'datamatrix':
+        return encode_datamatrix(data)
+    if symbology in ('code128', 'ean13'):
+        return encode_linear(symbology, data)
+    raise BarcodeError(f"Unknown symbology {symbology}; use one of {', '.join(SYMBOLOGIES)}")
+
+def barcode_image(symbology, data, width=None, height=None, module_size=None, max_module_size=None):
+    """
+    1-bit image of a barcode with its quiet zone, every module an exact square (2D) or bar (linear) of
+    module_size pixels. Without module_size, the largest that fits width (and for 2D codes height), capped at
+    max_module_size. Linear barcodes are height pixels tall.
+    """
+    from PIL import Image, ImageDraw
+    modules = encode(symbology, data)
+    if symbology in ('code128', 'ean13'):
+        left, right = QUIET_ZONE[symbology]
+        total = left + len(modules) + right
+        if module_size is None:
+            module_size = max(1, (width or total) // total)
+        if max_module_size:
+            module_size = min(module_size, max_module_size)
+        image = Image.new("1", (total * module_size, height or 50 * module_size), 1)
+        draw = ImageDraw.Draw(image)
+        position = 0
+        while position < len(modules):
+            if not modules[position]:
+                position += 1
+                continue
+            end = position
+            while end < len(modules) and modules[end]:
+                end += 1
+            x = (left + position) * module_size
+            draw.rectangle([x, 0, (left + end) * module_size - 1, image.height - 1], fill=0)
+            position = end
+        return image
+
+    border = QUIET_ZONE[symbology]
+    total = len(modules) + 2 * border
+    if module_size is None:
+        fit = min(size for size in (width, height) if size) if (width or height) else total
+        module_size = max(1, fit // total)
+    if max_module_size:
+        module_size = min(module_size, max_module_size)
+    return matrix_image(modules, border, module_size)
@@ -2,11 +2,58 @@ import os
 import logging
 
 HISTORY_FILE = os.path.expanduser("~/label_printer_web/label_history.json")
+# Files every process watches for changes (see label_printer.settings). They get a directory of their own,
+# so writes to the log and the history don't wake the watchers.
+CONFIG_DIR = os.path.expanduser("~/label_printer_web/config")
+# Saved label defaults (length_mm, orientation, tape_type); see label_printer.settings
+SETTINGS_FILE = os.path.join(CONFIG_DIR, "settings.txt")
+# Where older versions kept it; moved into CONFIG_DIR on startup
+LEGACY_SETTINGS_FILE = os.path.expanduser("~/label_printer_web/settings.txt")
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
+# Every module logs to its own logger under "label_printer"; see label_printer.logs
 logger = logging.getLogger(__name__)
+LOG_FILE = os.path.expanduser("~/label_printer_web/app.log")
+LOG_LEVEL = os.environ.get("LABEL_PRINTER_LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+# Per-subsystem levels, e.g. {"print_queue": "DEBUG"}, changed at runtime through /api/v1/logging
+LOG_LEVELS_FILE = os.path.join(CONFIG_DIR, "log_levels.json")
+LEGACY_LOG_LEVELS_FILE = os.path.expanduser("~/label_printer_web/log_levels.json")
 
 #FONT_DIR = "/usr/share/fonts/truetype/"
 FONT_DIR = "/home/odroid/label_printer_web/static/fonts/"
 
+# Brother QL-810W USB identifiers
+PRINTER_VENDOR_ID = "04f9"
+PRINTER_PRODUCT_ID = "209c"
+PRINTER_MODEL = "QL-810W"
+PRINTER_LABEL = "62"  # 62mm continuous tape
+BROTHER_QL_PATH = os.path.expanduser("~/.local/bin/brother_ql")
+
+# "brother_ql" prints on the USB printer; "simulator" prints into SIMULATOR_DIR instead (see label_printer.backends)
+PRINTER_BACKEND = os.environ.get("LABEL_PRINTER_BACKEND", "brother_ql")
+SIMULATOR_DIR = os.path.expanduser("~/label_printer_web/simulator")
+SIMULATOR_KEEP = 200  # Printed labels kept in SIMULATOR_DIR
+# Simulated time runs this many times faster than a real printer; 0 prints instantly
+SIMULATOR_SPEED = float(os.environ.get("LABEL_PRINTER_SIMULATOR_SPEED", 1))
+# Random faults per print attempt, e.g. "busy=0.05,usb_reset=0.01,media_missing=0.01"
+SIMULATOR_FAULTS = os.environ.get("LABEL_PRINTER_SIMULATOR_FAULTS", "")
+
+# Render worker processes for labels, QR codes and print files; 0 renders in the calling thread
+RENDER_WORKERS = int(os.environ.get("LABEL_PRINTER_RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_TIMEOUT = 120  # Seconds a single render may take
+
+# Per-job scratch directories go on tmpfs when there is one
+WORKSPACE_ROOT = "/dev/shm/label_printer" if os.path.isdir("/dev/shm") else "/tmp/label_printer"
+# Set to a directory to keep intermediate images (raw QR code, cropped print files) for debugging
+DEBUG_IMAGE_DIR = os.environ.get("LABEL_PRINTER_DEBUG_IMAGES")
+
+# Under the WSGI front end, web workers reach the process that owns the printer over this socket
+SERVICE_ADDRESS = os.environ.get("LABEL_PRINTER_SERVICE_SOCKET", os.path.join(WORKSPACE_ROOT, "service.sock"))
+SERVICE_KEY_FILE = os.path.expanduser("~/label_printer_web/.service_key")
+# Numbered label runs (asset tags) and the last value printed of each, for resuming
+SEQUENCE_FILE = os.path.expanduser("~/label_printer_web/sequences.json")
+# Opt-in profiles of single requests (X-Profile header) and hot-folder files ("+prof" in the name); see label_printer.profiling
+PROFILE_DIR = os.path.expanduser("~/label_printer_web/profiles")
+PROFILE_INTERVAL = 0.001  # Seconds between stack samples
+PROFILE_KEEP = 200  # Profile parts kept in PROFILE_DIR, oldest removed first
@@ -0,0 +1,162 @@
+import logging
+import os
+import socket
+import threading
+import time
+from label_printer.config import PRINTER_VENDOR_ID, PRINTER_PRODUCT_ID
+
+logger = logging.getLogger(__name__)
+
+SYSFS_USB_DEVICES = "/sys/bus/usb/devices"
+NETLINK_KOBJECT_UEVENT = 15
+POLL_INTERVAL = 2  # Seconds between sysfs checks when hotplug events are unavailable
+RESCAN_INTERVAL = 30  # Safety rescan even when hotplug events are available
+STATUS_REQUEST = b"\x00" * 200 + b"\x1b\x40" + b"\x1b\x69\x53"  # Invalidate, initialize, status information request
+
+class PrinterOffline(Exception):
+    """Raised by print paths when the printer is not connected, so the job can wait for it."""
+
+def read_sysfs_attr(device_dir, name):
+    try:
+        with open(os.path.join(device_dir, name), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def find_printer_device(vendor_id=PRINTER_VENDOR_ID, product_id=PRINTER_PRODUCT_ID):
+    """
+    Find the printer in sysfs without spawning lsusb.
+    Returns a dict with sysfs_path, busnum, devnum and dev_path (/dev/bus/usb/BBB/DDD), or None.
+    """
+    try:
+        names = os.listdir(SYSFS_USB_DEVICES)
+    except OSError as e:
+        logger.error(f"Cannot list {SYSFS_USB_DEVICES}: {str(e)}")
+        return None
+    for name in names:
+        if ":" in name:  # Interface entries, not devices
+            continue
+        device_dir = os.path.join(SYSFS_USB_DEVICES, name)
+        if read_sysfs_attr(device_dir, "idVendor") != vendor_id or read_sysfs_attr(device_dir, "idProduct") != product_id:
+            continue
+        busnum = int(read_sysfs_attr(device_dir, "busnum") or 0)
+        devnum = int(read_sysfs_attr(device_dir, "devnum") or 0)
+        return {
+            'sysfs_path': os.path.realpath(device_dir),
+            'busnum': busnum,
+            'devnum': devnum,
+            'dev_path': f"/dev/bus/usb/{busnum:03d}/{devnum:03d}"
+        }
+    return None
+
+def find_device():
+    """The printer as the configured backend sees it (see label_printer.backends), or None when it is not connected."""
+    from label_printer.backends import printer_backend
+    return printer_backend.find_device()
+
+def printer_present():
+    return find_device() is not None
+
+def query_printer_status(timeout=1.0):
+    """
+    Ask the printer for its 32-byte status reply over USB.
+    Returns brother_ql's interpreted response: status_type, phase_type, media_type, media_width, media_length, errors.
+    Must not be called while a print is running.
+    """
+    from brother_ql.backends.pyusb import BrotherQLBackendPyUSB
+    from brother_ql.reader import interpret_response
+    backend = BrotherQLBackendPyUSB(f"usb://0x{PRINTER_VENDOR_ID}:0x{PRINTER_PRODUCT_ID}")
+    try:
+        backend.write(STATUS_REQUEST)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = backend.read()
+            if data and len(data) >= 32:
+                return interpret_response(data)
+            time.sleep(0.01)
+        raise TimeoutError("No status reply from printer")
+    finally:
+        backend.dispose()
+
+class PrinterMonitor:
+    """
+    Track printer presence from kernel USB hotplug events (netlink uevents),
+    falling back to a cheap sysfs poll where the netlink socket is unavailable.
+    """
+
+    def __init__(self):
+        self.online = threading.Event()
+        self.device = None
+        self.present = None  # Unknown until the first refresh
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.refresh()
+            self.thread = threading.Thread(target=self.run, name="printer-monitor", daemon=True)
+            self.thread.start()
+
+    def add_callback(self, callback):
+        """Register callback(present, device), called whenever presence changes."""
+        self.callbacks.append(callback)
+
+    def is_present(self):
+        self.start()
+        return self.online.is_set()
+
+    def wait_until_present(self, timeout=None):
+        self.start()
+        return self.online.wait(timeout)
+
+    def refresh(self):
+        device = find_device()
+        self.device = device
+        if device:
+            self.online.set()
+        else:
+            self.online.clear()
+        if bool(device) != self.present:
+            self.present = bool(device)
+            logger.info("Printer %s", 'connected at ' + device['dev_path'] if device else 'disconnected')
+            for callback in self.callbacks:
+                try:
+                    callback(bool(device), device)
+                except Exception as e:
+                    logger.error(f"Printer presence callback failed: {str(e)}")
+
+    def run(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))  # Kernel uevent multicast group
+            sock.settimeout(RESCAN_INTERVAL)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"USB hotplug events unavailable ({str(e)}), polling sysfs every {POLL_INTERVAL}s")
+            self.poll()
+            return
+        logger.debug("Listening for USB hotplug events")
+        while True:
+            try:
+                message = sock.recv(8192)
+            except socket.timeout:
+                self.refresh()
+                continue
+            except OSError as e:
+                logger.warning(f"USB hotplug socket failed ({str(e)}), polling sysfs every {POLL_INTERVAL}s")
+                sock.close()
+                self.poll()
+                return
+            fields = message.split(b"\0")
+            if b"SUBSYSTEM=usb" in fields and b"DEVTYPE=usb_device" in fields:
+                logger.debug("USB hotplug event: %s", fields[0].decode(errors='replace'))
+                self.refresh()
+
+    def poll(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            self.refresh()
+
+printer_monitor = PrinterMonitor()
@@ -1,14 +1,19 @@
 import glob
+import logging
 import os
-from PIL import ImageFont
-from label_printer.config import FONT_DIR, logger
+import threading
+from label_printer.config import FONT_DIR
+from label_printer.metrics import counted_cache
+
+logger = logging.getLogger(__name__)
 
 def scan_fonts():
-    logger.debug(f"Scanning fonts in directory: {FONT_DIR}")
+    from PIL import ImageFont
+    logger.debug("Scanning fonts in directory: %s", FONT_DIR)
     font_files = glob.glob(os.path.join(FONT_DIR, "**/*.ttf"), recursive=True)
     font_families = {}
     for font_path in font_files:
-        logger.debug(f"Found font file: {font_path}")
+        logger.debug("Found font file: %s", font_path)
         try:
             ImageFont.truetype(font_path, size=10)
             font_name = os.path.basename(font_path).replace('.ttf', '')
@@ -16,18 +21,33 @@ def scan_fonts():
             if family not in font_families:
                 font_families[family] = []
             font_families[family].append(font_path)
-            logger.debug(f"Added font: {font_name} (family: {family})")
+            logger.debug("Added font: %s (family: %s)", font_name, family)
         except Exception as e:
             logger.warning(f"Skipping font {font_path}: {str(e)}")
             continue
-    logger.debug(f"Usable font families: {sorted(font_families.keys())}")
+    logger.debug("Usable font families: %s", sorted(font_families.keys()))
     return font_families
 
-font_families = scan_fonts()
+# Filled in place by load_font_families(), so modules that imported it see the scan once it is done
+font_families = {}
+font_scan_lock = threading.Lock()
+fonts_scanned = threading.Event()
+
+def load_font_families():
+    """Scan FONT_DIR on first use, from a startup job or whichever caller needs the fonts first; returns font_families."""
+    with font_scan_lock:
+        if not fonts_scanned.is_set():
+            font_families.update(scan_fonts())
+            fonts_scanned.set()
+    return font_families
+
+def font_family_names():
+    return sorted(load_font_families().keys())
 
 def get_font_path(family, bold, italic):
+    load_font_families()
     if family not in font_families:
-        logger.debug(f"Font family {family} not found, using DejaVuSans.ttf")
+        logger.debug("Font family %s not found, using DejaVuSans.ttf", family)
         return "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
 
     styles = []
@@ -44,8 +64,14 @@ def get_font_path(family, bold, italic):
     plain_font = f"{family}.ttf"
     for path in font_families[family]:
         if plain_font in path:
-            logger.debug(f"Style {style_suffix} not found for {family}, using {plain_font}")
+            logger.debug("Style %s not found for %s, using %s", style_suffix, family, plain_font)
             return path
 
-    logger.debug(f"No matching style for {family}, using first available font")
+    logger.debug("No matching style for %s, using first available font", family)
     return font_families[family][0]
+
+@counted_cache('font', maxsize=256)
+def load_font(font_path, size):
+    """Parsed font for font_path at size, cached; parsing a TTF costs more than drawing a label."""
+    from PIL import ImageFont
+    return ImageFont.truetype(font_path, size)
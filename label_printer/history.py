@@ -1,7 +1,14 @@
 import json
 import os  # Add this import
+import fcntl
+import threading
 from label_printer.config import HISTORY_FILE
 
+# Request threads, and the worker processes of the WSGI front end, append concurrently;
+# the read-modify-write below must not interleave
+history_lock = threading.Lock()
+HISTORY_LOCK_FILE = HISTORY_FILE + ".lock"
+
 def load_history():
     if not os.path.exists(HISTORY_FILE):
         # Create an empty history file if it doesn’t exist
@@ -11,10 +18,14 @@ def load_history():
         return json.load(f)
 
 def save_history(entry):
-    history = load_history()
-    history.append(entry)
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f)
+    with history_lock, open(HISTORY_LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        history = load_history()
+        history.append(entry)
+        # Readers don't take the lock, so they must never see a half-written file
+        with open(f"{HISTORY_FILE}.tmp", 'w') as f:
+            json.dump(history, f)
+        os.replace(f"{HISTORY_FILE}.tmp", HISTORY_FILE)
 
 def ensure_history_file():
     if not os.path.exists(HISTORY_FILE):
@@ -1,11 +1,32 @@
-from PIL import Image, ImageDraw, ImageFont
+import logging
+from PIL import Image, ImageDraw
 import io
 import base64
-import qrcode
-from label_printer.fonts import get_font_path
-from label_printer.config import logger
+from label_printer.fonts import get_font_path, load_font
+from label_printer.workspace import save_debug_image
+from label_printer.qr import qr_image
+from label_printer.barcode import barcode_image
+from label_printer.metrics import span, StageTimer
 
-def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1='left', justify2='left', justify3='left', spacing1=10, spacing2=10):
+logger = logging.getLogger(__name__)
+
+BARCODE_HEIGHT = 100  # Pixels across the tape given to a barcode below the text
+BARCODE_MAX_MODULE = 6  # Widest module, in pixels, a label barcode is scaled up to
+
+def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1='left', justify2='left', justify3='left', spacing1=10, spacing2=10, barcode_type='', barcode_data='', barcode_height=BARCODE_HEIGHT):
+    """Render a label and return it as a base64-encoded PNG."""
+    image = render_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1, justify2, justify3, spacing1, spacing2, barcode_type, barcode_data, barcode_height)
+    return base64.b64encode(image_to_png(image)).decode('utf-8')
+
+def image_to_png(image):
+    buffered = io.BytesIO()
+    with span('png_encode'):
+        image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def render_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1='left', justify2='left', justify3='left', spacing1=10, spacing2=10, barcode_type='', barcode_data='', barcode_height=BARCODE_HEIGHT):
+    """Render a label as a PIL image: three text sections, then an optional barcode (see label_printer.barcode) centred below them."""
+    timer = StageTimer()
     width_px = 696  # 62mm at 300 DPI
     length_px = max(int(length_mm * 11.811) - 83, 1)  # Subtract ~7mm (~83px) padding
 
@@ -22,7 +43,8 @@ def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, fa
     fonts = []
     for face, bold, italic, size in [(face1, bold1, italic1, size1), (face2, bold2, italic2, size2), (face3, bold3, italic3, size3)]:
         font_path = get_font_path(face, bold, italic)
-        fonts.append(ImageFont.truetype(font_path, size))
+        fonts.append(load_font(font_path, size))
+    timer.lap('fonts')
 
     lines = [
         (text1.splitlines(), fonts[0], bg1, underline1, justify1),
@@ -85,7 +107,7 @@ def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, fa
             line_width = sum(draw.textbbox((0, 0), part[0], font=font)[2] - draw.textbbox((0, 0), part[0], font=font)[0] for part in parts if part[0])
             if line_width > img_width:
                 scale_factor = img_width / line_width
-                scaled_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", int(font.size * scale_factor))
+                scaled_font = load_font("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", int(font.size * scale_factor))
             else:
                 scaled_font = font
 
@@ -110,6 +132,13 @@ def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, fa
         if section_index < 2:  # Only increment y_offset if not the last section
             y_offset += spacings[section_index]
             section_index += 1
+    timer.lap('layout')
+
+    if barcode_type and barcode_data:
+        # Drawn at printer resolution with whole-pixel modules; rotating the label by 90 degrees keeps them exact
+        code = barcode_image(barcode_type, barcode_data, width=img_width, height=int(barcode_height), max_module_size=BARCODE_MAX_MODULE)
+        image.paste(code.convert("RGB"), ((img_width - code.width) // 2, start_y + y_offset))
+        timer.lap('barcode')
 
     bbox = image.getbbox()
     if bbox:
@@ -119,20 +148,60 @@ def generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, fa
 
     if orientation == "rotated":
         image = image.rotate(90, expand=True)
+    timer.lap('crop_rotate')
 
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-    return img_str
-
-def generate_qr_code_image(url, box_size=10):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=box_size,
-        border=0,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    return qr_img
+    return image
+
+QR_LABEL_SIZE = 150  # Pixels of tape height given to the code
+
+def render_qr_label(url, exclude_text=False):
+    """Render a QR code label: a code of up to 150px centred on the tape, with the text below unless exclude_text."""
+    with span('qr'):
+        qr_img = qr_image(url, size=QR_LABEL_SIZE)
+    logger.debug("QR code size: %sx%spx", qr_img.width, qr_img.height)
+
+    save_debug_image(qr_img, "raw_qr")
+
+    # Codes too dense for 150px at one pixel per module get the room they need
+    qr_area = max(QR_LABEL_SIZE, qr_img.height)
+    canvas_width = 696
+    canvas_height = qr_area if exclude_text else qr_area + 30
+    padded_img = Image.new("RGB", (canvas_width, canvas_height), "white")
+    draw = ImageDraw.Draw(padded_img)
+
+    paste_x = (canvas_width - qr_img.width) // 2
+    paste_y = (qr_area - qr_img.height) // 2
+    padded_img.paste(qr_img, (paste_x, paste_y))
+
+    if not exclude_text:
+        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+        font_size = 20
+        font = load_font(font_path, font_size)
+        text_bbox = draw.textbbox((0, 0), url, font=font)
+        text_width = text_bbox[2] - text_bbox[0]
+        text_x = (canvas_width - text_width) // 2
+        text_y = qr_area
+        draw.text((text_x, text_y), url, font=font, fill="black")
+
+    save_debug_image(padded_img, "test_qr")
+
+    return padded_img
+
+BARCODE_LABEL_HEIGHT = 150  # Pixels of tape height given to a stand-alone barcode
+
+def render_barcode_label(symbology, data, exclude_text=False):
+    """Render a barcode label: the code as wide as fits the tape at whole-pixel modules, with the data below unless exclude_text."""
+    with span('barcode'):
+        code = barcode_image(symbology, data, width=696, height=BARCODE_LABEL_HEIGHT, max_module_size=BARCODE_MAX_MODULE)
+    logger.debug("%s barcode size: %sx%spx", symbology, code.width, code.height)
+    canvas_width = max(696, code.width)
+    canvas_height = code.height if exclude_text else code.height + 30
+    label = Image.new("RGB", (canvas_width, canvas_height), "white")
+    label.paste(code.convert("RGB"), ((canvas_width - code.width) // 2, 0))
+    if not exclude_text:
+        draw = ImageDraw.Draw(label)
+        font = load_font("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
+        text_bbox = draw.textbbox((0, 0), data, font=font)
+        draw.text(((canvas_width - (text_bbox[2] - text_bbox[0])) // 2, code.height), data, font=font, fill="black")
+    save_debug_image(label, "barcode")
+    return label
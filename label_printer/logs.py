@@ -0,0 +1,111 @@
+import atexit
+import fcntl
+import logging
+import logging.handlers
+import os
+import queue
+from label_printer.config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUPS, LOG_LEVELS_FILE, LEGACY_LOG_LEVELS_FILE
+from label_printer.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+ROOT_LOGGER = "label_printer"
+
+# {subsystem: level} shared by every process through LOG_LEVELS_FILE
+log_levels = Settings(LOG_LEVELS_FILE, legacy_path=LEGACY_LOG_LEVELS_FILE)
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler for a log that several processes append to (the web workers and the print
+    service). Rotation happens under a lock file, and a handler whose file another process has
+    rotated away reopens the new one instead of writing to the old.
+    """
+
+    def shouldRollover(self, record):
+        self.reopen_if_moved()
+        return super().shouldRollover(record)
+
+    def reopen_if_moved(self):
+        if self.stream is None:
+            return
+        try:
+            st = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            st = None
+        current = os.fstat(self.stream.fileno())
+        if st is None or (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+    def doRollover(self):
+        with open(f"{self.baseFilename}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited for the lock
+            try:
+                size = os.path.getsize(self.baseFilename)
+            except FileNotFoundError:
+                size = 0
+            if size >= self.maxBytes:
+                super().doRollover()
+            else:
+                self.reopen_if_moved()
+
+def logger_name(subsystem):
+    """Logger of a subsystem: "print_queue" is label_printer.print_queue, "" is all of label_printer."""
+    if not subsystem or subsystem == ROOT_LOGGER:
+        return ROOT_LOGGER
+    return subsystem if subsystem.startswith(ROOT_LOGGER + ".") else f"{ROOT_LOGGER}.{subsystem}"
+
+applied_levels = set()
+
+def apply_levels(levels):
+    """Set the level of every subsystem in levels; subsystems no longer listed go back to the default."""
+    names = {logger_name(subsystem): level for subsystem, level in levels.items() if level in LEVELS}
+    for name in applied_levels - set(names):
+        logging.getLogger(name).setLevel(LOG_LEVEL if name == ROOT_LOGGER else logging.NOTSET)
+    for name, level in names.items():
+        logging.getLogger(name).setLevel(level)
+    applied_levels.clear()
+    applied_levels.update(names)
+
+def setup_logging():
+    """
+    Log label_printer records through a queue: the calling thread only formats records that pass the
+    level check and enqueues them, and a background thread writes LOG_FILE (rotated at LOG_MAX_BYTES)
+    and copies warnings to stderr. Levels start at LOG_LEVEL and follow LOG_LEVELS_FILE. Once per process.
+    """
+    root = logging.getLogger(ROOT_LOGGER)
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    file_handler = SharedRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    log_levels.on_change(apply_levels)
+    try:
+        log_levels.watch()
+    except Exception as e:
+        logger.error(f"Cannot follow {LOG_LEVELS_FILE}, log level changes apply to this process only: {str(e)}")
+
+def set_levels(changes):
+    """Merge {subsystem: level or None} into the saved levels; None drops a subsystem back to the default. Every process applies them."""
+    levels = log_levels.get()
+    for subsystem, level in changes.items():
+        if level is None:
+            levels.pop(subsystem, None)
+        else:
+            levels[subsystem] = level
+    log_levels.save(levels)
+    return levels
@@ -0,0 +1,189 @@
+import bisect
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+# Seconds; from a cached font lookup up to a long label fighting USB retries
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRACE_HISTORY = 200  # Per-job traces kept for /metrics/traces
+
+class Metric:
+    def __init__(self, registry, kind, name, help, labelnames, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+
+    def labels_key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+class Counter(Metric):
+    def inc(self, amount=1, **labels):
+        self.registry.record(self.name, self.labels_key(labels), amount)
+
+class Histogram(Metric):
+    def observe(self, value, **labels):
+        self.registry.record(self.name, self.labels_key(labels), value)
+
+class Registry:
+    """
+    Counters and histograms of this process in Prometheus text format, plus a trace of stage timings
+    per print job. Render workers collect what they measure and send it back with their result, so
+    the process that owns the print queue reports the whole pipeline.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.traces = collections.deque(maxlen=TRACE_HISTORY)
+
+    def counter(self, name, help, labelnames=()):
+        self.metrics[name] = Counter(self, 'counter', name, help, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.metrics[name] = Histogram(self, 'histogram', name, help, labelnames, buckets)
+        return self.metrics[name]
+
+    def record(self, name, key, value):
+        collected = getattr(self.local, 'collected', None)
+        if collected is not None:
+            collected.append((name, key, value))
+        else:
+            self.apply([(name, key, value)])
+
+    def apply(self, records):
+        """Add records (name, label values, value) to the totals, and stage timings to the trace of the running job."""
+        trace = getattr(self.local, 'trace', None)
+        with self.lock:
+            for name, key, value in records:
+                metric = self.metrics[name]
+                if metric.kind == 'counter':
+                    self.values[name, key] = self.values.get((name, key), 0) + value
+                    continue
+                # Per-bucket counts (the last is +Inf), then the sum
+                state = self.values.setdefault((name, key), [0] * (len(metric.buckets) + 1) + [0.0])
+                state[bisect.bisect_left(metric.buckets, value)] += 1
+                state[-1] += value
+                if trace is not None and metric is stage_seconds:
+                    trace['spans'].append({'stage': key[0], 'seconds': round(value, 6)})
+
+    @contextlib.contextmanager
+    def collecting(self):
+        """Collect the records of this thread into a list instead of adding them to the totals."""
+        self.local.collected = []
+        try:
+            yield self.local.collected
+        finally:
+            self.local.collected = None
+
+    @contextlib.contextmanager
+    def job_trace(self, job_id, description):
+        """Record the stages timed in this thread as the trace of one print job."""
+        trace = {'job_id': job_id, 'description': description, 'started': time.time(), 'spans': []}
+        self.local.trace = trace
+        try:
+            yield trace
+        finally:
+            self.local.trace = None
+            trace['seconds'] = round(time.time() - trace['started'], 6)
+            with self.lock:
+                self.traces.append(trace)
+
+    def recent_traces(self, job_id=None):
+        with self.lock:
+            return [trace for trace in self.traces if job_id is None or trace['job_id'] == job_id]
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            values = dict(self.values)
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for (value_name, key), value in sorted(values.items()):
+                if value_name != name:
+                    continue
+                labels = [f'{label}="{escape(key_value)}"' for label, key_value in zip(metric.labelnames, key)]
+                if metric.kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric.buckets) + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{format_labels(labels + [le])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+registry = Registry()
+
+stage_seconds = registry.histogram('label_printer_stage_seconds', 'Time spent in each stage of producing and printing a label', ('stage',))
+job_wait_seconds = registry.histogram('label_printer_job_wait_seconds', 'Time print jobs spent queued before they started', ('kind',))
+job_seconds = registry.histogram('label_printer_job_seconds', 'Time print jobs took from start to finish', ('kind', 'outcome'))
+jobs_total = registry.counter('label_printer_jobs_total', 'Print jobs finished', ('kind', 'outcome'))
+retries_total = registry.counter('label_printer_print_retries_total', 'Failed print attempts that were retried', ('error',))
+usb_recoveries_total = registry.counter('label_printer_usb_recoveries_total', 'USB recovery steps run', ('tier', 'outcome'))
+cache_requests_total = registry.counter('label_printer_cache_requests_total', 'Lookups in the font, QR code and barcode caches', ('cache', 'result'))
+
+@contextlib.contextmanager
+def span(stage):
+    """Time the enclosed block as one stage of the current label."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+class StageTimer:
+    """Times consecutive stages of a long function: lap(stage) records the time since the previous lap."""
+
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        stage_seconds.observe(now - self.last, stage=stage)
+        self.last = now
+
+def collect_metrics(fn, args, kwargs):
+    """Render worker side of a job: run fn and return (result, the metrics it recorded) for the calling process."""
+    with registry.collecting() as records:
+        result = fn(*args, **kwargs)
+    return result, records
+
+def counted_cache(name, maxsize):
+    """functools.lru_cache that counts its hits and misses as cache name."""
+    def decorate(fn):
+        local = threading.local()
+
+        @functools.lru_cache(maxsize=maxsize)
+        def compute(*args, **kwargs):
+            local.missed = True
+            return fn(*args, **kwargs)
+
+        @functools.wraps(fn)
+        def lookup(*args, **kwargs):
+            local.missed = False
+            result = compute(*args, **kwargs)
+            cache_requests_total.inc(cache=name, result='miss' if local.missed else 'hit')
+            return result
+
+        lookup.cache_info = compute.cache_info
+        lookup.cache_clear = compute.cache_clear
+        return lookup
+    return decorate
@@ -0,0 +1,192 @@
+import collections
+import logging
+import threading
+import time
+import uuid
+from label_printer.device import printer_monitor, PrinterOffline
+from label_printer.metrics import registry, job_wait_seconds, job_seconds, jobs_total
+from label_printer.profiling import wrap, run_profiled
+
+logger = logging.getLogger(__name__)
+
+# How long a web request waits for its job before answering that it is still queued
+PRINT_WAIT_TIMEOUT = 60
+EVENT_HISTORY = 500  # Job events kept for clients that (re)connect to the event stream
+
+class PrintJob:
+    def __init__(self, func, args, kwargs, description):
+        self.id = uuid.uuid4().hex[:12]
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description or func.__name__
+        self.stage = 'queued'
+        self.submitted = time.time()
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish. Returns True if it did within timeout."""
+        return self.finished.wait(timeout)
+
+    def outcome(self):
+        """'success' or 'error' once finished, None before. Print functions return None or an error dict on failure."""
+        if not self.finished.is_set():
+            return None
+        if self.error is not None or self.result is None or (isinstance(self.result, dict) and self.result.get('status') == 'error'):
+            return 'error'
+        return 'success'
+
+    def message(self):
+        """The error, or the message a print function returned, if any."""
+        if self.error is not None:
+            return str(self.error)
+        if isinstance(self.result, dict):
+            return self.result.get('message')
+        return None
+
+class PrintQueue:
+    """
+    Single writer for the printer. Jobs run one at a time, in submission order, and only
+    while the printer is connected; a job that finds the printer gone stays at the head
+    of the queue until the printer monitor reports it back.
+    """
+
+    def __init__(self):
+        self.jobs = collections.deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.device_lock = threading.Lock()  # Held while a job talks to the printer
+        self.current = None
+        self.listeners = []
+        self.events = collections.deque(maxlen=EVENT_HISTORY)
+        self.event_seq = 0
+        self.event_condition = threading.Condition()
+
+    def add_listener(self, listener):
+        """
+        Register listener(event, job) for job events: 'queued', 'started', 'interrupted' and 'finished'
+        from the queue, plus progress stages reported by the print functions ('rendered', 'sending', 'sent',
+        'acknowledged', 'printed', 'cut').
+        """
+        self.listeners.append(listener)
+
+    def publish(self, event, job, **data):
+        """Record a job event for the event streams and pass it to the listeners."""
+        if event != 'finished':
+            job.stage = event
+        record = dict(data, job_id=job.id, description=job.description, stage=event, time=time.time())
+        if event == 'finished':
+            record['outcome'] = job.outcome()
+            if job.message():
+                record['message'] = job.message()
+        with self.event_condition:
+            self.event_seq += 1
+            record['seq'] = self.event_seq
+            self.events.append(record)
+            self.event_condition.notify_all()
+        for listener in self.listeners:
+            try:
+                listener(event, job)
+            except Exception as e:
+                logger.error(f"Print queue listener failed on {event}: {str(e)}")
+
+    def events_since(self, seq, job_id=None, timeout=None):
+        """
+        Return job events newer than seq, optionally only for job_id, waiting up to timeout for the first one.
+        Events that have dropped out of the history are skipped.
+        """
+        def newer():
+            return [event for event in self.events if event['seq'] > seq and (job_id is None or event['job_id'] == job_id)]
+        with self.event_condition:
+            return self.event_condition.wait_for(newer, timeout)
+
+    def latest_seq(self):
+        with self.event_condition:
+            return self.event_seq
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="print-queue", daemon=True)
+                self.thread.start()
+
+    def submit(self, func, *args, description=None, **kwargs):
+        description = description or func.__name__
+        func, args = wrap(func, args)
+        job = PrintJob(func, args, kwargs, description)
+        with self.condition:
+            self.jobs.append(job)
+            position = len(self.jobs)
+            self.condition.notify()
+        logger.debug("Queued print job %s (%s) at position %s", job.id, job.description, position)
+        self.publish('queued', job, position=position)
+        self.start()
+        return job
+
+    def pending(self):
+        with self.condition:
+            return len(self.jobs)
+
+    def find(self, job_id):
+        """Return the queued or running job with job_id, or None."""
+        with self.condition:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def snapshot(self):
+        """List the queued jobs in print order, the running one first."""
+        with self.condition:
+            jobs = list(self.jobs)
+        return [{'job_id': job.id, 'description': job.description, 'stage': job.stage, 'position': position, 'submitted': job.submitted}
+                for position, job in enumerate(jobs, 1)]
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                job = self.jobs[0]
+            if not printer_monitor.is_present():
+                logger.info("Printer offline, holding %s job(s) until it is reconnected", self.pending())
+                printer_monitor.wait_until_present()
+                logger.info("Printer reconnected, draining print queue")
+            # Profiled jobs run wrapped; count them under the function they wrap
+            kind = job.args[1] if job.func is run_profiled else getattr(job.func, '__name__', 'job')
+            with self.device_lock:
+                self.current = job
+                self.publish('started', job)
+                started = time.time()
+                job_wait_seconds.observe(started - job.submitted, kind=kind)
+                try:
+                    with registry.job_trace(job.id, job.description):
+                        job.result = job.func(*job.args, **job.kwargs)
+                except PrinterOffline as e:
+                    logger.warning(f"Print job {job.id} interrupted, printer went offline: {str(e)}")
+                    self.current = None
+                    jobs_total.inc(kind=kind, outcome='interrupted')
+                    self.publish('interrupted', job)
+                    printer_monitor.refresh()
+                    continue  # Job stays at the head of the queue
+                except Exception as e:
+                    logger.error(f"Print job {job.id} ({job.description}) failed: {str(e)}")
+                    job.error = e
+                self.current = None
+                elapsed = time.time() - started
+            with self.condition:
+                self.jobs.popleft()
+                waiting = list(self.jobs)
+            job.finished.set()
+            job_seconds.observe(elapsed, kind=kind, outcome=job.outcome())
+            jobs_total.inc(kind=kind, outcome=job.outcome())
+            self.publish('finished', job)
+            for position, waiting_job in enumerate(waiting, 1):
+                self.publish('queued', waiting_job, position=position)
+
+print_queue = PrintQueue()
+
+def report_progress(stage, **data):
+    """Publish a progress stage for the job that is printing right now; a no-op outside the print queue."""
+    job = print_queue.current
+    if job is not None:
+        print_queue.publish(stage, job, **data)
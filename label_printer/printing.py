@@ -1,15 +1,26 @@
+import logging
 import subprocess
 import os
-from PIL import Image, ImageDraw, ImageFont
 import io
-import base64
-import qrcode
-import time
-from label_printer.config import logger
-import PyPDF2
-from label_printer.utils import resolve_usb_conflicts
+from label_printer.device import printer_present, PrinterOffline
+from label_printer.recovery import recovery_manager
+from label_printer.backends import printer_backend
+from label_printer.config import BROTHER_QL_PATH, PRINTER_MODEL, PRINTER_LABEL, PRINTER_VENDOR_ID, PRINTER_PRODUCT_ID
+from label_printer.retry import RetryPolicy, PrintError, classify_error, TRANSIENT, FATAL
+from label_printer.print_queue import report_progress
+from label_printer.settings import settings
+from label_printer.workspace import job_workspace, save_debug_image
+from label_printer.metrics import span, StageTimer
 import re
-import json
+import threading
+import ast
+
+logger = logging.getLogger(__name__)
+
+BROTHER_QL_TIMEOUT = 30  # Seconds allowed for a single brother_ql run
+
+# Shared by every print path: at most 3 attempts within 60 seconds, stepping up USB recovery between attempts
+PRINT_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=4.0, deadline=60.0, recover=printer_backend.recover)
 
 def clean_filename(filename):
     """Replace problematic Unicode sequences with the '|' symbol."""
@@ -17,345 +28,372 @@ def clean_filename(filename):
     cleaned = re.sub(r'\uf027', '|', filename)
     return cleaned
 
-def print_label(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1='left', justify2='left', justify3='left', spacing1=10, spacing2=10):
-    from label_printer.image import generate_label_image
-    img_path = "/tmp/label.png"
-    image = generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1, justify2, justify3, spacing1, spacing2)
-    Image.open(io.BytesIO(base64.b64decode(image))).save(img_path)
+def clean_printer_output(stderr):
+    """Filter out deprecation warnings and --debug chatter from brother_ql's stderr."""
+    cleaned_output = [line for line in stderr.splitlines() if "deprecation warning" not in line.lower() and not line.startswith("DEBUG:")]
+    return "\n".join(cleaned_output) or "Printing was successful."
 
-    size_check = subprocess.run(["identify", img_path], capture_output=True, text=True)
-    logger.debug(f"Image size: {size_check.stdout}")
+def track_printer_progress(line, progress):
+    """
+    Turn one line of brother_ql --debug output into job progress stages: 'sending' with the byte count,
+    'sent' once the first status reply arrives after the write, 'acknowledged' when the printer enters
+    its printing phase, 'printed' when it reports completion and 'cut' when it is ready for the next label.
+    progress is a dict carrying state between lines of the same run.
+    """
+    match = re.search(r"Total: (\d+) bytes", line)
+    if match:
+        progress['bytes'] = int(match.group(1))
+        report_progress('sending', bytes=progress['bytes'])
+        return
+    match = re.search(r"result: (\{.*\})", line)
+    if not match:
+        return
+    try:
+        status = ast.literal_eval(match.group(1))
+    except (ValueError, SyntaxError):
+        return
+    stages = []
+    if 'sent' not in progress:
+        stages.append('sent')
+    if status.get('phase_type') == 'Printing state':
+        stages.append('acknowledged')
+    if status.get('status_type') == 'Printing completed':
+        stages.append('printed')
+    if status.get('phase_type') == 'Waiting to receive' and 'printed' in progress:
+        stages.append('cut')
+    for stage in stages:
+        if stage not in progress:
+            progress[stage] = True
+            report_progress(stage, bytes=progress.get('bytes'))
 
-    brother_ql_path = os.path.expanduser("~/.local/bin/brother_ql")
+def run_brother_ql(image, red=False):
+    """
+    Make a single print attempt with brother_ql. image is a file path, or PNG bytes that are piped to
+    brother_ql on stdin so no scratch file is shared between jobs.
+    Returns the CompletedProcess on success; raises PrinterOffline if the printer is not connected,
+    or PrintError classified for the retry policy.
+    """
+    if not printer_present():
+        raise PrinterOffline("Printer not found on USB")
+    # --debug makes brother_ql log every status reply from the printer; the progress stages are read from those
     print_cmd = [
-        brother_ql_path, "--backend", "pyusb",
-        "--model", "QL-810W", "--printer", "usb://0x04f9:0x209c",
-        "print", "--label", "62"
+        BROTHER_QL_PATH, "--debug", "--backend", "pyusb",
+        "--model", PRINTER_MODEL, "--printer", f"usb://0x{PRINTER_VENDOR_ID}:0x{PRINTER_PRODUCT_ID}",
+        "print", "--label", PRINTER_LABEL
     ]
-    if tape_type == "red_black":
+    if red:
         print_cmd.append("--red")
-    print_cmd.append(img_path)
+    print_cmd.append("-" if isinstance(image, bytes) else image)
 
-    result = None
-    for attempt in range(3):
-        try:
-            logger.debug(f"Executing print (attempt {attempt + 1}/3): {' '.join(print_cmd)}")
-            result = subprocess.run(print_cmd, capture_output=True, text=True, check=True)
-            logger.debug(f"Output: {result.stdout}")
-            logger.debug(f"Error (if any): {result.stderr}")
-            if "Printing was successful" in result.stderr:
-                logger.info(f"Successfully printed label on attempt {attempt + 1}")
-                break
-            else:
-                logger.warning(f"Print attempt {attempt + 1} failed with output: {result.stderr}")
-                resolve_usb_conflicts()
-                time.sleep(2)
-        except subprocess.CalledProcessError as e:
-            logger.warning(f"Print attempt {attempt + 1} failed with error: {e.stderr}")
-            if "Resource busy" in e.stderr.lower() or "usberror" in e.stderr.lower():
-                logger.info("Detected USB conflict, resolving...")
-                resolve_usb_conflicts()
-                time.sleep(2)
-            else:
-                logger.error(f"Unexpected subprocess error: {e.stderr}")
-                break
-        except Exception as e:
-            logger.error(f"Unexpected error during print attempt {attempt + 1}: {str(e)}")
-            if "Resource busy" in str(e).lower() or "USBError" in str(e):
-                logger.info("Detected USB conflict, resolving...")
-                resolve_usb_conflicts()
-                time.sleep(2)
-            else:
-                logger.error(f"Non-USB error, aborting: {str(e)}")
-                break
-    else:
-        logger.error("Failed to print label after 3 attempts")
-        os.remove(img_path)
-        return {'status': 'error', 'message': 'Failed to print label after 3 attempts'}
-
-    # Filter out deprecation warning from stderr
-    cleaned_output = []
-    if result:
-        for line in result.stderr.splitlines():
-            if "deprecation warning" not in line.lower():
-                cleaned_output.append(line)
-    cleaned_message = "\n".join(cleaned_output) if cleaned_output else "Printing was successful."
-
-    os.remove(img_path)
-    return {'status': 'success', 'message': cleaned_message}
-
-def print_qr_code(url, exclude_text=False):
-    from label_printer.image import generate_qr_code_image
-    img_path = "/tmp/qr_code.png"
-    
+    logger.debug("Executing print: %s", print_cmd)
+    stages = StageTimer()
     try:
-        # Read tape_type from settings.txt
-        settings_path = os.path.expanduser("~/label_printer_web/settings.txt")
-        tape_type = "red_black"  # Default to red_black if settings.txt is missing
-        if os.path.exists(settings_path):
-            with open(settings_path, 'r') as f:
-                settings = json.load(f)
-                tape_type = settings.get("tape_type", "red_black")
-            logger.debug(f"Read tape_type from settings.txt: {tape_type}")
-        else:
-            logger.warning("settings.txt not found, defaulting to red_black tape_type")
-
-        qr_img = generate_qr_code_image(url, box_size=10)
-        logger.debug(f"Original QR code size: {qr_img.width}x{qr_img.height}px")
-        
-        raw_qr_path = "/home/odroid/raw_qr.png"
-        qr_img.save(raw_qr_path)
-        logger.debug(f"Saved raw QR image at {raw_qr_path}, size: {qr_img.width}x{qr_img.height}px")
-        
-        qr_img = qr_img.resize((150, 150), Image.LANCZOS)
-        logger.debug(f"QR code size after resize: {qr_img.width}x{qr_img.height}px")
-        
-        canvas_width = 696
-        canvas_height = 150 if exclude_text else 180
-        padded_img = Image.new("RGB", (canvas_width, canvas_height), "white")
-        draw = ImageDraw.Draw(padded_img)
-        
-        paste_x = (canvas_width - qr_img.width) // 2
-        paste_y = 0
-        padded_img.paste(qr_img, (paste_x, paste_y))
-        
-        if not exclude_text:
-            font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-            font_size = 20
-            font = ImageFont.truetype(font_path, font_size)
-            text_bbox = draw.textbbox((0, 0), url, font=font)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_x = (canvas_width - text_width) // 2
-            text_y = 150
-            draw.text((text_x, text_y), url, font=font, fill="black")
-        
-        debug_path = "/home/odroid/test_qr.png"
-        padded_img.save(debug_path)
-        logger.debug(f"Saved debug image at {debug_path}, size: {padded_img.width}x{padded_img.height}px")
-        
-        padded_img.save(img_path)
-        logger.debug(f"Padded image size: {padded_img.width}x{padded_img.height}px")
-
-        brother_ql_path = os.path.expanduser("~/.local/bin/brother_ql")
-        print_cmd = [
-            brother_ql_path, "--backend", "pyusb",
-            "--model", "QL-810W", "--printer", "usb://0x04f9:0x209c",
-            "print", "--label", "62"
-        ]
-        if tape_type == "red_black":
-            print_cmd.append("--red")
-        print_cmd.append(img_path)
+        process = subprocess.Popen(print_cmd, stdin=subprocess.PIPE if isinstance(image, bytes) else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise PrintError(FATAL, f"Cannot run brother_ql: {str(e)}")
+    stages.lap('spawn')
+    if isinstance(image, bytes):
+        # Feed stdin from another thread so a chatty stderr can't deadlock against a full stdin pipe
+        def feed():
+            try:
+                process.stdin.write(image)
+            except OSError:
+                pass  # brother_ql exited early; its stderr says why
+            finally:
+                process.stdin.close()
+        threading.Thread(target=feed, daemon=True).start()
+    timed_out = threading.Event()
+    def kill():
+        timed_out.set()
+        process.kill()
+    timer = threading.Timer(BROTHER_QL_TIMEOUT, kill)
+    timer.start()
+    progress = {}
+    stderr_lines = []
+    try:
+        for raw_line in process.stderr:
+            line = raw_line.decode(errors='replace')
+            stderr_lines.append(line)
+            track_printer_progress(line, progress)
+        stdout = process.stdout.read().decode(errors='replace')
+        process.wait()
+    finally:
+        timer.cancel()
+        stages.lap('brother_ql')
+    if timed_out.is_set():
+        raise PrintError(TRANSIENT, f"brother_ql timed out after {BROTHER_QL_TIMEOUT}s")
+    result = subprocess.CompletedProcess(print_cmd, process.returncode, stdout, "".join(stderr_lines))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Output: %s", result.stdout)
+        logger.debug("Error (if any): %s", clean_printer_output(result.stderr))
+    if "Printing was successful" not in result.stderr:
+        raise PrintError(classify_error(result.stderr), clean_printer_output(result.stderr) if result.stderr.strip() else f"brother_ql exited with code {result.returncode}")
+    recovery_manager.record_success()
+    return result
+
+# The print jobs below get their label already rendered: callers render it (render_pool.run with the
+# render_*_png functions) before queueing, so rendering never holds the printer and overlaps the previous print.
+
+def print_label(png, red=False):
+    """Print a text label rendered by render_label_png."""
+    report_progress('rendered')
+    logger.debug("Label image: %s bytes of PNG", len(png))
 
+    try:
+        result = PRINT_RETRY_POLICY.run(lambda: printer_backend.print(png, red=red), "Label print")
+    except PrintError as e:
+        logger.error(f"Failed to print label: {str(e)}")
+        return {'status': 'error', 'message': f'Failed to print label: {str(e)}'}
+
+    logger.info("Successfully printed label")
+    return {'status': 'success', 'message': clean_printer_output(result.stderr)}
+
+def qr_code_red():
+    """QR codes print on the saved tape type, red_black if none is saved."""
+    return settings.get().get("tape_type", "red_black") == "red_black"
+
+def print_qr_code(png, red=False):
+    """Print a QR code label rendered by render_qr_png."""
+    try:
+        report_progress('rendered')
         try:
-            logger.debug(f"Executing QR print (tape_type: {tape_type}): {' '.join(print_cmd)}")
-            result = subprocess.run(print_cmd, capture_output=True, text=True, check=True)
-            logger.debug(f"Output: {result.stdout}")
-            logger.debug(f"Error (if any): {result.stderr}")
-            if "Printing was successful" in result.stderr:
-                logger.info(f"Successfully printed QR code (tape_type: {tape_type})")
-                os.remove(img_path)
-                cleaned_output = [line for line in result.stderr.splitlines() if "deprecation warning" not in line.lower()]
-                return {'status': 'success', 'message': "\n".join(cleaned_output) or "Printing was successful."}
-            else:
-                logger.error(f"Failed to print QR code (tape_type: {tape_type}) with output: {result.stderr}")
-                os.remove(img_path)
-                return {'status': 'error', 'message': f'Failed to print QR code (tape_type: {tape_type})'}
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to print QR code (tape_type: {tape_type}) with error: {e.stderr}")
-            if "Resource busy" in e.stderr.lower() or "usberror" in e.stderr.lower():
-                logger.info("Detected USB conflict, resolving...")
-                resolve_usb_conflicts()
-            os.remove(img_path)
-            return {'status': 'error', 'message': f'Failed to print QR code (tape_type: {tape_type}): {e.stderr}'}
-        except Exception as e:
-            logger.error(f"Unexpected error printing QR code (tape_type: {tape_type}): {str(e)}")
-            if "Resource busy" in str(e).lower() or "USBError" in str(e):
-                logger.info("Detected USB conflict, resolving...")
-                resolve_usb_conflicts()
-            os.remove(img_path)
-            return {'status': 'error', 'message': f'Error printing QR code (tape_type: {tape_type}): {str(e)}'}
+            result = PRINT_RETRY_POLICY.run(lambda: printer_backend.print(png, red=red), "QR code print")
+        except PrintError as e:
+            logger.error(f"Failed to print QR code (red: {red}): {str(e)}")
+            return {'status': 'error', 'message': f'Failed to print QR code (red: {red}): {str(e)}'}
+        logger.info("Successfully printed QR code (red: %s)", red)
+        return {'status': 'success', 'message': clean_printer_output(result.stderr)}
 
+    except PrinterOffline:
+        raise
     except Exception as e:
         logger.error(f"Error in print_qr_code: {str(e)}")
-        if os.path.exists(img_path):
-            os.remove(img_path)
         return {'status': 'error', 'message': f'Error in print_qr_code: {str(e)}'}
-        
-def print_file(file_path):
-    """Print an image or PDF file with cropping, custom scaling, and optional grayscale/dithering."""
-    output_path = "/tmp/print_file.png"  # Define early to avoid UnboundLocalError
+
+def print_barcode(png, symbology, red=False):
+    """Print a stand-alone Code 128, EAN-13, Data Matrix or QR code label rendered by render_barcode_png; see label_printer.barcode."""
+    report_progress('rendered')
     try:
-        PAPER_WIDTH = 696  # Printer paper width in pixels (62mm at 300 DPI)
+        result = PRINT_RETRY_POLICY.run(lambda: printer_backend.print(png, red=red), f"{symbology} barcode print")
+    except PrintError as e:
+        logger.error(f"Failed to print {symbology} barcode: {str(e)}")
+        return {'status': 'error', 'message': f'Failed to print {symbology} barcode: {str(e)}'}
+    logger.info("Successfully printed %s barcode", symbology)
+    return {'status': 'success', 'message': clean_printer_output(result.stderr)}
 
-        # Clean the filename to handle Unicode issues
-        filename = clean_filename(os.path.basename(file_path))
-        logger.debug(f"Cleaned filename: {filename}")
+def print_sequence_label(png, value, red=False, stopped=None):
+    """
+    Print one label of a sequence run, rendered ahead of time by the run; see label_printer.sequence.
+    stopped is the run's Event: a failed label sets it, and labels queued behind it then skip themselves
+    instead of printing past a value that will be printed again when the run is resumed.
+    """
+    if stopped is not None and stopped.is_set():
+        logger.info("Skipping sequence label %s, an earlier label of the run failed", value)
+        return {'status': 'error', 'message': f'Skipped {value}: an earlier label of the sequence failed'}
+    report_progress('rendered')
+    try:
+        result = PRINT_RETRY_POLICY.run(lambda: printer_backend.print(png, red=red), f"Sequence label {value}")
+    except PrinterOffline:
+        raise
+    except Exception as e:
+        if stopped is not None:
+            stopped.set()
+        if not isinstance(e, PrintError):
+            raise
+        logger.error(f"Failed to print sequence label {value}: {str(e)}")
+        return {'status': 'error', 'message': f'Failed to print {value}: {str(e)}'}
+    logger.info("Printed sequence label %s", value)
+    return {'status': 'success', 'message': clean_printer_output(result.stderr)}
 
-        # Determine file type and dimensions
-        if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-            img = Image.open(file_path)
-            width, height = img.size
-        elif file_path.lower().endswith('.pdf'):
-            pdf = PyPDF2.PdfReader(file_path)
-            num_pages = len(pdf.pages)
-            logger.debug(f"PDF has {num_pages} pages")
-
-            # Convert all pages to PNGs at full resolution
-            page_images = []
-            for page_num in range(num_pages):
-                output_prefix = f"/tmp/pdf_page_{page_num}"
-                subprocess.run(['pdftoppm', '-png', '-f', str(page_num + 1), '-l', str(page_num + 1), file_path, output_prefix], check=True)
-                page_img = Image.open(f"{output_prefix}-{page_num + 1}.png")
+def prepare_print_file(file_path, crop=None, target_width=None, target_height=None, dither=None, source=None):
+    """
+    Load an image or PDF file and prepare it for printing: crop, scale, rotate and optionally dither.
+    Options left as None come from the filename flags: "+ws" keeps whitespace, "|w=N|" and "|h=N|" set
+    the size in pixels, "-gs" skips dithering.
+    source is an optional binary file object holding the contents (e.g. an upload); file_path then
+    only supplies the name and type.
+    Returns the prepared PIL image, or None if the file type is unsupported.
+    This is CPU-bound and touches no shared state, so it is safe to run in a worker process.
+    """
+    from PIL import Image
+    PAPER_WIDTH = 696  # Printer paper width in pixels (62mm at 300 DPI)
+    timer = StageTimer()
+
+    # Clean the filename to handle Unicode issues
+    filename = clean_filename(os.path.basename(file_path))
+    logger.debug("Cleaned filename: %s", filename)
+
+    # Determine file type and dimensions
+    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+        img = Image.open(source or file_path)
+        img.load()
+        width, height = img.size
+    elif file_path.lower().endswith('.pdf'):
+        import PyPDF2
+        pdf = PyPDF2.PdfReader(source or file_path)
+        num_pages = len(pdf.pages)
+        logger.debug("PDF has %s pages", num_pages)
+
+        # Convert all pages to PNGs at full resolution in one pdftoppm run, in a private directory so
+        # parallel jobs don't collide. An in-memory source is piped in on stdin.
+        page_images = []
+        with job_workspace(prefix="pdf_pages_") as page_dir:
+            output_prefix = os.path.join(page_dir, "pdf_page")
+            if source is not None:
+                source.seek(0)
+                subprocess.run(['pdftoppm', '-png', '-', output_prefix], input=source.read(), check=True)
+            else:
+                subprocess.run(['pdftoppm', '-png', file_path, output_prefix], check=True)
+            # Page numbers are zero-padded to the same width, so name order is page order
+            for page_file in sorted(os.listdir(page_dir)):
+                page_img = Image.open(os.path.join(page_dir, page_file))
+                page_img.load()
                 page_images.append(page_img)
-                os.remove(f"{output_prefix}-{page_num + 1}.png")
-
-            # Combine pages vertically into a single image
-            total_height = sum(img.height for img in page_images)
-            max_width = max(img.width for img in page_images)
-            combined_img = Image.new('RGB', (max_width, total_height), (255, 255, 255))
-            y_offset = 0
-            for img in page_images:
-                combined_img.paste(img, (0, y_offset))
-                y_offset += img.height
-            img = combined_img
+
+        # Combine pages vertically into a single image
+        total_height = sum(img.height for img in page_images)
+        max_width = max(img.width for img in page_images)
+        combined_img = Image.new('RGB', (max_width, total_height), (255, 255, 255))
+        y_offset = 0
+        for img in page_images:
+            combined_img.paste(img, (0, y_offset))
+            y_offset += img.height
+        img = combined_img
+        width, height = img.size
+    else:
+        logger.debug("Skipping unsupported file: %s", file_path)
+        return None  # Caller will handle removal
+    timer.lap('decode')
+
+    # Log original dimensions
+    logger.debug("Original dimensions: %sx%spx", width, height)
+
+    # Crop whitespace unless filename contains "+ws"
+    if crop is None:
+        crop = "+ws" not in filename.lower()
+    if crop:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img_array = img.point(lambda p: p < 240 and 255)  # Anything darker than 240 is content
+        bbox = img_array.getbbox()
+        if bbox:
+            img = img.crop(bbox)
             width, height = img.size
+            logger.debug("Cropped image to remove whitespace: %sx%spx", width, height)
         else:
-            logger.debug(f"Skipping unsupported file: {file_path}")
-            return None  # Caller will handle removal
-
-        # Log original dimensions
-        logger.debug(f"Original dimensions: {width}x{height}px")
-
-        # Crop whitespace unless filename contains "+ws"
-        if "+ws" not in filename.lower():
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            img_array = img.point(lambda p: p < 240 and 255)  # Anything darker than 240 is content
-            bbox = img_array.getbbox()
-            if bbox:
-                img = img.crop(bbox)
-                width, height = img.size
-                logger.debug(f"Cropped image to remove whitespace: {width}x{height}px")
-            else:
-                logger.debug("No content detected after cropping, using original image")
-
-        # Save intermediate cropped image for debugging
-        debug_path = "/home/odroid/cropped_debug.png"
-        img.save(debug_path)
-        logger.debug(f"Saved cropped image for debugging at {debug_path}, size: {width}x{height}px")
-
-        # Parse filename for custom width or height
-        custom_width = None
-        custom_height = None
-        width_match = re.search(r'\|w=(\d+)\|', filename)
-        height_match = re.search(r'\|h=(\d+)\|', filename)
-        if width_match:
-            custom_width = int(width_match.group(1))
-            logger.debug(f"Custom width specified: {custom_width}px")
-        if height_match:
-            custom_height = int(height_match.group(1))
-            logger.debug(f"Custom height specified: {custom_height}px")
-
-        # Final resize step
-        aspect_ratio = width / height
-        if custom_width and custom_height:
-            # Both specified, stretch to exact dimensions
-            new_width = custom_width
-            new_height = custom_height
-            rotate = new_width > PAPER_WIDTH and new_width > new_height
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            logger.debug(f"Stretched image to {new_width}x{new_height}px (ignoring aspect ratio), rotate: {rotate}")
-        elif custom_width:
-            # Only width specified, preserve aspect ratio
-            new_width = custom_width
-            new_height = int(new_width / aspect_ratio)
-            rotate = new_width > PAPER_WIDTH and new_width > new_height
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            logger.debug(f"Resized to custom width {new_width}x{new_height}px (preserving aspect ratio), rotate: {rotate}")
-        elif custom_height:
-            # Only height specified, preserve aspect ratio
-            new_height = custom_height
-            new_width = int(new_height * aspect_ratio)
-            rotate = new_width > PAPER_WIDTH and new_width > new_height
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            logger.debug(f"Resized to custom height {new_width}x{new_height}px (preserving aspect ratio), rotate: {rotate}")
-        else:
-            # No custom dimensions, use default scaling
-            if width < height:  # Portrait
-                new_width = PAPER_WIDTH
-                new_height = int(PAPER_WIDTH / aspect_ratio)
-                rotate = False
-            else:  # Landscape
-                new_width = int(PAPER_WIDTH * aspect_ratio)
-                new_height = PAPER_WIDTH
-                rotate = True
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            logger.debug(f"Scaled image to {new_width}x{new_height}px (still in color), rotate: {rotate}")
-
-        # Rotate if wider than tall and exceeds paper width
-        if rotate:
-            img = img.rotate(90, expand=True)
-            logger.debug(f"Rotated image to align short edge with paper width, new dimensions: {img.width}x{img.height}px")
-
-        # Create a white canvas with tape width and image height
-        canvas_width = PAPER_WIDTH
-        canvas_height = img.height
-        canvas = Image.new('RGB', (canvas_width, canvas_height), (255, 255, 255))
-        # Paste the image on the left side (x=0)
-        canvas.paste(img, (0, 0))
-        img = canvas
-        logger.debug(f"Placed image on white canvas: {canvas_width}x{canvas_height}px")
-
-        # Convert to grayscale and dither unless "-gs" is in filename
-        if "-gs" not in filename:
-            img = img.convert('L')  # Grayscale
-            img = img.convert('1', dither=Image.FLOYDSTEINBERG)  # 1-bit with dithering
-            logger.debug(f"Converted to grayscale and dithered to 1-bit")
-        else:
-            logger.debug(f"Keeping image in original color mode due to '-gs' in filename")
+            logger.debug("No content detected after cropping, using original image")
+        timer.lap('crop')
+
+    # Save intermediate cropped image for debugging
+    save_debug_image(img, "cropped_debug")
+
+    # Parse filename for custom width or height
+    custom_width = target_width
+    custom_height = target_height
+    width_match = re.search(r'\|w=(\d+)\|', filename) if target_width is None else None
+    height_match = re.search(r'\|h=(\d+)\|', filename) if target_height is None else None
+    if width_match:
+        custom_width = int(width_match.group(1))
+        logger.debug("Custom width specified: %spx", custom_width)
+    if height_match:
+        custom_height = int(height_match.group(1))
+        logger.debug("Custom height specified: %spx", custom_height)
+
+    # Final resize step
+    aspect_ratio = width / height
+    if custom_width and custom_height:
+        # Both specified, stretch to exact dimensions
+        new_width = custom_width
+        new_height = custom_height
+        rotate = new_width > PAPER_WIDTH and new_width > new_height
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+        logger.debug("Stretched image to %sx%spx (ignoring aspect ratio), rotate: %s", new_width, new_height, rotate)
+    elif custom_width:
+        # Only width specified, preserve aspect ratio
+        new_width = custom_width
+        new_height = int(new_width / aspect_ratio)
+        rotate = new_width > PAPER_WIDTH and new_width > new_height
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+        logger.debug("Resized to custom width %sx%spx (preserving aspect ratio), rotate: %s", new_width, new_height, rotate)
+    elif custom_height:
+        # Only height specified, preserve aspect ratio
+        new_height = custom_height
+        new_width = int(new_height * aspect_ratio)
+        rotate = new_width > PAPER_WIDTH and new_width > new_height
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+        logger.debug("Resized to custom height %sx%spx (preserving aspect ratio), rotate: %s", new_width, new_height, rotate)
+    else:
+        # No custom dimensions, use default scaling
+        if width < height:  # Portrait
+            new_width = PAPER_WIDTH
+            new_height = int(PAPER_WIDTH / aspect_ratio)
+            rotate = False
+        else:  # Landscape
+            new_width = int(PAPER_WIDTH * aspect_ratio)
+            new_height = PAPER_WIDTH
+            rotate = True
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+        logger.debug("Scaled image to %sx%spx (still in color), rotate: %s", new_width, new_height, rotate)
+
+    # Rotate if wider than tall and exceeds paper width
+    if rotate:
+        img = img.rotate(90, expand=True)
+        logger.debug("Rotated image to align short edge with paper width, new dimensions: %sx%spx", img.width, img.height)
+
+    # Create a white canvas with tape width and image height
+    canvas_width = PAPER_WIDTH
+    canvas_height = img.height
+    canvas = Image.new('RGB', (canvas_width, canvas_height), (255, 255, 255))
+    # Paste the image on the left side (x=0)
+    canvas.paste(img, (0, 0))
+    img = canvas
+    logger.debug("Placed image on white canvas: %sx%spx", canvas_width, canvas_height)
+    timer.lap('resize')
+
+    # Convert to grayscale and dither unless "-gs" is in filename
+    if dither is None:
+        dither = "-gs" not in filename
+    if dither:
+        img = img.convert('L')  # Grayscale
+        img = img.convert('1', dither=Image.FLOYDSTEINBERG)  # 1-bit with dithering
+        logger.debug("Converted to grayscale and dithered to 1-bit")
+        timer.lap('dither')
+    else:
+        logger.debug("Keeping image in original color mode, dithering disabled")
+
+    return img
 
+def print_prepared_image(img, file_path):
+    """Print an image returned by prepare_print_file, with USB conflict resolution."""
+    try:
         # Prepare image for printing
-        img.save(output_path)
-
-        # Print with USB conflict resolution
-        brother_ql_path = os.path.expanduser("~/.local/bin/brother_ql")
-        print_cmd = [
-            brother_ql_path, "--backend", "pyusb",
-            "--model", "QL-810W", "--printer", "usb://0x04f9:0x209c",
-            "print", "--label", "62", output_path
-        ]
-        for attempt in range(3):
-            try:
-                logger.debug(f"Executing print (attempt {attempt + 1}/3): {' '.join(print_cmd)}")
-                result = subprocess.run(print_cmd, capture_output=True, text=True)
-                logger.debug(f"Output: {result.stdout}")
-                logger.debug(f"Error (if any): {result.stderr}")
-                if "Printing was successful" in result.stderr:  # Check stderr for success
-                    logger.info(f"Successfully printed {file_path} on attempt {attempt + 1}")
-                    break
-                elif "Resource busy" in result.stderr or result.returncode != 0:
-                    logger.warning(f"Print attempt {attempt + 1} failed, resolving USB conflicts")
-                    resolve_usb_conflicts()
-                    time.sleep(2)
-                else:
-                    logger.error(f"Print failed with unexpected output: {result.stderr}")
-                    break
-            except subprocess.CalledProcessError as e:
-                logger.warning(f"Print attempt {attempt + 1} failed with error: {e.stderr}")
-                resolve_usb_conflicts()
-                time.sleep(2)
-            except Exception as e:
-                logger.error(f"Unexpected error during print attempt {attempt + 1}: {str(e)}")
-                resolve_usb_conflicts()
-                time.sleep(2)
-        else:
-            logger.error(f"Failed to print {file_path} after 3 attempts")
-            return None
+        buffered = io.BytesIO()
+        with span('png_encode'):
+            img.save(buffered, format="PNG")
+        png = buffered.getvalue()
+        report_progress('rendered')
 
+        try:
+            result = PRINT_RETRY_POLICY.run(lambda: printer_backend.print(png), f"Print of {file_path}")
+        except PrintError as e:
+            logger.error(f"Failed to print {file_path}: {str(e)}")
+            return None
+        logger.info("Successfully printed %s", file_path)
         return result
+    except PrinterOffline:
+        raise
     except Exception as e:
         logger.error(f"Error printing file {file_path}: {str(e)}")
         return None
-    finally:
-        if os.path.exists(output_path):
-            os.remove(output_path)
+
+def print_file(file_path):
+    """Print an image or PDF file with cropping, custom scaling, and optional grayscale/dithering."""
+    try:
+        img = prepare_print_file(file_path)
+    except Exception as e:
+        logger.error(f"Error preparing file {file_path}: {str(e)}")
+        return None
+    if img is None:
+        return None  # Caller will handle removal
+    return print_prepared_image(img, file_path)
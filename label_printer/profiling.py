@@ -0,0 +1,174 @@
+import collections
+import contextlib
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from label_printer.config import PROFILE_DIR, PROFILE_INTERVAL, PROFILE_KEEP
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"  # Request header that turns on profiling for one request
+PROFILE_FLAG = "+prof"  # Filename flag that does the same for a hot-folder file
+
+local = threading.local()
+
+def new_profile_id():
+    return uuid.uuid4().hex[:12]
+
+def requested():
+    """The id of the profile the current thread is working for, or None when it isn't being profiled."""
+    return getattr(local, 'profile_id', None)
+
+@contextlib.contextmanager
+def profiled(profile_id):
+    """Mark the work this thread starts in the block (render jobs, print jobs) as part of profile_id; None leaves it unprofiled."""
+    previous = requested()
+    local.profile_id = profile_id
+    try:
+        yield
+    finally:
+        local.profile_id = previous
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Sampler:
+    """
+    Samples the stack of one thread every PROFILE_INTERVAL from a background thread, counting
+    each distinct stack. Nothing runs unless a profile was asked for, so unprofiled work pays nothing.
+    """
+
+    def __init__(self, profile_id, name, thread_id=None):
+        self.profile_id = profile_id
+        self.name = name
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name=f"profile-{profile_id}", daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(PROFILE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        """Stop sampling and save what was collected as one part of the profile."""
+        self.stopped.set()
+        self.thread.join()
+        save_part({
+            'id': self.profile_id,
+            'name': self.name,
+            'pid': os.getpid(),
+            'started': self.started,
+            'seconds': round(time.time() - self.started, 6),
+            'samples': sum(self.stacks.values()),
+            'stacks': dict(self.stacks),
+        })
+
+@contextlib.contextmanager
+def sampled(name):
+    """Sample the enclosed block as a part named name of the current thread's profile, if it has one."""
+    profile_id = requested()
+    if profile_id is None:
+        yield
+        return
+    sampler = Sampler(profile_id, name).start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+
+def begin(name):
+    """Start a new profile of the current thread, e.g. for a web request; end() saves it."""
+    local.profile_id = new_profile_id()
+    return Sampler(local.profile_id, name).start()
+
+def end(sampler):
+    local.profile_id = None
+    sampler.stop()
+
+def run_profiled(profile_id, name, fn, *args, **kwargs):
+    """fn(*args, **kwargs) as part of profile_id, in whichever process or thread runs it; sent in place of fn."""
+    with profiled(profile_id), sampled(name):
+        return fn(*args, **kwargs)
+
+def wrap(fn, args):
+    """(fn, args) to hand to another thread or process: wrapped in run_profiled if this thread is being profiled."""
+    profile_id = requested()
+    if profile_id is None:
+        return fn, args
+    return run_profiled, (profile_id, getattr(fn, '__name__', 'job'), fn) + tuple(args)
+
+def save_part(part):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{part['id']}.{part['pid']}.{threading.get_ident()}.{time.time_ns()}.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(part, f)
+        os.replace(f"{path}.tmp", path)
+        logger.info("Saved profile %s part %s: %s samples in %.3fs", part['id'], part['name'], part['samples'], part['seconds'])
+        parts = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime)
+        for old in parts[:-PROFILE_KEEP]:
+            os.remove(old)
+    except OSError as e:
+        logger.error(f"Cannot save profile {part['id']}: {str(e)}")
+
+def load_parts(profile_id=None):
+    if profile_id is not None and not re.fullmatch(r"[0-9a-f]+", profile_id):
+        return []
+    pattern = f"{profile_id}.*.json" if profile_id else "*.json"
+    parts = []
+    for path in glob.glob(os.path.join(PROFILE_DIR, pattern)):
+        try:
+            with open(path, 'r') as f:
+                parts.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Pruned or replaced while we listed it
+    return sorted(parts, key=lambda part: part['started'])
+
+def list_profiles():
+    """Saved profiles, newest first, with the parts (request, render job, print job) each is made of."""
+    profiles = {}
+    for part in load_parts():
+        profile = profiles.setdefault(part['id'], {'id': part['id'], 'started': part['started'], 'parts': []})
+        profile['parts'].append({key: part[key] for key in ('name', 'pid', 'started', 'seconds', 'samples')})
+    return sorted(profiles.values(), key=lambda profile: profile['started'], reverse=True)
+
+def folded_stacks(profile_id):
+    """
+    The profile in the folded format of flamegraph.pl and speedscope: one "frame;frame;... count" line
+    per stack, each stack under the name of the part it was sampled in. None if there is no such profile.
+    """
+    parts = load_parts(profile_id)
+    if not parts:
+        return None
+    lines = [f"{part['name']};{stack} {count}" for part in parts for stack, count in part['stacks'].items()]
+    return "\n".join(lines) + "\n"
+
+def top_functions(profile_id, limit=25):
+    """The functions with the most samples of their own: self is time spent in the function itself, total includes its callees."""
+    own = collections.Counter()
+    total = collections.Counter()
+    for part in load_parts(profile_id):
+        for stack, count in part['stacks'].items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+    return [{'function': frame, 'self': count, 'total': total[frame]} for frame, count in own.most_common(limit)]
@@ -0,0 +1,56 @@
+import logging
+from label_printer.metrics import counted_cache
+
+logger = logging.getLogger(__name__)
+
+QR_CACHE_SIZE = 256
+
+@counted_cache('qr', maxsize=QR_CACHE_SIZE)
+def qr_matrix(data, error_correction='L'):
+    """
+    Encode data as a QR code once per (data, error correction level L/M/Q/H).
+    Returns the module matrix without quiet zone, as a tuple of rows of booleans (True is dark).
+    """
+    import qrcode
+    levels = {
+        'L': qrcode.constants.ERROR_CORRECT_L,
+        'M': qrcode.constants.ERROR_CORRECT_M,
+        'Q': qrcode.constants.ERROR_CORRECT_Q,
+        'H': qrcode.constants.ERROR_CORRECT_H,
+    }
+    qr = qrcode.QRCode(version=None, error_correction=levels[error_correction], border=0)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = tuple(tuple(row) for row in qr.get_matrix())
+    logger.debug("Encoded QR code version %s-%s, %s modules", qr.version, error_correction, len(matrix))
+    return matrix
+
+def qr_image(data, size=None, module_size=None, border=0, error_correction='L'):
+    """
+    1-bit image of the QR code for data, with border modules of quiet zone. Every module is a square of
+    module_size pixels; if that isn't given, the largest that fits the code into size pixels (at least 1),
+    so module edges stay sharp instead of being resampled.
+    """
+    matrix = qr_matrix(data, error_correction)
+    modules = len(matrix) + 2 * border
+    if module_size is None:
+        module_size = max(1, size // modules) if size else 1
+    return matrix_image(matrix, border, module_size)
+
+def matrix_image(matrix, border=0, module_size=1):
+    """1-bit image of a 2D code's module matrix (rows of booleans, True is dark), with border modules of quiet zone."""
+    from PIL import Image
+    modules = len(matrix) + 2 * border
+    # One pixel per module, packed 8 to a byte with 1 as white, then scaled up by an integer factor
+    row_bytes = (modules + 7) // 8
+    quiet_row = b"\xff" * row_bytes
+    pad = row_bytes * 8 - modules
+    rows = [quiet_row] * border
+    for row in matrix:
+        bits = "1" * border + "".join("0" if dark else "1" for dark in row) + "1" * (border + pad)
+        rows.append(int(bits, 2).to_bytes(row_bytes, "big"))
+    rows += [quiet_row] * border
+    image = Image.frombytes("1", (modules, modules), b"".join(rows))
+    if module_size > 1:
+        image = image.resize((modules * module_size, modules * module_size), Image.NEAREST)
+    return image
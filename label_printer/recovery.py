@@ -0,0 +1,195 @@
+import fcntl
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from label_printer.device import find_printer_device
+from label_printer.metrics import usb_recoveries_total
+
+logger = logging.getLogger(__name__)
+
+USBDEVFS_RESET = 21780  # _IO('U', 20)
+CONFLICTING_DRIVERS = ["usblp", "lp", "usbhid"]
+
+# Circuit breaker: after BREAKER_THRESHOLD recoveries without a successful print in between,
+# stop touching the USB stack for a cooldown that doubles each time, up to BREAKER_MAX_COOLDOWN.
+BREAKER_THRESHOLD = 6
+BREAKER_BASE_COOLDOWN = 5
+BREAKER_MAX_COOLDOWN = 300
+
+def reclaim_interface(device):
+    """Tier 1: detach any kernel driver from the printer interface and claim/release it in-process."""
+    try:
+        import usb.core
+        import usb.util
+    except ImportError:
+        logger.debug("pyusb not available, skipping interface re-claim")
+        return False
+    dev = usb.core.find(bus=device['busnum'], address=device['devnum'])
+    if dev is None:
+        return False
+    try:
+        if dev.is_kernel_driver_active(0):
+            dev.detach_kernel_driver(0)
+            logger.info("Detached kernel driver from printer interface")
+        usb.util.claim_interface(dev, 0)
+        usb.util.release_interface(dev, 0)
+        return True
+    finally:
+        usb.util.dispose_resources(dev)
+
+def process_uid(pid):
+    """Real uid of process pid from /proc/<pid>/status, or None if it has exited."""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith("Uid:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def process_name(pid):
+    try:
+        with open(f"/proc/{pid}/comm", 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return '?'
+
+def release_holders(device):
+    """
+    Tier 2: terminate processes of our own user that still hold the device node open (e.g. a hung brother_ql).
+    Holders running as other users, such as cups or ippusbxd when we run as root, are logged and left alone.
+    """
+    holders = []
+    dev_path = device['dev_path']
+    uid = os.getuid()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            for fd in os.listdir(fd_dir):
+                if os.readlink(os.path.join(fd_dir, fd)) == dev_path:
+                    holders.append(int(pid))
+                    break
+        except OSError:
+            continue  # Process exited or belongs to another user
+    terminated = False
+    for pid in holders:
+        holder_uid = process_uid(pid)
+        name = process_name(pid)
+        if holder_uid != uid:
+            logger.warning("Not terminating process %s (%s, uid %s) holding %s: it is not ours", pid, name, holder_uid, dev_path)
+            continue
+        try:
+            os.kill(pid, signal.SIGTERM)
+            terminated = True
+            logger.info("Terminated process %s (%s) holding %s", pid, name, dev_path)
+        except OSError as e:
+            logger.warning(f"Could not terminate process {pid} holding {dev_path}: {str(e)}")
+    return terminated
+
+def reset_device(device):
+    """Tier 3: USBDEVFS_RESET on the device node, which makes the printer re-enumerate."""
+    with open(device['dev_path'], 'wb') as fd:
+        fcntl.ioctl(fd, USBDEVFS_RESET, 0)
+    logger.info("Reset USB device %s", device['dev_path'])
+    return True
+
+def unbind_drivers(device):
+    """Tier 4: unbind conflicting kernel drivers from the printer interfaces, and stop ippusbxd."""
+    unbound = False
+    sysfs_path = device['sysfs_path']
+    base = os.path.basename(sysfs_path)
+    for name in os.listdir(sysfs_path):
+        if not name.startswith(base + ":"):
+            continue
+        driver_link = os.path.join(sysfs_path, name, "driver")
+        if not os.path.islink(driver_link):
+            continue
+        driver = os.path.basename(os.readlink(driver_link))
+        if driver not in CONFLICTING_DRIVERS:
+            continue
+        try:
+            with open(os.path.join(driver_link, "unbind"), "w") as f:
+                f.write(name)
+            logger.info("Unbound kernel driver %s from %s", driver, name)
+        except OSError:
+            subprocess.run(["sudo", "-n", "/sbin/rmmod", driver], capture_output=True, text=True, check=True)
+            logger.info("Removed kernel driver %s", driver)
+        unbound = True
+    status = subprocess.run(["/bin/systemctl", "is-active", "ippusbxd"], capture_output=True, text=True)
+    if status.stdout.strip() == "active":
+        subprocess.run(["sudo", "-n", "/bin/systemctl", "stop", "ippusbxd"], check=True)
+        subprocess.run(["sudo", "-n", "/bin/systemctl", "disable", "ippusbxd"], check=True)
+        logger.info("Stopped and disabled ippusbxd service")
+        unbound = True
+    return unbound
+
+class UsbRecoveryManager:
+    """
+    Recover the printer's USB connection with the cheapest step that might work.
+    Each recovery without a successful print in between escalates one tier, and a
+    circuit breaker stops recovery attempts entirely when they keep failing.
+    """
+
+    TIERS = [
+        ("re-claim interface", reclaim_interface),
+        ("release device holders", release_holders),
+        ("USB reset", reset_device),
+        ("unbind kernel drivers", unbind_drivers),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0  # Recoveries since the last successful print
+        self.trips = 0
+        self.open_until = 0
+
+    def record_success(self):
+        """Called by print paths after a successful print; resets escalation and the breaker."""
+        with self.lock:
+            if self.failures or self.trips:
+                logger.debug("Printer healthy again, resetting USB recovery state")
+            self.failures = 0
+            self.trips = 0
+            self.open_until = 0
+
+    def breaker_open(self):
+        return time.monotonic() < self.open_until
+
+    def recover(self):
+        """Run the next recovery tier. Returns True if a step was performed."""
+        with self.lock:
+            if self.breaker_open():
+                logger.warning(f"USB recovery circuit open for another {self.open_until - time.monotonic():.0f}s, skipping")
+                usb_recoveries_total.inc(tier='none', outcome='circuit_open')
+                return False
+            device = find_printer_device()
+            if device is None:
+                logger.warning("Printer not found in sysfs, nothing to recover")
+                return False
+            tier = min(self.failures, len(self.TIERS) - 1)
+            self.failures += 1
+            if self.failures >= BREAKER_THRESHOLD:
+                cooldown = min(BREAKER_BASE_COOLDOWN * 2 ** self.trips, BREAKER_MAX_COOLDOWN)
+                self.trips += 1
+                self.failures = 0
+                self.open_until = time.monotonic() + cooldown
+                logger.error(f"USB recovery keeps failing, opening circuit for {cooldown}s")
+            name, step = self.TIERS[tier]
+            start = time.monotonic()
+            try:
+                performed = step(device)
+                logger.info("USB recovery tier %s (%s) finished in %.1f ms", tier + 1, name, (time.monotonic() - start) * 1000)
+                usb_recoveries_total.inc(tier=name, outcome='performed' if performed else 'skipped')
+                return bool(performed)
+            except Exception as e:
+                logger.warning(f"USB recovery tier {tier + 1} ({name}) failed: {str(e)}")
+                usb_recoveries_total.inc(tier=name, outcome='failed')
+            return False
+
+recovery_manager = UsbRecoveryManager()
@@ -0,0 +1,156 @@
+import base64
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from label_printer.config import RENDER_WORKERS, RENDER_TIMEOUT
+from label_printer.metrics import registry, span, collect_metrics
+from label_printer.profiling import wrap
+
+logger = logging.getLogger(__name__)
+
+# Worker functions. They run in the render processes, so they take and return plain picklable
+# values: labels and QR codes come back as PNG bytes, which are small and can be handed to
+# brother_ql as they are; prepared print files come back as PIL images, 1-bit once dithered.
+
+def warm_up():
+    """Worker initializer: parse the regular face of every font family once, before the first request needs it."""
+    from label_printer.fonts import load_font_families, get_font_path, load_font
+    for family in load_font_families():
+        try:
+            load_font(get_font_path(family, False, False), 48)
+        except Exception as e:
+            logger.debug("Could not preload font family %s: %s", family, e)
+
+def render_label_png(*args, **kwargs):
+    """generate_label_image arguments in, PNG bytes out."""
+    from label_printer.image import render_label_image, image_to_png
+    return image_to_png(render_label_image(*args, **kwargs))
+
+def render_qr_png(url, exclude_text=False):
+    from label_printer.image import render_qr_label, image_to_png
+    return image_to_png(render_qr_label(url, exclude_text))
+
+def render_barcode_png(symbology, data, exclude_text=False):
+    from label_printer.image import render_barcode_label, image_to_png
+    return image_to_png(render_barcode_label(symbology, data, exclude_text))
+
+def render_sequence_png(layout, value, label_params):
+    """One label of a sequence: the value as a QR code ('qr'), with the value below it ('qr_text'), or as text1 of a label ('text')."""
+    from label_printer.image import render_label_image, render_qr_label, image_to_png
+    if layout == 'text':
+        return image_to_png(render_label_image(**dict(label_params, text1=value)))
+    return image_to_png(render_qr_label(value, exclude_text=layout == 'qr'))
+
+def prepare_upload(filename, data, **options):
+    """prepare_print_file for file contents sent over a request rather than sitting on disk."""
+    from label_printer.printing import prepare_print_file
+    return prepare_print_file(filename, source=io.BytesIO(data), **options)
+
+class WorkerFuture(Future):
+    """
+    Future of a job sent to a worker. The metrics the worker recorded are added to this process by
+    result(), in the thread that waits for it, so its stages land in the trace of that thread's print job.
+    """
+
+    def __init__(self, inner):
+        super().__init__()
+        self.inner = inner
+        self.records = []
+        inner.add_done_callback(self.resolve)
+
+    def resolve(self, inner):
+        try:
+            if inner.cancelled():
+                super().cancel()
+                self.set_running_or_notify_cancel()
+                return
+            error = inner.exception()
+            if error is not None:
+                self.set_exception(error)
+                return
+            result, self.records = inner.result()
+            self.set_result(result)
+        except InvalidStateError:
+            pass  # Cancelled by the caller in the meantime
+
+    def result(self, timeout=None):
+        result = super().result(timeout)
+        records, self.records = self.records, []
+        registry.apply(records)
+        return result
+
+    def cancel(self):
+        self.inner.cancel()
+        return super().cancel()
+
+class RenderPool:
+    """
+    Worker processes for CPU-bound PIL work, so rendering runs on all cores instead of
+    queueing behind the GIL in whatever thread received the request. Workers fork from a
+    forkserver that has already imported the image code and scanned the fonts.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                context = multiprocessing.get_context("forkserver")
+                # The web process imports these lazily; the forkserver imports them once for every worker
+                context.set_forkserver_preload(["label_printer.image", "label_printer.printing", "qrcode", "PyPDF2"])
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=warm_up)
+                logger.info("Started %s render worker(s)", self.workers)
+            return self.executor
+
+    def restart(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                logger.warning("Render pool is broken, restarting it")
+                self.executor = None
+                executor.shutdown(wait=False)
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in a worker and return its Future. With no workers configured it runs right here."""
+        fn, args = wrap(fn, args)
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        executor = self.start()
+        try:
+            return WorkerFuture(executor.submit(collect_metrics, fn, args, kwargs))
+        except (BrokenProcessPool, RuntimeError):
+            self.restart(executor)
+            return WorkerFuture(self.start().submit(collect_metrics, fn, args, kwargs))
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn in a worker and wait for its result; a job that lost its worker to a crash is retried once."""
+        with span('render'):
+            future = self.submit(fn, *args, **kwargs)
+            executor = self.executor
+            try:
+                return future.result(timeout=RENDER_TIMEOUT)
+            except BrokenProcessPool:
+                self.restart(executor)
+                return self.submit(fn, *args, **kwargs).result(timeout=RENDER_TIMEOUT)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+render_pool = RenderPool()
+
+def label_preview(**params):
+    """Render a label preview in a worker; returns the base64 PNG that generate_label_image would."""
+    return base64.b64encode(render_pool.run(render_label_png, **params)).decode('utf-8')
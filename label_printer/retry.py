@@ -0,0 +1,68 @@
+import logging
+import random
+import time
+from label_printer.metrics import retries_total, span
+
+logger = logging.getLogger(__name__)
+
+# Error classes for failed print attempts
+BUSY = "busy"            # Another process or a kernel driver holds the device
+NOT_FOUND = "not_found"  # The device vanished or could not be opened
+TRANSIENT = "transient"  # USB I/O hiccup or timeout, worth another try
+FATAL = "fatal"          # Bad input, missing binary, anything retrying won't fix
+
+class PrintError(Exception):
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+def classify_error(text):
+    """Map brother_ql/pyusb error output to one of BUSY, NOT_FOUND, TRANSIENT or FATAL."""
+    lower = (text or "").lower()
+    if "resource busy" in lower or "errno 16" in lower:
+        return BUSY
+    if "no such device" in lower or "device not found" in lower or "errno 19" in lower or ("not found" in lower and "usb" in lower):
+        return NOT_FOUND
+    if "usberror" in lower or "timed out" in lower or "timeout" in lower or "input/output error" in lower or "errno 5" in lower or "pipe error" in lower:
+        return TRANSIENT
+    return FATAL
+
+class RetryPolicy:
+    """
+    Run an attempt function until it succeeds, with jittered exponential backoff,
+    a cap on attempts and an overall deadline. The attempt function returns its result
+    on success and raises PrintError on failure; any other exception propagates unchanged.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=4.0, deadline=60.0, retry_on=(BUSY, NOT_FOUND, TRANSIENT), recover=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.recover = recover
+
+    def backoff(self, attempt):
+        """Delay before the retry following attempt (0-based): half fixed, half random."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def run(self, attempt_fn, description="print"):
+        give_up_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            try:
+                return attempt_fn()
+            except PrintError as e:
+                logger.warning(f"{description} attempt {attempt + 1}/{self.max_attempts} failed ({e.kind}): {str(e)}")
+                if e.kind not in self.retry_on or attempt + 1 == self.max_attempts:
+                    raise
+                retries_total.inc(error=e.kind)
+                if self.recover is not None and e.kind in (BUSY, NOT_FOUND, TRANSIENT):
+                    with span('usb_recovery'):
+                        self.recover()
+                delay = self.backoff(attempt)
+                if time.monotonic() + delay >= give_up_at:
+                    logger.error(f"{description} deadline of {self.deadline}s reached, giving up")
+                    raise
+                with span('retry_backoff'):
+                    time.sleep(delay)
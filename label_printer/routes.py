@@ -1,278 +1,296 @@
-from flask import render_template, request
-from label_printer.config import logger
+import logging
+from flask import render_template, request, jsonify, Response, g
 from label_printer.history import load_history, save_history
-from label_printer.fonts import font_families, get_font_path  # Updated import
-from label_printer.printing import print_label, print_qr_code
-from label_printer.image import generate_label_image
-from label_printer.utils import resolve_usb_conflicts
+from label_printer.fonts import font_family_names
+from label_printer.printing import print_label, print_qr_code, qr_code_red
+from label_printer.service import print_service
+from label_printer.sequence import SequenceError
+from label_printer.settings import settings
+from label_printer.render_pool import render_pool, render_label_png, render_qr_png, label_preview
+from label_printer import profiling
 from datetime import datetime
-import os
+import base64
 import json
-import time
 
-from flask import render_template, request
-from label_printer.config import logger
-from label_printer.history import load_history, save_history
-from label_printer.fonts import font_families, get_font_path
-from label_printer.printing import print_label, print_qr_code
-from label_printer.image import generate_label_image
-from label_printer.utils import resolve_usb_conflicts
-from datetime import datetime
-import os
-import json
-import time
+logger = logging.getLogger(__name__)
+
+JOB_STREAM_KEEPALIVE = 15  # Seconds between keepalive comments on idle job event streams
+
+def label_params_from_form(form, defaults):
+    """Read the label form into keyword arguments for render_label_png and label_preview."""
+    return {
+        "text1": form.get('text1', ''),
+        "text2": form.get('text2', ''),
+        "text3": form.get('text3', ''),
+        "length_mm": int(form.get('length', defaults.get('length_mm', 100))),
+        "size1": int(form.get('size1', 48)),
+        "size2": int(form.get('size2', 48)),
+        "size3": int(form.get('size3', 48)),
+        "face1": form.get('face1', 'DejaVuSans'),
+        "face2": form.get('face2', 'DejaVuSans'),
+        "face3": form.get('face3', 'DejaVuSans'),
+        "bold1": bool(form.get('bold1')),
+        "bold2": bool(form.get('bold2')),
+        "bold3": bool(form.get('bold3')),
+        "italic1": bool(form.get('italic1')),
+        "italic2": bool(form.get('italic2')),
+        "italic3": bool(form.get('italic3')),
+        "underline1": bool(form.get('underline1')),
+        "underline2": bool(form.get('underline2')),
+        "underline3": bool(form.get('underline3')),
+        "bg1": form.get('bg1', 'white'),
+        "bg2": form.get('bg2', 'white'),
+        "bg3": form.get('bg3', 'white'),
+        "orientation": form.get('orientation', defaults.get('orientation', 'rotated')),
+        "tape_type": form.get('tape_type', defaults.get('tape_type', 'black')),
+        "justify1": form.get('justify1', 'left'),
+        "justify2": form.get('justify2', 'left'),
+        "justify3": form.get('justify3', 'left'),
+        "spacing1": int(form.get('spacing1', 10)),
+        "spacing2": int(form.get('spacing2', 10)),
+        "barcode_type": form.get('barcode_type', ''),
+        "barcode_data": form.get('barcode_data', ''),
+        "barcode_height": int(form.get('barcode_height', 100))
+    }
+
+def label_description(params):
+    """Short job description for the shared queue view: the first non-empty line of the label text."""
+    for key in ('text1', 'text2', 'text3'):
+        line = params[key].strip().splitlines()[0] if params[key].strip() else ''
+        if line:
+            return f"label '{line[:30]}'"
+    return "label"
+
+def job_event_stream(after, job_id=None):
+    """Server-sent events for print jobs newer than sequence number after; a per-job stream ends when the job finishes."""
+    def generate():
+        seq = after
+        while True:
+            events = print_service.events_since(seq, job_id, JOB_STREAM_KEEPALIVE)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                seq = event['seq']
+                yield f"id: {seq}\ndata: {json.dumps(event)}\n\n"
+                if job_id is not None and event['stage'] == 'finished':
+                    return
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 def init_routes(app):
+    @app.before_request
+    def start_profile():
+        """Requests with an X-Profile header are sampled, along with the render and print jobs they start."""
+        if request.headers.get(profiling.PROFILE_HEADER):
+            g.profile = profiling.begin(f"{request.method} {request.path}")
+
+    @app.after_request
+    def add_profile_id(response):
+        if 'profile' in g:
+            response.headers['X-Profile-Id'] = g.profile.profile_id
+        return response
+
+    @app.teardown_request
+    def end_profile(error=None):
+        sampler = g.pop('profile', None)
+        if sampler is not None:
+            profiling.end(sampler)
+
     @app.route('/', methods=['GET', 'POST'])
     def print_new_label():
-        defaults = app.config.get('DEFAULTS', {})
+        defaults = settings.get()
         form_data = request.form.to_dict() if request.method == 'POST' else defaults
         if request.method == 'POST' and request.form.get('action') == 'Print Label':
-            logger.debug(f"POST data: {request.form}")
+            logger.debug("POST data: %s", request.form)
             try:
-                text1 = request.form.get('text1', '')
-                text2 = request.form.get('text2', '')
-                text3 = request.form.get('text3', '')
-                length_mm = int(request.form.get('length', defaults.get('length_mm', 100)))
-                size1 = int(request.form.get('size1', 48))
-                size2 = int(request.form.get('size2', 48))
-                size3 = int(request.form.get('size3', 48))
-                face1 = request.form.get('face1', 'DejaVuSans')
-                face2 = request.form.get('face2', 'DejaVuSans')
-                face3 = request.form.get('face3', 'DejaVuSans')
-                bold1 = bool(request.form.get('bold1'))
-                bold2 = bool(request.form.get('bold2'))
-                bold3 = bool(request.form.get('bold3'))
-                italic1 = bool(request.form.get('italic1'))
-                italic2 = bool(request.form.get('italic2'))
-                italic3 = bool(request.form.get('italic3'))
-                underline1 = bool(request.form.get('underline1'))
-                underline2 = bool(request.form.get('underline2'))
-                underline3 = bool(request.form.get('underline3'))
-                bg1 = request.form.get('bg1', 'white')
-                bg2 = request.form.get('bg2', 'white')
-                bg3 = request.form.get('bg3', 'white')
-                orientation = request.form.get('orientation', defaults.get('orientation', 'rotated'))
-                tape_type = request.form.get('tape_type', defaults.get('tape_type', 'black'))
-                justify1 = request.form.get('justify1', 'left')
-                justify2 = request.form.get('justify2', 'left')
-                justify3 = request.form.get('justify3', 'left')
-                spacing1 = int(request.form.get('spacing1', 10))
-                spacing2 = int(request.form.get('spacing2', 10))
-
-                result = print_label(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1, justify2, justify3, spacing1, spacing2)
+                params = label_params_from_form(request.form, defaults)
+                # Rendered here rather than in the print job, so the printer is only held to print
+                png = render_pool.run(render_label_png, **params)
+                result = print_service.submit_and_wait(print_label, png, red=params['tape_type'] == 'red_black', description=label_description(params))
 
                 # Handle dictionary response from print_label
                 if isinstance(result, dict):
                     if result['status'] == 'success':
                         message = "Label printed successfully!"
+                    elif result['status'] == 'queued':
+                        message = result['message']
                     else:
                         message = f"Error: {result['message']}"
                 else:
                     # Fallback for unexpected result type
                     message = "Error: Unexpected response from printer"
 
-                entry = {
-                    "text1": text1,
-                    "text2": text2,
-                    "text3": text3,
-                    "length_mm": length_mm,
-                    "size1": size1,
-                    "size2": size2,
-                    "size3": size3,
-                    "face1": face1,
-                    "face2": face2,
-                    "face3": face3,
-                    "bold1": bold1,
-                    "bold2": bold2,
-                    "bold3": bold3,
-                    "italic1": italic1,
-                    "italic2": italic2,
-                    "italic3": italic3,
-                    "underline1": underline1,
-                    "underline2": underline2,
-                    "underline3": underline3,
-                    "bg1": bg1,
-                    "bg2": bg2,
-                    "bg3": bg3,
-                    "orientation": orientation,
-                    "tape_type": tape_type,
-                    "justify1": justify1,
-                    "justify2": justify2,
-                    "justify3": justify3,
-                    "spacing1": spacing1,
-                    "spacing2": spacing2,
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
+                entry = dict(params, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
                 save_history(entry)
 
-                preview_image = generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1, justify2, justify3, spacing1, spacing2)
-                return render_template('index.html', message=message, history=load_history(), font_families=sorted(font_families.keys()), preview_image=preview_image, **entry)
+                preview_image = base64.b64encode(png).decode('utf-8')
+                return render_template('index.html', message=message, history=load_history(), font_families=font_family_names(), preview_image=preview_image, **entry)
             except Exception as e:
                 logger.error(f"Error processing form: {str(e)}")
-                return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=sorted(font_families.keys()), **form_data), 400
-        return render_template('index.html', history=load_history(), font_families=sorted(font_families.keys()), **form_data)
+                return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=font_family_names(), **form_data), 400
+        return render_template('index.html', history=load_history(), font_families=font_family_names(), **form_data)
     
-    @app.route('/preview', methods=['POST'])
-    def preview_label():
-        defaults = app.config.get('DEFAULTS', {})
-        logger.debug(f"Preview POST data: {request.form}")
+    @app.route('/jobs', methods=['GET'])
+    def list_jobs():
+        """Queued and running print jobs in print order, and the event sequence number to stream from."""
+        return jsonify({'jobs': print_service.snapshot(), 'seq': print_service.latest_seq()})
+
+    @app.route('/jobs/label', methods=['POST'])
+    def submit_label_job():
+        """Queue a label from the form and answer at once; progress is reported on the job event streams."""
+        defaults = settings.get()
+        logger.debug("Job POST data: %s", request.form)
         try:
-            text1 = request.form.get('text1', '')
-            text2 = request.form.get('text2', '')
-            text3 = request.form.get('text3', '')
-            length_mm = int(request.form.get('length', defaults.get('length_mm', 100)))
-            size1 = int(request.form.get('size1', 48))
-            size2 = int(request.form.get('size2', 48))
-            size3 = int(request.form.get('size3', 48))
-            face1 = request.form.get('face1', 'DejaVuSans')
-            face2 = request.form.get('face2', 'DejaVuSans')
-            face3 = request.form.get('face3', 'DejaVuSans')
-            bold1 = bool(request.form.get('bold1'))
-            bold2 = bool(request.form.get('bold2'))
-            bold3 = bool(request.form.get('bold3'))
-            italic1 = bool(request.form.get('italic1'))
-            italic2 = bool(request.form.get('italic2'))
-            italic3 = bool(request.form.get('italic3'))
-            underline1 = bool(request.form.get('underline1'))
-            underline2 = bool(request.form.get('underline2'))
-            underline3 = bool(request.form.get('underline3'))
-            bg1 = request.form.get('bg1', 'white')
-            bg2 = request.form.get('bg2', 'white')
-            bg3 = request.form.get('bg3', 'white')
-            orientation = request.form.get('orientation', defaults.get('orientation', 'rotated'))
-            tape_type = request.form.get('tape_type', defaults.get('tape_type', 'black'))
-            justify1 = request.form.get('justify1', 'left')
-            justify2 = request.form.get('justify2', 'left')
-            justify3 = request.form.get('justify3', 'left')
-            spacing1 = int(request.form.get('spacing1', 10))
-            spacing2 = int(request.form.get('spacing2', 10))
+            params = label_params_from_form(request.form, defaults)
+        except ValueError as e:
+            logger.error(f"Invalid label form: {str(e)}")
+            return jsonify({'status': 'error', 'message': f"Invalid form data: {str(e)}"}), 400
+        try:
+            png = render_pool.run(render_label_png, **params)
+        except Exception as e:
+            logger.error(f"Error rendering label: {str(e)}")
+            return jsonify({'status': 'error', 'message': f"Cannot render label: {str(e)}"}), 500
+        job = print_service.submit(print_label, png, red=params['tape_type'] == 'red_black', description=label_description(params))
+        save_history(dict(params, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return jsonify({'status': 'queued', 'job_id': job.id, 'description': job.description}), 202
 
-            preview_image = generate_label_image(text1, text2, text3, length_mm, size1, size2, size3, face1, face2, face3, bold1, bold2, bold3, italic1, italic2, italic3, underline1, underline2, underline3, bg1, bg2, bg3, orientation, tape_type, justify1, justify2, justify3, spacing1, spacing2)
+    @app.route('/jobs/events', methods=['GET'])
+    def job_events():
+        """
+        Server-sent events for every print job: queue positions and progress stages, so all users see the same queue.
+        Starts after ?after=<seq> (from /jobs), or after Last-Event-ID when the browser reconnects.
+        """
+        after = request.headers.get('Last-Event-ID', type=int)
+        if after is None:
+            after = request.args.get('after', print_service.latest_seq(), type=int)
+        return job_event_stream(after)
 
-            entry = {
-                "text1": text1,
-                "text2": text2,
-                "text3": text3,
-                "length_mm": length_mm,
-                "size1": size1,
-                "size2": size2,
-                "size3": size3,
-                "face1": face1,
-                "face2": face2,
-                "face3": face3,
-                "bold1": bold1,
-                "bold2": bold2,
-                "bold3": bold3,
-                "italic1": italic1,
-                "italic2": italic2,
-                "italic3": italic3,
-                "underline1": underline1,
-                "underline2": underline2,
-                "underline3": underline3,
-                "bg1": bg1,
-                "bg2": bg2,
-                "bg3": bg3,
-                "orientation": orientation,
-                "tape_type": tape_type,
-                "justify1": justify1,
-                "justify2": justify2,
-                "justify3": justify3,
-                "spacing1": spacing1,
-                "spacing2": spacing2
-            }
-            return render_template('index.html', message="Label preview generated", history=load_history(), font_families=sorted(font_families.keys()), preview_image=preview_image, **entry)
+    @app.route('/jobs/<job_id>/events', methods=['GET'])
+    def single_job_events(job_id):
+        """Server-sent events for one print job, from its first event until it finishes."""
+        if print_service.find(job_id) is None and not print_service.events_since(0, job_id, 0):
+            return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+        return job_event_stream(request.headers.get('Last-Event-ID', 0, type=int), job_id)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint for the print service process."""
+        return Response(print_service.metrics(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/traces', methods=['GET'])
+    def metrics_traces():
+        """Per-stage timings of recent print jobs; ?job_id= narrows it to one job."""
+        return jsonify({'traces': print_service.traces(request.args.get('job_id'))})
+
+    @app.route('/preview', methods=['POST'])
+    def preview_label():
+        defaults = settings.get()
+        logger.debug("Preview POST data: %s", request.form)
+        try:
+            entry = label_params_from_form(request.form, defaults)
+            preview_image = label_preview(**entry)
+            return render_template('index.html', message="Label preview generated", history=load_history(), font_families=font_family_names(), preview_image=preview_image, **entry)
         except Exception as e:
             logger.error(f"Error generating preview: {str(e)}")
-            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=sorted(font_families.keys()), **request.form.to_dict()), 400
+            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=font_family_names(), **request.form.to_dict()), 400
 
     @app.route('/print_qr', methods=['POST'])
     def print_qr():
-        defaults = app.config.get('DEFAULTS', {})
+        defaults = settings.get()
         try:
             url = request.url_root.rstrip('/')
-            logger.debug(f"Generating QR code for URL: {url}")
-            for attempt in range(3):
-                try:
-                    result = print_qr_code(url)
-                    if "Printing was successful" in result.stdout or "Printing was successful" in result.stderr:
-                        logger.info("QR code printed successfully.")
-                        return render_template('index.html', message="QR code printed successfully!", history=load_history(), font_families=sorted(font_families.keys()), **defaults)
-                    logger.error(f"Print attempt {attempt + 1}/3 failed: {result.stderr}")
-                    resolve_usb_conflicts()
-                    time.sleep(2)
-                except Exception as e:
-                    logger.error(f"Error printing QR code (attempt {attempt + 1}/3): {e}")
-                    resolve_usb_conflicts()
-                    time.sleep(2)
-            logger.error("Failed to print QR code after 3 attempts.")
-            return render_template('index.html', message="Failed to print QR code after retries", history=load_history(), font_families=sorted(font_families.keys()), **defaults), 500
+            logger.debug("Generating QR code for URL: %s", url)
+            png = render_pool.run(render_qr_png, url)
+            result = print_service.submit_and_wait(print_qr_code, png, red=qr_code_red(), description="QR code")
+            if result['status'] == 'success':
+                logger.info("QR code printed successfully.")
+                return render_template('index.html', message="QR code printed successfully!", history=load_history(), font_families=font_family_names(), **defaults)
+            if result['status'] == 'queued':
+                return render_template('index.html', message=result['message'], history=load_history(), font_families=font_family_names(), **defaults)
+            logger.error(f"Failed to print QR code: {result['message']}")
+            return render_template('index.html', message="Failed to print QR code after retries", history=load_history(), font_families=font_family_names(), **defaults), 500
         except Exception as e:
             logger.error(f"Error printing QR code: {str(e)}")
-            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=sorted(font_families.keys()), **defaults), 400
+            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=font_family_names(), **defaults), 400
 
     @app.route('/print_qr_custom', methods=['POST'])
     def print_qr_custom():
-        defaults = app.config.get('DEFAULTS', {})
+        defaults = settings.get()
         try:
             qr_text = request.form.get('qr_text', '')
             exclude_text = bool(request.form.get('exclude_text'))
             if not qr_text:
-                return render_template('index.html', message="Error: No text provided for QR code", history=load_history(), font_families=sorted(font_families.keys()), **defaults)
-            logger.debug(f"Generating QR code for custom text: {qr_text}, exclude_text: {exclude_text}")
-            for attempt in range(3):
-                try:
-                    result = print_qr_code(qr_text, exclude_text=exclude_text)
-                    if "Printing was successful" in result.stdout or "Printing was successful" in result.stderr:
-                        logger.info("Custom QR code printed successfully.")
-                        return render_template('index.html', message="Custom QR code printed successfully!", history=load_history(), font_families=sorted(font_families.keys()), qr_text=qr_text, exclude_text=exclude_text, **defaults)
-                    logger.error(f"Print attempt {attempt + 1}/3 failed: {result.stderr}")
-                    resolve_usb_conflicts()
-                    time.sleep(2)
-                except Exception as e:
-                    logger.error(f"Error printing custom QR code (attempt {attempt + 1}/3): {e}")
-                    resolve_usb_conflicts()
-                    time.sleep(2)
-            logger.error("Failed to print custom QR code after 3 attempts.")
-            return render_template('index.html', message="Failed to print custom QR code after retries", history=load_history(), font_families=sorted(font_families.keys()), qr_text=qr_text, exclude_text=exclude_text, **defaults), 500
+                return render_template('index.html', message="Error: No text provided for QR code", history=load_history(), font_families=font_family_names(), **defaults)
+            logger.debug("Generating QR code for custom text: %s, exclude_text: %s", qr_text, exclude_text)
+            png = render_pool.run(render_qr_png, qr_text, exclude_text)
+            result = print_service.submit_and_wait(print_qr_code, png, red=qr_code_red(), description="custom QR code")
+            if result['status'] == 'success':
+                logger.info("Custom QR code printed successfully.")
+                return render_template('index.html', message="Custom QR code printed successfully!", history=load_history(), font_families=font_family_names(), qr_text=qr_text, exclude_text=exclude_text, **defaults)
+            if result['status'] == 'queued':
+                return render_template('index.html', message=result['message'], history=load_history(), font_families=font_family_names(), qr_text=qr_text, exclude_text=exclude_text, **defaults)
+            logger.error(f"Failed to print custom QR code: {result['message']}")
+            return render_template('index.html', message="Failed to print custom QR code after retries", history=load_history(), font_families=font_family_names(), qr_text=qr_text, exclude_text=exclude_text, **defaults), 500
         except Exception as e:
             logger.error(f"Error printing custom QR code: {str(e)}")
-            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=sorted(font_families.keys()), **defaults), 400
+            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=font_family_names(), **defaults), 400
+
+    @app.route('/print_sequence', methods=['POST'])
+    def print_sequence():
+        """Start a numbered label run from the sequence form; its labels show up in the print queue."""
+        defaults = settings.get()
+        name = request.form.get('sequence_name', '').strip()
+        try:
+            if not name:
+                raise SequenceError("A sequence name is required")
+            if request.form.get('resume'):
+                status = print_service.start_sequence(name, None, True)
+            else:
+                spec = {
+                    'format': request.form.get('sequence_format', '{n}'),
+                    'start': int(request.form.get('sequence_start', 1)),
+                    'count': int(request.form.get('sequence_count', 1)),
+                    'step': int(request.form.get('sequence_step', 1)),
+                    'layout': request.form.get('sequence_layout', 'qr_text'),
+                    'label': label_params_from_form({'size1': request.form.get('sequence_size', 48)}, defaults),
+                }
+                status = print_service.start_sequence(name, spec)
+            message = f"Sequence {name} started successfully: {status['remaining']} label(s) to print"
+        except (SequenceError, ValueError) as e:
+            logger.error(f"Error starting sequence {name}: {str(e)}")
+            message = f"Error: {str(e)}"
+        return render_template('index.html', message=message, history=load_history(), font_families=font_family_names(), **defaults)
 
     @app.route('/save_defaults', methods=['POST'])
     def save_defaults():
-        defaults = app.config.get('DEFAULTS', {})
+        defaults = settings.get()
         try:
             length_mm = int(request.form.get('length', defaults.get('length_mm', 100)))
             orientation = request.form.get('orientation', defaults.get('orientation', 'rotated'))
             tape_type = request.form.get('tape_type', defaults.get('tape_type', 'black'))
             
-            settings = {
+            new_settings = {
                 "length_mm": length_mm,
                 "orientation": orientation,
                 "tape_type": tape_type
             }
-            settings_file = "/home/odroid/label_printer_web/settings.txt"
-            with open(settings_file, "w") as f:
-                json.dump(settings, f)
-            logger.debug(f"Saved default settings: {settings}")
-            
-            app.config['DEFAULTS'] = settings
+            settings.save(new_settings)
             
             form_data = request.form.to_dict()
             form_data['length_mm'] = length_mm
             
-            return render_template('index.html', message="Defaults saved successfully!", history=load_history(), font_families=sorted(font_families.keys()), **form_data)
+            return render_template('index.html', message="Defaults saved successfully!", history=load_history(), font_families=font_family_names(), **form_data)
         except Exception as e:
             logger.error(f"Error saving defaults: {str(e)}")
-            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=sorted(font_families.keys()), **defaults), 400
+            return render_template('index.html', message=f"Error: {str(e)}", history=load_history(), font_families=font_family_names(), **defaults), 400
 
     @app.route('/reprint', methods=['POST'])
     def reprint_label():
-        defaults = app.config.get('DEFAULTS', {})
+        defaults = settings.get()
         label_id = int(request.form.get('label_id', -1))
         history = load_history()[::-1]
         if 0 <= label_id < len(history):
             label = history[label_id]
-            return render_template('index.html', message="Label loaded for editing", history=load_history(), font_families=sorted(font_families.keys()), **label)
-        return render_template('index.html', message="Invalid label selection", history=load_history(), font_families=sorted(font_families.keys()), **defaults)
+            return render_template('index.html', message="Label loaded for editing", history=load_history(), font_families=font_family_names(), **label)
+        return render_template('index.html', message="Invalid label selection", history=load_history(), font_families=font_family_names(), **defaults)
@@ -0,0 +1,232 @@
+import collections
+import json
+import logging
+import os
+import string
+import threading
+import time
+from label_printer.config import SEQUENCE_FILE, RENDER_TIMEOUT
+from label_printer.print_queue import print_queue
+from label_printer.printing import print_sequence_label
+from label_printer.render_pool import render_pool, render_sequence_png
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ('text', 'qr', 'qr_text')
+QUEUE_AHEAD = 3  # Labels of a run waiting in the print queue, so the printer never waits for the next one
+MAX_SEQUENCE_COUNT = 100000
+
+class SequenceError(Exception):
+    pass
+
+def format_value(fmt, n):
+    """Format counter value n with fmt, e.g. "ASSET-{n:06d}". Only the field n is allowed."""
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(fmt) if field is not None]
+    except ValueError as e:
+        raise SequenceError(f"Invalid format: {str(e)}")
+    if not fields or any(field != 'n' for field in fields):
+        raise SequenceError("Format must contain the counter as {n}, e.g. ASSET-{n:06d}, and no other fields")
+    try:
+        return fmt.format(n=n)
+    except (ValueError, TypeError) as e:
+        raise SequenceError(f"Invalid format: {str(e)}")
+
+class SequenceStore:
+    """Sequence definitions and the last value printed of each, in SEQUENCE_FILE, so a run can resume after a restart."""
+
+    def __init__(self, path=SEQUENCE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading {self.path}: {str(e)}")
+            return {}
+
+    def update(self, name, **fields):
+        with self.lock:
+            sequences = self.load()
+            sequences[name] = dict(sequences.get(name, {}), **fields, updated=time.time())
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(sequences, f)
+            os.replace(tmp_path, self.path)
+
+    def get(self, name):
+        with self.lock:
+            return self.load().get(name)
+
+class SequenceRun:
+    """
+    Print values start, start + step, ... of one sequence. Labels are rendered ahead in the render pool,
+    as many at a time as there are workers and more, and fed to the print queue a few at a time, so the
+    printer runs continuously while other jobs can still get in between.
+    """
+
+    def __init__(self, name, spec, next_n, remaining, store):
+        self.name = name
+        self.spec = spec
+        self.next_n = next_n
+        self.remaining = remaining
+        self.store = store
+        self.state = 'running'
+        self.printed = 0
+        self.last_value = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.stopped = threading.Event()  # Set by the first label that fails; see print_sequence_label
+        self.thread = threading.Thread(target=self.run, name=f"sequence-{name}", daemon=True)
+
+    def status(self):
+        return {
+            'name': self.name, 'format': self.spec['format'], 'layout': self.spec['layout'],
+            'state': self.state, 'printed': self.printed, 'remaining': self.remaining,
+            'last_value': self.last_value, 'error': self.error,
+        }
+
+    def render(self, n):
+        value = format_value(self.spec['format'], n)
+        return n, value, render_pool.submit(render_sequence_png, self.spec['layout'], value, self.spec['label'])
+
+    def run(self):
+        render_ahead = max(2, 2 * render_pool.workers)
+        step = self.spec['step']
+        red = self.spec['label'].get('tape_type') == 'red_black'
+        numbers = iter(range(self.next_n, self.next_n + self.remaining * step, step))
+        rendering = collections.deque()
+        queued = collections.deque()
+        logger.info("Sequence %s: printing %s label(s) from %s", self.name, self.remaining, format_value(self.spec['format'], self.next_n))
+        error = None
+        try:
+            for n in numbers:
+                rendering.append(self.render(n))
+                if len(rendering) < render_ahead:
+                    continue
+                self.queue_next(rendering, queued, red)
+                if self.cancelled.is_set() or not self.collect(queued, QUEUE_AHEAD - 1):
+                    break
+            while rendering and not self.cancelled.is_set() and self.state == 'running':
+                self.queue_next(rendering, queued, red)
+                if not self.collect(queued, QUEUE_AHEAD - 1):
+                    break
+            if self.state == 'running':
+                self.collect(queued, 0)
+        except Exception as e:
+            logger.error(f"Sequence {self.name} failed: {str(e)}")
+            error = str(e)
+        for _, _, future in rendering:
+            future.cancel()
+        # Labels queued when the run stopped still come out of the print queue: record the ones that print, so a
+        # resume starts after them. Behind a failed label they skip themselves. The state changes only afterwards,
+        # so the run can't be resumed while they are still queued.
+        self.drain(queued)
+        if error is not None:
+            self.state = 'failed'
+            self.error = error
+        if self.state == 'running':
+            self.state = 'cancelled' if self.cancelled.is_set() else 'finished'
+        logger.info("Sequence %s %s after %s label(s), last %s", self.name, self.state, self.printed, self.last_value)
+
+    def queue_next(self, rendering, queued, red):
+        n, value, future = rendering.popleft()
+        png = future.result(timeout=RENDER_TIMEOUT)
+        job = print_queue.submit(print_sequence_label, png, value, red=red, stopped=self.stopped, description=f"{self.name} {value}")
+        queued.append((n, value, job))
+
+    def collect(self, queued, keep):
+        """Wait until at most keep labels of this run are queued, recording each printed one. False once one fails."""
+        while len(queued) > keep:
+            n, value, job = queued.popleft()
+            job.wait()
+            if job.outcome() != 'success':
+                self.error = f"{value}: {job.message()}"
+                logger.error(f"Sequence {self.name} stopped at {self.error}")
+                self.drain(queued)
+                self.state = 'failed'
+                return False
+            self.record(n, value)
+        return True
+
+    def drain(self, queued):
+        """Wait for the labels of this run still in the print queue, recording those that printed."""
+        while queued:
+            n, value, job = queued.popleft()
+            job.wait()
+            if job.outcome() == 'success':
+                self.record(n, value)
+
+    def record(self, n, value):
+        self.printed += 1
+        self.remaining -= 1
+        self.last_value = value
+        self.store.update(self.name, last_printed=n)
+
+class SequenceManager:
+    def __init__(self):
+        self.store = SequenceStore()
+        self.runs = {}
+        self.lock = threading.Lock()
+
+    def start(self, name, spec, resume=False):
+        """
+        Start printing sequence name. spec holds format, start, count, step, layout and label (render_label_png
+        keyword arguments; the value goes in text1 for the 'text' layout). With resume, the stored sequence
+        of that name continues after its last printed value and spec is ignored.
+        """
+        with self.lock:
+            run = self.runs.get(name)
+            if run is not None and run.state == 'running':
+                raise SequenceError(f"Sequence {name} is already printing")
+            if resume:
+                stored = self.store.get(name)
+                if stored is None:
+                    raise SequenceError(f"No stored sequence named {name} to resume")
+                spec = {key: stored[key] for key in ('format', 'start', 'count', 'step', 'layout', 'label')}
+                end = spec['start'] + (spec['count'] - 1) * spec['step']
+                last = stored.get('last_printed')
+                next_n = spec['start'] if last is None else last + spec['step']
+                remaining = max(0, (end - next_n) // spec['step'] + 1)
+                if not remaining:
+                    raise SequenceError(f"Sequence {name} is already complete")
+            else:
+                if spec['layout'] not in LAYOUTS:
+                    raise SequenceError(f"layout must be one of {', '.join(LAYOUTS)}")
+                if not 1 <= spec['count'] <= MAX_SEQUENCE_COUNT or spec['step'] < 1:
+                    raise SequenceError(f"count must be between 1 and {MAX_SEQUENCE_COUNT} and step at least 1")
+                format_value(spec['format'], spec['start'])
+                self.store.update(name, last_printed=None, **spec)
+                next_n, remaining = spec['start'], spec['count']
+            run = SequenceRun(name, spec, next_n, remaining, self.store)
+            self.runs[name] = run
+        run.thread.start()
+        return run.status()
+
+    def cancel(self, name):
+        """Stop a run after the labels already in the print queue."""
+        run = self.runs.get(name)
+        if run is None:
+            raise SequenceError(f"Sequence {name} is not printing")
+        run.cancelled.set()
+        return run.status()
+
+    def status(self):
+        """Every stored sequence, with the progress of its current or last run."""
+        sequences = self.store.load()
+        with self.lock:
+            runs = dict(self.runs)
+        result = []
+        for name, stored in sorted(sequences.items()):
+            entry = {key: stored.get(key) for key in ('format', 'start', 'count', 'step', 'layout', 'last_printed')}
+            entry['name'] = name
+            entry['last_printed_value'] = format_value(stored['format'], stored['last_printed']) if stored.get('last_printed') is not None else None
+            entry['run'] = runs[name].status() if name in runs else None
+            result.append(entry)
+        return result
+
+sequence_manager = SequenceManager()
@@ -0,0 +1,299 @@
+import collections
+import logging
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from label_printer.backends import printer_backend
+from label_printer.config import SERVICE_KEY_FILE
+from label_printer.metrics import registry
+from label_printer.profiling import wrap
+from label_printer.print_queue import print_queue, PrintJob, PRINT_WAIT_TIMEOUT
+from label_printer.sequence import sequence_manager
+from label_printer.startup import startup_jobs
+from label_printer.status import status_monitor
+
+logger = logging.getLogger(__name__)
+
+JOB_HISTORY = 100  # Finished jobs kept so a web worker can still collect their results
+# What web workers may call on the service process
+SERVICE_METHODS = {'submit', 'wait_job', 'snapshot', 'latest_seq', 'events_since', 'status', 'wait_for_status', 'startup_status',
+                   'start_sequence', 'cancel_sequence', 'sequences', 'metrics', 'traces',
+                   'backend_status', 'inject_fault'}
+
+class ServiceUnavailable(Exception):
+    """Raised in a web worker when the print service process cannot be reached."""
+
+def load_service_key(create=False):
+    """The shared secret that authenticates web workers to the service process; the service creates it on first start."""
+    if create and not os.path.exists(SERVICE_KEY_FILE):
+        fd = os.open(SERVICE_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(secrets.token_bytes(32))
+    with open(SERVICE_KEY_FILE, 'rb') as f:
+        return f.read()
+
+class LocalPrinter:
+    """The print queue and status monitor of this process, as the service process exposes them."""
+
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, func, args, kwargs, description):
+        job = print_queue.submit(func, *args, description=description, **kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+            # Only finished jobs are dropped: a web worker may still wait for any queued one, however many the printer is holding
+            finished = [job_id for job_id, entry in self.jobs.items() if entry.finished.is_set()]
+            for job_id in finished[:len(self.jobs) - JOB_HISTORY]:
+                del self.jobs[job_id]
+        return job
+
+    def wait_job(self, job_id, timeout):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown job {job_id}")
+        finished = job.wait(timeout)
+        return {'finished': finished, 'result': job.result, 'error': str(job.error) if job.error is not None else None}
+
+    def snapshot(self):
+        return print_queue.snapshot()
+
+    def latest_seq(self):
+        return print_queue.latest_seq()
+
+    def events_since(self, seq, job_id=None, timeout=None):
+        return print_queue.events_since(seq, job_id, timeout)
+
+    def status(self):
+        return status_monitor.get()
+
+    def wait_for_status(self, version, timeout=None):
+        return status_monitor.wait_for_change(version, timeout)
+
+    def startup_status(self):
+        return startup_jobs.status()
+
+    def start_sequence(self, name, spec, resume=False):
+        return sequence_manager.start(name, spec, resume)
+
+    def cancel_sequence(self, name):
+        return sequence_manager.cancel(name)
+
+    def sequences(self):
+        return sequence_manager.status()
+
+    def metrics(self):
+        return registry.render()
+
+    def traces(self, job_id=None):
+        return registry.recent_traces(job_id)
+
+    def backend_status(self):
+        return printer_backend.describe()
+
+    def inject_fault(self, fault, count=1):
+        printer_backend.inject_fault(fault, count)
+        return printer_backend.describe()
+
+class RemoteJob:
+    """A job queued in the service process, seen from a web worker. wait() fetches its result over the socket."""
+
+    outcome = PrintJob.outcome
+    message = PrintJob.message
+
+    def __init__(self, client, job_id, description):
+        self.client = client
+        self.id = job_id
+        self.description = description
+        self.stage = 'queued'
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.finished.is_set():
+            state = self.client.call('wait_job', self.id, timeout)
+            if state['finished']:
+                self.result = state['result']
+                self.error = Exception(state['error']) if state['error'] is not None else None
+                self.finished.set()
+        return self.finished.is_set()
+
+class ServiceClient:
+    """One connection to the service process per thread, opened on first use and reopened if the service restarted."""
+
+    def __init__(self, address):
+        self.address = address
+        self.local = threading.local()
+
+    def connect(self):
+        try:
+            return Client(self.address, family='AF_UNIX', authkey=load_service_key())
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ServiceUnavailable(f"Print service is not running: {str(e)}")
+
+    def call(self, method, *args):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        try:
+            conn.send((method, args))
+        except OSError:
+            # Stale connection from before a service restart; nothing was sent, so it is safe to retry
+            conn.close()
+            conn = self.local.conn = self.connect()
+            conn.send((method, args))
+        try:
+            status, value = conn.recv()
+        except (OSError, EOFError) as e:
+            conn.close()
+            self.local.conn = None
+            raise ServiceUnavailable(f"Print service closed the connection: {str(e)}")
+        if status == 'error':
+            raise value
+        return value
+
+class PrintService:
+    """
+    What the web tier needs from the printer side: queue jobs, follow them and read the printer status.
+    In a single process this is the local print queue and status monitor. Under the WSGI front end each
+    worker connect()s to the one service process that owns them, so printing stays single-writer.
+    """
+
+    def __init__(self):
+        self.local = LocalPrinter()
+        self.client = None
+
+    def connect(self, address):
+        self.client = ServiceClient(address)
+
+    def call(self, method, *args):
+        if self.client is None:
+            return getattr(self.local, method)(*args)
+        return self.client.call(method, *args)
+
+    def submit(self, func, *args, description=None, **kwargs):
+        """Queue func(*args, **kwargs); returns the job. func must be a module-level function and its arguments picklable."""
+        if self.client is None:
+            return self.local.submit(func, args, kwargs, description)
+        description = description or func.__name__
+        func, args = wrap(func, args)
+        job_id, description = self.client.call('submit', func, args, kwargs, description)
+        return RemoteJob(self.client, job_id, description)
+
+    def snapshot(self):
+        return self.call('snapshot')
+
+    def latest_seq(self):
+        return self.call('latest_seq')
+
+    def events_since(self, seq, job_id=None, timeout=None):
+        return self.call('events_since', seq, job_id, timeout)
+
+    def find(self, job_id):
+        """The snapshot entry of a queued or running job, or None."""
+        return next((entry for entry in self.snapshot() if entry['job_id'] == job_id), None)
+
+    def status(self):
+        """(snapshot, version) of the printer status."""
+        return self.call('status')
+
+    def wait_for_status(self, version, timeout=None):
+        return self.call('wait_for_status', version, timeout)
+
+    def startup_status(self):
+        """Startup jobs of the process that owns the printer; see label_printer.startup."""
+        return self.call('startup_status')
+
+    def start_sequence(self, name, spec, resume=False):
+        """Start a numbered label run; see SequenceManager.start. Raises SequenceError."""
+        return self.call('start_sequence', name, spec, resume)
+
+    def cancel_sequence(self, name):
+        return self.call('cancel_sequence', name)
+
+    def sequences(self):
+        return self.call('sequences')
+
+    def metrics(self):
+        """Prometheus text of the process that prints: render and print stage timings, job, retry, USB recovery and cache counters."""
+        return self.call('metrics')
+
+    def traces(self, job_id=None):
+        """Stage timings of recent print jobs, or of job_id only."""
+        return self.call('traces', job_id)
+
+    def backend_status(self):
+        """What prints: the USB printer through brother_ql, or the simulator with its counters and pending faults."""
+        return self.call('backend_status')
+
+    def inject_fault(self, fault, count=1):
+        """Make the next count print attempts fail with fault; raises ValueError unless the simulator prints."""
+        return self.call('inject_fault', fault, count)
+
+    def submit_and_wait(self, func, *args, timeout=PRINT_WAIT_TIMEOUT, description=None, **kwargs):
+        """
+        Queue a print job and wait for its result while the printer is connected.
+        If the printer is offline, or the job doesn't finish in time, return a 'queued' status instead of blocking.
+        """
+        job = self.submit(func, *args, description=description, **kwargs)
+        if not self.status()[0]['online']:
+            return {'status': 'queued', 'job_id': job.id, 'message': 'Printer is offline. The job is queued and will print when the printer is reconnected.'}
+        if not job.wait(timeout):
+            return {'status': 'queued', 'job_id': job.id, 'message': 'The job is queued and will print shortly.'}
+        if job.error is not None:
+            return {'status': 'error', 'job_id': job.id, 'message': str(job.error)}
+        return job.result
+
+    def serve(self, address):
+        """Answer web workers on a unix socket at address. Blocks; run it in the process that owns the printer."""
+        authkey = load_service_key(create=True)
+        if os.path.exists(address):
+            os.unlink(address)
+        os.makedirs(os.path.dirname(address), exist_ok=True)
+        listener = Listener(address, family='AF_UNIX', authkey=authkey)
+        os.chmod(address, 0o600)
+        logger.info("Print service listening on %s", address)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.warning(f"Rejected print service connection: {str(e)}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), name="print-service-conn", daemon=True).start()
+        finally:
+            # Also removes the socket file, so web workers see at once that the service is gone
+            listener.close()
+            logger.info("Print service stopped listening on %s", address)
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (OSError, EOFError):
+                    return
+                try:
+                    if method not in SERVICE_METHODS:
+                        raise ValueError(f"Unknown print service method {method}")
+                    result = getattr(self.local, method)(*args)
+                    if method == 'submit':
+                        result = (result.id, result.description)
+                    reply = ('ok', result)
+                except Exception as e:
+                    reply = ('error', e)
+                try:
+                    conn.send(reply)
+                except (OSError, EOFError):
+                    return
+                except Exception as e:
+                    # The result or exception did not pickle
+                    logger.error(f"Print service could not answer {method}: {str(e)}")
+                    conn.send(('error', RuntimeError(str(e))))
+
+print_service = PrintService()
@@ -0,0 +1,140 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from label_printer.config import SETTINGS_FILE, LEGACY_SETTINGS_FILE
+
+logger = logging.getLogger(__name__)
+
+class Settings:
+    """
+    A JSON settings file kept in memory; by default the saved label defaults (length_mm, orientation,
+    tape_type) of SETTINGS_FILE. get() never touches the disk. save() replaces the file atomically, and every process that called
+    watch() reloads its copy when the file changes, so the web workers, the print service and anyone
+    editing the file by hand see the same settings.
+    """
+
+    def __init__(self, path=SETTINGS_FILE, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.snapshot = {}
+        self.signature = None
+        self.lock = threading.Lock()
+        self.observer = None
+        self.listeners = []
+
+    def get(self):
+        """A copy of the current settings."""
+        return dict(self.snapshot)
+
+    def on_change(self, listener):
+        """Call listener(settings) whenever the settings are loaded or saved with new values."""
+        self.listeners.append(listener)
+
+    def notify(self, settings):
+        for listener in self.listeners:
+            try:
+                listener(settings)
+            except Exception as e:
+                logger.error(f"Settings listener failed: {str(e)}")
+
+    def file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def load(self):
+        """Read the file into the snapshot, unless it is unchanged since the last load. Returns the settings."""
+        settings = self.reload()
+        if settings is None:
+            return self.get()
+        self.notify(settings)
+        return settings
+
+    def reload(self):
+        """The new settings if the file changed, else None."""
+        with self.lock:
+            signature = self.file_signature()
+            if signature == self.signature and signature is not None:
+                return None
+            settings = {}
+            if signature is None:
+                logger.debug(f"Settings file {self.path} does not exist")
+            else:
+                try:
+                    with open(self.path, 'r') as f:
+                        settings = json.load(f)
+                    logger.debug(f"Loaded settings from {self.path}: {settings}")
+                except (OSError, ValueError) as e:
+                    # Keep what we had until the file changes again; a half-written edit is followed by another change event
+                    logger.error(f"Error loading {self.path}: {str(e)}")
+                    self.signature = signature
+                    return None
+            changed = settings != self.snapshot
+            self.snapshot = settings
+            self.signature = signature
+            return self.get() if changed else None
+
+    def move_legacy_file(self):
+        """Move the file over from where older versions kept it, unless it is already in place."""
+        if self.legacy_path is None or os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            os.replace(self.legacy_path, self.path)
+            logger.info(f"Moved {self.legacy_path} to {self.path}")
+        except FileNotFoundError:
+            pass  # Another process moved it first
+        except OSError as e:
+            logger.error(f"Error moving {self.legacy_path} to {self.path}: {str(e)}")
+
+    def save(self, settings):
+        """Write settings to a temporary file and rename it over the old one, so no reader sees a partial file."""
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock, open(f"{self.path}.lock", 'w') as lock_file:
+            # Several processes may save at once; they share the temporary file name
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with open(tmp_path, 'w') as f:
+                json.dump(settings, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.snapshot = dict(settings)
+            self.signature = self.file_signature()
+        self.notify(self.get())
+        logger.debug(f"Saved settings to {self.path}: {settings}")
+
+    def watch(self):
+        """Load the settings and reload them whenever the file changes. Once per process."""
+        self.move_legacy_file()
+        self.load()
+        if self.observer is not None:
+            return
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        settings = self
+
+        class SettingsFileHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # The directory also holds other watched files and our .tmp and .lock files
+                if settings.path not in (event.src_path, getattr(event, 'dest_path', None)):
+                    return
+                # Our own reads show up as opened and closed_no_write events
+                if event.event_type in ('opened', 'closed_no_write'):
+                    return
+                settings.load()
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        self.observer = Observer()
+        self.observer.schedule(SettingsFileHandler(), directory, recursive=False)
+        self.observer.daemon = True
+        self.observer.start()
+        logger.info(f"Watching {self.path} for changes")
+
+settings = Settings(legacy_path=LEGACY_SETTINGS_FILE)
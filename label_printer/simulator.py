@@ -0,0 +1,332 @@
+import collections
+import io
+import logging
+import os
+import random
+import struct
+import subprocess
+import threading
+import time
+from label_printer.config import PRINTER_MODEL, PRINTER_LABEL, SIMULATOR_DIR, SIMULATOR_KEEP, SIMULATOR_SPEED, SIMULATOR_FAULTS
+from label_printer.device import PrinterOffline, printer_monitor
+from label_printer.metrics import span
+from label_printer.print_queue import report_progress
+from label_printer.retry import PrintError, BUSY, NOT_FOUND, FATAL
+
+logger = logging.getLogger(__name__)
+
+FAULTS = ('busy', 'usb_reset', 'media_missing')
+
+# Rough QL-810W figures; simulated waits are divided by SIMULATOR_SPEED
+DOTS_PER_MM = 11.811
+PRINT_SPEED = 176  # mm/s printing black only
+RED_PRINT_SPEED = 50  # mm/s printing black and red
+CUT_SECONDS = 0.5
+USB_BYTES_PER_SECOND = 1000000
+USB_RESET_SECONDS = 3.0  # Off the bus after a USB reset fault
+MEDIA_WIDTH = 62  # mm of the loaded tape
+RASTER_WIDTH = 90  # Bytes per raster line: the 720 dots of the print head
+
+# Raster commands other than raster lines: (prefix, name, argument bytes)
+COMMANDS = (
+    (b"\x1b\x40", 'init', 0),
+    (b"\x1b\x69\x61", 'mode', 1),
+    (b"\x1b\x69\x53", 'status_request', 0),
+    (b"\x1b\x69\x21", 'auto_status', 1),
+    (b"\x1b\x69\x7a", 'media', 10),
+    (b"\x1b\x69\x4d", 'various', 1),
+    (b"\x1b\x69\x41", 'cut_every', 1),
+    (b"\x1b\x69\x4b", 'expanded', 1),
+    (b"\x1b\x69\x64", 'margins', 2),
+    (b"\x4d", 'compression', 1),
+    (b"\x0c", 'print', 0),
+    (b"\x1a", 'print', 0),
+)
+
+class RasterError(ValueError):
+    """Raster data a QL-810W would reject."""
+
+RasterPage = collections.namedtuple('RasterPage', 'image rows two_color cut')
+
+def unpack_bits(data):
+    """Undo the TIFF PackBits compression of one raster line."""
+    row = bytearray()
+    index = 0
+    while index < len(data):
+        count = data[index]
+        if count > 127:
+            if index + 1 >= len(data):
+                raise RasterError("Truncated compressed raster line")
+            row += bytes([data[index + 1]]) * (257 - count)
+            index += 2
+        else:
+            row += data[index + 1:index + 2 + count]
+            index += 2 + count
+    return bytes(row)
+
+def page_image(black_rows, red_rows):
+    """The printed page: black and red dots on white, mirrored back since the head prints the raster right to left."""
+    from PIL import Image
+    size = (RASTER_WIDTH * 8, len(black_rows))
+    image = Image.new("RGB", size, "white")
+    # In mode "1" a set bit is 255, so a plane of dots is its own paste mask
+    if red_rows:
+        image.paste((255, 0, 0), (0, 0), Image.frombytes("1", size, b"".join(red_rows)))
+    image.paste((0, 0, 0), (0, 0), Image.frombytes("1", size, b"".join(black_rows)))
+    return image.transpose(Image.FLIP_LEFT_RIGHT)
+
+def decode_raster(data):
+    """
+    Check a QL raster job the way the printer would and decode its pages. Raises RasterError on
+    unknown commands, truncated or mis-sized raster lines, a raster count that doesn't match the
+    media command, tape other than MEDIA_WIDTH, or a job that ends without printing.
+    """
+    pages = []
+    black_rows, red_rows = [], []
+    initialized = compression = two_color = cut = False
+    media = None
+    pos = 0
+    while pos < len(data):
+        byte = data[pos]
+        if byte == 0x00:  # Invalidate/preamble
+            pos += 1
+            continue
+        if byte in (0x67, 0x77):  # "g" raster line, "w" two-color raster line: command, colour, length, data
+            if pos + 3 > len(data):
+                raise RasterError(f"Truncated raster line at byte {pos}")
+            color, length = data[pos + 1], data[pos + 2]
+            payload = data[pos + 3:pos + 3 + length]
+            if len(payload) < length:
+                raise RasterError(f"Truncated raster line at byte {pos}")
+            row = unpack_bits(payload) if compression else payload
+            if len(row) != RASTER_WIDTH:
+                raise RasterError(f"Raster line of {len(row)} bytes at byte {pos}, expected {RASTER_WIDTH}")
+            if byte == 0x67 or color == 0x01:
+                black_rows.append(row)
+            elif color == 0x02:
+                red_rows.append(row)
+            else:
+                raise RasterError(f"Unknown raster colour {color:#x} at byte {pos}")
+            pos += 3 + length
+            continue
+        if byte == 0x5a:  # "Z": an empty raster line
+            black_rows.append(bytes(RASTER_WIDTH))
+            if two_color:
+                red_rows.append(bytes(RASTER_WIDTH))
+            pos += 1
+            continue
+        for prefix, name, size in COMMANDS:
+            if data.startswith(prefix, pos):
+                break
+        else:
+            raise RasterError(f"Unknown command {data[pos:pos + 4].hex(' ')} at byte {pos}")
+        args = data[pos + len(prefix):pos + len(prefix) + size]
+        if len(args) < size:
+            raise RasterError(f"Truncated {name} command at byte {pos}")
+        pos += len(prefix) + size
+        if name == 'init':
+            initialized = True
+            black_rows, red_rows = [], []
+        elif name == 'compression':
+            compression = args[0] == 0x02
+        elif name == 'media':
+            media = {'width': args[2], 'length': args[3], 'rows': struct.unpack('<L', args[4:8])[0]}
+        elif name == 'expanded':
+            two_color = bool(args[0] & 0x01)
+            cut = bool(args[0] & 0x08)
+        elif name == 'print':
+            if not initialized:
+                raise RasterError("Print command before initialization")
+            if media is None:
+                raise RasterError("Print command without print information")
+            if media['width'] != MEDIA_WIDTH:
+                raise RasterError(f"Job is for {media['width']}mm tape, {MEDIA_WIDTH}mm is loaded")
+            if len(black_rows) != media['rows']:
+                raise RasterError(f"Job announced {media['rows']} raster lines but sent {len(black_rows)}")
+            if red_rows and not two_color:
+                raise RasterError("Red raster lines without two-color printing")
+            if two_color and len(red_rows) != len(black_rows):
+                raise RasterError(f"{len(black_rows)} black but {len(red_rows)} red raster lines")
+            pages.append(RasterPage(page_image(black_rows, red_rows), len(black_rows), two_color, cut))
+            black_rows, red_rows = [], []
+    if black_rows or red_rows:
+        raise RasterError("Job ended without a print command")
+    if not pages:
+        raise RasterError("Job printed nothing")
+    return pages
+
+def parse_faults(spec):
+    """{fault: probability per attempt} from "busy=0.05,usb_reset=0.01"."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        fault, _, rate = item.partition("=")
+        try:
+            if fault not in FAULTS:
+                raise ValueError(f"unknown fault {fault}")
+            rates[fault] = float(rate)
+        except ValueError as e:
+            logger.error(f"Ignoring simulator fault setting {item}: {str(e)}")
+    return rates
+
+class PrinterSimulator:
+    """
+    A QL-810W in software, behind the same backend interface as the USB printer (see label_printer.backends).
+    Labels are converted to raster data with brother_ql as the command line tool would, decoded and
+    checked as the printer would, and saved as PNG files in SIMULATOR_DIR. Transfer, print and cut
+    times follow the printer's speed, and faults (busy device, USB reset, missing media) can be
+    injected on demand or at random rates.
+    """
+
+    name = 'simulator'
+
+    def __init__(self, output_dir=SIMULATOR_DIR, speed=SIMULATOR_SPEED, faults=SIMULATOR_FAULTS):
+        self.output_dir = output_dir
+        self.speed = speed
+        self.fault_rates = parse_faults(faults)
+        self.pending_faults = collections.deque()
+        self.lock = threading.Lock()
+        self.offline_until = 0
+        self.errors = []  # Reported by status queries until the next good print
+        self.counters = collections.Counter()
+        self.saved = collections.deque()
+        self.device = {'sysfs_path': 'simulator', 'busnum': 0, 'devnum': 0, 'dev_path': 'simulator'}
+
+    def wait(self, seconds):
+        if self.speed > 0:
+            time.sleep(seconds / self.speed)
+
+    def find_device(self):
+        return None if time.monotonic() < self.offline_until else self.device
+
+    def next_fault(self):
+        with self.lock:
+            if self.pending_faults:
+                return self.pending_faults.popleft()
+        for fault, rate in self.fault_rates.items():
+            if random.random() < rate:
+                return fault
+        return None
+
+    def inject_fault(self, fault, count=1):
+        """Make the next count print attempts fail with fault."""
+        if fault not in FAULTS:
+            raise ValueError(f"Unknown fault {fault}, expected one of {', '.join(FAULTS)}")
+        with self.lock:
+            self.pending_faults.extend([fault] * count)
+
+    def fail(self, fault, kind, message):
+        with self.lock:
+            self.counters[f"fault_{fault}"] += 1
+        logger.info("Simulated printer fault: %s", fault)
+        raise PrintError(kind, message)
+
+    def disconnect(self):
+        """Drop off the bus for USB_RESET_SECONDS, telling the printer monitor when we leave and come back."""
+        delay = USB_RESET_SECONDS / self.speed if self.speed > 0 else 0
+        self.offline_until = time.monotonic() + delay
+        printer_monitor.refresh()
+        timer = threading.Timer(delay, printer_monitor.refresh)
+        timer.daemon = True
+        timer.start()
+
+    def rasterize(self, image, red):
+        """Raster data for a file path or PNG bytes, converted with the options the brother_ql command line uses."""
+        from PIL import Image
+        from brother_ql.conversion import convert
+        from brother_ql.raster import BrotherQLRaster
+        qlr = BrotherQLRaster(PRINTER_MODEL)
+        qlr.exception_on_warning = True
+        source = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+        return convert(qlr, [source], PRINTER_LABEL, cut=True, dither=False, compress=False, red=red, rotate='auto', dpi_600=False, hq=True, threshold=70)
+
+    def print(self, image, red=False):
+        if self.find_device() is None:
+            raise PrinterOffline("Simulated printer is off the USB bus")
+        with span('raster_convert'):
+            data = self.rasterize(image, red)
+        fault = self.next_fault()
+        report_progress('sending', bytes=len(data))
+        if fault == 'busy':
+            self.fail(fault, BUSY, "usb.core.USBError: [Errno 16] Resource busy")
+        if fault == 'usb_reset':
+            # Gone halfway through the transfer
+            self.wait(len(data) / 2 / USB_BYTES_PER_SECOND)
+            self.disconnect()
+            self.fail(fault, NOT_FOUND, "usb.core.USBError: [Errno 19] No such device (it may have been disconnected)")
+        with span('usb_transfer'):
+            self.wait(len(data) / USB_BYTES_PER_SECOND)
+        try:
+            pages = decode_raster(data)
+        except RasterError as e:
+            with self.lock:
+                self.counters['rejected'] += 1
+            raise PrintError(FATAL, f"Printer rejected the raster data: {str(e)}")
+        report_progress('sent')
+        if fault == 'media_missing':
+            self.errors = ['No media when printing']
+            self.fail(fault, FATAL, "Printer reported errors: No media when printing")
+        for page in pages:
+            report_progress('acknowledged')
+            length_mm = page.rows / DOTS_PER_MM
+            with span('printer'):
+                self.wait(length_mm / (RED_PRINT_SPEED if page.two_color else PRINT_SPEED))
+            self.record(page, length_mm, len(data))
+            report_progress('printed')
+            if page.cut:
+                self.wait(CUT_SECONDS)
+                report_progress('cut')
+        self.errors = []
+        stderr = (f"INFO:brother_ql.backends.helpers:Sending instructions to the printer. Total: {len(data)} bytes.\n"
+                  "INFO:brother_ql.backends.helpers:Printing was successful. Waiting for the next job.\n")
+        return subprocess.CompletedProcess(['simulator', PRINTER_MODEL], 0, "", stderr)
+
+    def record(self, page, length_mm, size):
+        with self.lock:
+            self.counters['labels'] += 1
+            self.counters['bytes'] += size
+            self.counters['tape_mm'] += round(length_mm)
+            number = self.counters['labels']
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{number:06d}.png")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            page.image.save(path)
+            self.saved.append(path)
+            while len(self.saved) > SIMULATOR_KEEP:
+                os.remove(self.saved.popleft())
+        except OSError as e:
+            logger.error(f"Cannot save simulated label {path}: {str(e)}")
+        logger.debug("Simulated label %s: %.0fmm, %s", number, length_mm, 'black and red' if page.two_color else 'black')
+
+    def query_status(self, timeout=1.0):
+        if self.find_device() is None:
+            raise TimeoutError("No status reply from printer")
+        return {
+            'status_type': 'Reply to status request',
+            'phase_type': 'Waiting to receive',
+            'media_type': 'Continuous length tape',
+            'media_width': MEDIA_WIDTH,
+            'media_length': 0,
+            'errors': list(self.errors),
+        }
+
+    def recover(self):
+        """Like the USB recovery steps: nothing to do while the device is off the bus."""
+        with self.lock:
+            self.counters['recoveries'] += 1
+        return self.find_device() is not None
+
+    def describe(self):
+        with self.lock:
+            return {
+                'backend': self.name,
+                'model': PRINTER_MODEL,
+                'label': PRINTER_LABEL,
+                'connected': self.find_device() is not None,
+                'speed': self.speed,
+                'fault_rates': dict(self.fault_rates),
+                'pending_faults': list(self.pending_faults),
+                'errors': list(self.errors),
+                'counters': dict(self.counters),
+                'output_dir': self.output_dir,
+                'last_label': self.saved[-1] if self.saved else None,
+            }
@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class StartupJobs:
+    """
+    Slow startup work (USB recovery, startup QR codes, font scan, render workers) run in
+    background threads, so the web server binds at once. Tracks which subsystems are ready.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def run(self, name, func, *args, after=None):
+        """Run func(*args) in a background thread as startup job name, once the job named after has finished."""
+        with self.lock:
+            if name in self.jobs:
+                return
+            self.jobs[name] = {'state': 'pending', 'started': None, 'finished': None, 'error': None, 'done': threading.Event()}
+        threading.Thread(target=self.execute, args=(name, func, args, after), name=f"startup-{name}", daemon=True).start()
+
+    def execute(self, name, func, args, after):
+        job = self.jobs[name]
+        if after in self.jobs:
+            self.jobs[after]['done'].wait()
+        job['state'] = 'running'
+        job['started'] = time.time()
+        logger.debug("Startup job %s started", name)
+        try:
+            func(*args)
+            job['state'] = 'ready'
+            logger.info("Startup job %s finished in %.1fs", name, time.time() - job['started'])
+        except Exception as e:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"Startup job {name} failed: {str(e)}")
+        job['finished'] = time.time()
+        job['done'].set()
+
+    def status(self):
+        """{name: {state, started, finished, error}}; state is pending, running, ready or failed."""
+        with self.lock:
+            return {name: {key: value for key, value in job.items() if key != 'done'} for name, job in self.jobs.items()}
+
+startup_jobs = StartupJobs()
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from label_printer.backends import printer_backend
+from label_printer.device import printer_monitor
+from label_printer.print_queue import print_queue
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUERY_INTERVAL = 30  # Seconds between status requests to an idle printer
+
+class StatusMonitor:
+    """
+    Keep one cached snapshot of the printer's state, fed by hotplug events, print queue
+    events and occasional status replies from the printer. Readers get the cached copy
+    or block until it changes, so the cost doesn't depend on how many clients are watching.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.snapshot = {
+            'online': False,
+            'state': 'offline',  # offline, idle, busy or error
+            'current_job': None,
+            'queued': 0,
+            'media': None,
+            'errors': [],
+            'updated': time.time()
+        }
+        self.query_now = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="status-monitor", daemon=True)
+        printer_monitor.add_callback(self.on_presence)
+        print_queue.add_listener(self.on_job_event)
+        self.on_presence(printer_monitor.is_present(), printer_monitor.device)
+        self.thread.start()
+
+    def update(self, **changes):
+        with self.condition:
+            snapshot = dict(self.snapshot, **changes)
+            if not snapshot['online']:
+                snapshot['state'] = 'offline'
+            elif snapshot['current_job']:
+                snapshot['state'] = 'busy'
+            elif snapshot['errors']:
+                snapshot['state'] = 'error'
+            else:
+                snapshot['state'] = 'idle'
+            if all(snapshot[key] == self.snapshot[key] for key in snapshot if key != 'updated'):
+                return
+            snapshot['updated'] = time.time()
+            self.snapshot = snapshot
+            self.version += 1
+            self.condition.notify_all()
+        logger.debug("Printer status changed: %s", snapshot['state'])
+
+    def get(self):
+        """Return (snapshot, version) without touching the printer."""
+        self.start()
+        with self.condition:
+            return dict(self.snapshot), self.version
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the snapshot version differs from version, or timeout. Returns (snapshot, version)."""
+        self.start()
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return dict(self.snapshot), self.version
+
+    def on_presence(self, present, device):
+        if present:
+            self.update(online=True)
+            self.query_now.set()
+        else:
+            self.update(online=False, media=None, errors=[])
+
+    def on_job_event(self, event, job):
+        if event == 'started':
+            self.update(current_job=job.description, queued=print_queue.pending())
+        elif event in ('finished', 'interrupted'):
+            self.update(current_job=None, queued=print_queue.pending())
+            self.query_now.set()
+        else:
+            self.update(queued=print_queue.pending())
+
+    def run(self):
+        while True:
+            self.query_now.wait(STATUS_QUERY_INTERVAL)
+            self.query_now.clear()
+            if not printer_monitor.is_present():
+                continue
+            # Never talk to the printer while a job has it; the next 'finished' event triggers a query
+            if not print_queue.device_lock.acquire(blocking=False):
+                continue
+            try:
+                status = printer_backend.query_status()
+            except Exception as e:
+                logger.debug("Printer status query failed: %s", e)
+                continue
+            finally:
+                print_queue.device_lock.release()
+            media = f"{status['media_type']} {status['media_width']}mm"
+            if status['media_length']:
+                media += f" x {status['media_length']}mm"
+            self.update(media=media, errors=status['errors'])
+
+status_monitor = StatusMonitor()
@@ -0,0 +1,31 @@
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from label_printer.config import WORKSPACE_ROOT, DEBUG_IMAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+@contextlib.contextmanager
+def job_workspace(prefix="job_"):
+    """
+    Private scratch directory for one job, removed when the block exits.
+    Lives on tmpfs where available, so scratch files never touch the SD card.
+    """
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=prefix, dir=WORKSPACE_ROOT) as path:
+        yield path
+
+def save_debug_image(image, name):
+    """Save an intermediate image to DEBUG_IMAGE_DIR, if set, under a name unique to this process and thread."""
+    if not DEBUG_IMAGE_DIR:
+        return
+    try:
+        os.makedirs(DEBUG_IMAGE_DIR, exist_ok=True)
+        debug_path = os.path.join(DEBUG_IMAGE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}-{name}.png")
+        image.save(debug_path)
+        logger.debug("Saved debug image at %s, size: %sx%spx", debug_path, image.width, image.height)
+    except Exception as e:
+        logger.warning(f"Could not save debug image {name}: {str(e)}")
@@ -9,20 +9,108 @@ window.printLabel = function() {
             return;
         }
         console.log('Form found:', form);
-        var input = document.createElement('input');
-        input.type = 'hidden';
-        input.name = 'action';
-        input.value = 'Print Label';
-        form.appendChild(input);
-        form.action = '/';
-        console.log('Submitting form to / with action=Print Label');
-        form.submit();
+        if (!window.EventSource || !window.fetch) {
+            // No live progress available: fall back to the synchronous form post
+            var input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'action';
+            input.value = 'Print Label';
+            form.appendChild(input);
+            form.action = '/';
+            console.log('Submitting form to / with action=Print Label');
+            form.submit();
+            return;
+        }
+        console.log('Submitting label job to /jobs/label');
+        fetch('/jobs/label', { method: 'POST', body: new FormData(form) })
+            .then(response => response.json().then(data => {
+                if (!response.ok) throw new Error(data.message || `HTTP error ${response.status}`);
+                return data;
+            }))
+            .then(data => {
+                console.log('Label job queued:', data);
+                var previewModal = bootstrap.Modal.getInstance(document.getElementById('previewModal'));
+                if (previewModal) previewModal.hide();
+                window.trackPrintJob(data.job_id);
+            })
+            .catch(error => {
+                console.error('Error submitting label job:', error);
+                showAlert('Error submitting print request: ' + error.message, 'danger');
+            });
     } catch (error) {
         console.error('Error in printLabel:', error);
         alert('Error submitting print request: ' + error.message);
     }
 };
 
+// Print queue shared by everyone using the printer, fed by /jobs/events
+var printJobs = {};
+var ownJobs = {};
+var finishedJobs = {};  // Outcomes that may arrive before /jobs/label has answered
+var printJobStages = {
+    queued: job => 'Queued' + (job.position ? ' (position ' + job.position + ')' : ''),
+    started: job => 'Starting',
+    rendered: job => 'Rendered',
+    sending: job => 'Sending' + (job.bytes ? ' ' + Math.round(job.bytes / 1024) + ' kB' : ''),
+    sent: job => 'Sent to printer',
+    acknowledged: job => 'Printing',
+    printed: job => 'Printed',
+    cut: job => 'Cut',
+    interrupted: job => 'Waiting for printer'
+};
+
+function renderPrintQueue() {
+    var queueElement = document.getElementById('printQueue');
+    if (!queueElement) return;
+    var jobs = Object.values(printJobs).sort((a, b) => (a.position || 0) - (b.position || 0));
+    queueElement.innerHTML = '';
+    jobs.forEach(job => {
+        var item = document.createElement('div');
+        item.className = 'print-queue-item' + (ownJobs[job.job_id] ? ' own' : '');
+        var stage = printJobStages[job.stage] ? printJobStages[job.stage](job) : job.stage;
+        item.textContent = job.description + ': ' + stage;
+        queueElement.appendChild(item);
+    });
+    queueElement.style.display = jobs.length ? '' : 'none';
+}
+
+function applyJobEvent(event) {
+    if (event.stage === 'finished') {
+        delete printJobs[event.job_id];
+        finishedJobs[event.job_id] = event;
+        if (ownJobs[event.job_id]) {
+            delete ownJobs[event.job_id];
+            showJobOutcome(event);
+        }
+    } else {
+        var job = printJobs[event.job_id] || { job_id: event.job_id, description: event.description };
+        job.stage = event.stage;
+        if (event.position !== undefined) job.position = event.position;
+        if (event.bytes) job.bytes = event.bytes;
+        if (event.stage === 'started') job.position = 1;
+        printJobs[event.job_id] = job;
+    }
+    renderPrintQueue();
+}
+
+function showJobOutcome(event) {
+    if (event.outcome === 'success') {
+        showAlert('Label printed successfully!', 'success');
+    } else {
+        showAlert('Error: ' + (event.message || 'Printing failed'), 'danger');
+    }
+}
+
+window.trackPrintJob = function(jobId) {
+    if (finishedJobs[jobId]) {
+        showJobOutcome(finishedJobs[jobId]);
+        return;
+    }
+    ownJobs[jobId] = true;
+    showAlert('Label sent to the print queue', 'info');
+    renderPrintQueue();
+};
+
 window.saveTemplate = function() {
     console.log('saveTemplate called');
     try {
@@ -37,7 +125,7 @@ window.saveTemplate = function() {
         var config = {};
         formData.forEach((value, key) => {
             // Convert specific fields to appropriate types
-            if (['size1', 'size2', 'size3', 'spacing1', 'spacing2', 'length'].includes(key)) {
+            if (['size1', 'size2', 'size3', 'spacing1', 'spacing2', 'barcode_height', 'length'].includes(key)) {
                 config[key] = parseInt(value, 10) || 0; // Parse numbers
             } else if (['bold1', 'italic1', 'underline1', 'bold2', 'italic2', 'underline2', 'bold3', 'italic3', 'underline3'].includes(key)) {
                 config[key] = value === 'on' || value === true; // Parse checkboxes
@@ -468,7 +556,28 @@ function showAlert(message, type) {
 document.addEventListener('DOMContentLoaded', function() {
     console.log('DOM content loaded');
 
-    // Printer status check
+    // Printer status display
+    function showPrinterStatus(data) {
+        const statusElement = document.getElementById('printerStatus');
+        if (data.online) {
+            let text = 'Printer: Online';
+            if (data.state === 'busy') {
+                text += ' (printing' + (data.queued > 1 ? ', ' + (data.queued - 1) + ' queued' : '') + ')';
+            } else if (data.state === 'error') {
+                text += ' (' + data.errors.join(', ') + ')';
+            }
+            statusElement.textContent = text;
+            statusElement.classList.remove('offline');
+            statusElement.classList.add('online');
+        } else {
+            statusElement.textContent = 'Printer: Offline' + (data.queued ? ' (' + data.queued + ' queued)' : '');
+            statusElement.classList.remove('online');
+            statusElement.classList.add('offline');
+        }
+        console.log('Printer status updated:', data.state || (data.online ? 'online' : 'offline'));
+    }
+
+    // Fallback for browsers without EventSource: poll the cached status
     function checkPrinterStatus() {
         console.log('Checking printer status');
         fetch('/printer_status')
@@ -476,19 +585,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (!response.ok) throw new Error('Network response was not ok');
                 return response.json();
             })
-            .then(data => {
-                const statusElement = document.getElementById('printerStatus');
-                if (data.online) {
-                    statusElement.textContent = 'Printer: Online';
-                    statusElement.classList.remove('offline');
-                    statusElement.classList.add('online');
-                } else {
-                    statusElement.textContent = 'Printer: Offline';
-                    statusElement.classList.remove('online');
-                    statusElement.classList.add('offline');
-                }
-                console.log('Printer status updated:', data.online ? 'Online' : 'Offline');
-            })
+            .then(showPrinterStatus)
             .catch(error => {
                 if (error.name === 'AbortError') {
                     console.log('Printer status check aborted');
@@ -502,9 +599,40 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
-    // Initial check and periodic updates
-    checkPrinterStatus();
-    setInterval(checkPrinterStatus, 5000);
+    // Status changes are pushed by the server; EventSource reconnects on its own
+    if (window.EventSource) {
+        const statusSource = new EventSource('/printer_status/stream');
+        statusSource.onmessage = function(event) {
+            showPrinterStatus(JSON.parse(event.data));
+        };
+        statusSource.onerror = function() {
+            console.warn('Printer status stream interrupted, reconnecting');
+        };
+    } else {
+        checkPrinterStatus();
+        setInterval(checkPrinterStatus, 5000);
+    }
+
+    // Shared print queue: load the current jobs, then follow their events from that point on
+    if (window.EventSource && document.getElementById('printQueue')) {
+        fetch('/jobs')
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => {
+                data.jobs.forEach(job => { printJobs[job.job_id] = job; });
+                renderPrintQueue();
+                const jobSource = new EventSource('/jobs/events?after=' + data.seq);
+                jobSource.onmessage = function(event) {
+                    applyJobEvent(JSON.parse(event.data));
+                };
+                jobSource.onerror = function() {
+                    console.warn('Print job stream interrupted, reconnecting');
+                };
+            })
+            .catch(error => console.error('Error loading print queue:', error));
+    }
 
     // Font selection setup
     window.currentTextarea = null;
@@ -1,46 +1,231 @@
+import logging
 import os
 import time
+import queue
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from label_printer.printing import print_file
-from label_printer.config import logger
+from label_printer.printing import prepare_print_file, print_prepared_image
+from label_printer.print_queue import print_queue
+from label_printer.render_pool import render_pool
+from label_printer.metrics import span, stage_seconds
+from label_printer.profiling import PROFILE_FLAG, new_profile_id, profiled
+
+logger = logging.getLogger("label_printer.hot_folder")
 
 PRINT_DIR = "/home/odroid/label_printer_web/print"
 
+# Spool layout: ready files are atomically renamed into CLAIMED_DIR before any work is done,
+# then into DONE_DIR or FAILED_DIR. Anything left in CLAIMED_DIR at startup was interrupted.
+CLAIMED_DIR = os.path.join(PRINT_DIR, "claimed")
+DONE_DIR = os.path.join(PRINT_DIR, "done")
+FAILED_DIR = os.path.join(PRINT_DIR, "failed")
+DONE_KEEP = 50  # Number of printed files kept in DONE_DIR
+FAILED_KEEP = 200  # Number of failed files kept in FAILED_DIR for review; older ones are deleted
+
+# Readiness tuning: a file is ready once the writer has closed it (IN_CLOSE_WRITE)
+# and it stayed unchanged for CLOSE_SETTLE seconds, or, if no close event arrives,
+# once its size and mtime stayed unchanged for QUIET_PERIOD seconds.
+POLL_INTERVAL = 0.1
+CLOSE_SETTLE = 0.1
+QUIET_PERIOD = 1.5
+
+def file_signature(file_path):
+    """Return (size, mtime_ns) for file_path, or None if it no longer exists."""
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def move_to(file_path, target_dir):
+    """
+    Atomically rename file_path into target_dir and flush the directory entries to disk.
+    A numeric suffix is added before the extension if the name is already taken.
+    Returns the new path, or None if file_path disappeared.
+    """
+    filename = os.path.basename(file_path)
+    target_path = os.path.join(target_dir, filename)
+    if os.path.exists(target_path):
+        root, ext = os.path.splitext(filename)
+        target_path = os.path.join(target_dir, f"{root}.{time.time_ns()}{ext}")
+    try:
+        os.rename(file_path, target_path)
+    except FileNotFoundError:
+        return None
+    for directory in {os.path.dirname(file_path), target_dir}:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return target_path
+
+def prune_dir(directory, keep):
+    """Keep only the keep most recently moved files in directory."""
+    try:
+        entries = sorted(os.scandir(directory), key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[keep:]:
+            os.remove(entry.path)
+    except Exception as e:
+        logger.warning(f"Failed to prune {directory}: {str(e)}")
+
+def move_to_failed(claimed_path):
+    """Move a file that could not be printed to FAILED_DIR for review, keeping the FAILED_KEEP most recent."""
+    move_to(claimed_path, FAILED_DIR)
+    prune_dir(FAILED_DIR, FAILED_KEEP)
+
 class PrintHandler(FileSystemEventHandler):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> {'signature', 'stable_since', 'closed'}
+        self.wakeup = threading.Event()
+        self.print_queue = queue.Queue()  # (file_path, future) in the order files became ready
+        threading.Thread(target=self.check_pending, daemon=True).start()
+        threading.Thread(target=self.print_prepared, daemon=True).start()
+
     def on_created(self, event):
         self.process_event(event)
 
     def on_modified(self, event):
         self.process_event(event)
 
-    def process_event(self, event):
+    def on_closed(self, event):
+        self.process_event(event, closed=True)
+
+    def on_moved(self, event):
+        # Some clients write to a temporary name and rename it when done
+        if not event.is_directory and os.path.dirname(event.dest_path) == os.path.dirname(event.src_path):
+            self.track(event.dest_path, closed=True)
+
+    def process_event(self, event, closed=False):
         if event.is_directory:
             return
-        file_path = event.src_path
-        logger.debug(f"File event detected: {file_path} (event: {event.event_type})")
-        time.sleep(2)  # Increased delay for Samba to finish writing
-        if os.path.exists(file_path):  # Ensure file still exists
-            logger.debug(f"Processing file: {file_path}")
-            result = print_file(file_path)
-            if result is None:
-                # Invalid file or failed after retries
-                logger.info(f"Removing invalid or unprintable file: {file_path}")
-                os.remove(file_path)
-            elif "Printing was successful" in result.stderr:
-                logger.info(f"Successfully printed {file_path}, removing file")
-                os.remove(file_path)
-            else:
-                logger.error(f"Failed to print {file_path}, keeping file for review")
+        logger.debug("File event detected: %s (event: %s)", event.src_path, event.event_type)
+        self.track(event.src_path, closed=closed)
+
+    def track(self, file_path, closed=False):
+        """Register or refresh a pending file; duplicate events for one path coalesce here."""
+        with self.lock:
+            entry = self.pending.get(file_path)
+            if entry is None:
+                self.pending[file_path] = {
+                    'signature': file_signature(file_path),
+                    'stable_since': time.monotonic(),
+                    'first_seen': time.monotonic(),
+                    'closed': closed
+                }
+            elif closed:
+                entry['closed'] = True
+        self.wakeup.set()
+
+    def check_pending(self):
+        """Poll pending files for stability and claim the ready ones."""
+        while True:
+            self.wakeup.wait()
+            time.sleep(POLL_INTERVAL)
+            now = time.monotonic()
+            ready = []
+            with self.lock:
+                for file_path, entry in list(self.pending.items()):
+                    signature = file_signature(file_path)
+                    if signature is None:
+                        logger.debug("File %s no longer exists, skipping", file_path)
+                        del self.pending[file_path]
+                        continue
+                    if signature != entry['signature']:
+                        entry['signature'] = signature
+                        entry['stable_since'] = now
+                        continue
+                    quiet_for = now - entry['stable_since']
+                    if (entry['closed'] and quiet_for >= CLOSE_SETTLE) or (signature[0] > 0 and quiet_for >= QUIET_PERIOD):
+                        logger.debug("File %s is ready after %.2fs quiet (closed: %s)", file_path, quiet_for, entry['closed'])
+                        del self.pending[file_path]
+                        stage_seconds.observe(now - entry['first_seen'], stage='hot_folder_settle')
+                        ready.append(file_path)
+                if not self.pending:
+                    self.wakeup.clear()
+            # Claiming renames, fsyncs and may start the render pool; watchdog events must not wait for that
+            for file_path in ready:
+                self.enqueue(file_path)
+
+    def recover(self):
+        """Resume jobs interrupted by a crash or restart, then pick up files that arrived while we were down."""
+        for directory in (CLAIMED_DIR, DONE_DIR, FAILED_DIR):
+            os.makedirs(directory, exist_ok=True)
+        claimed = sorted(os.scandir(CLAIMED_DIR), key=lambda e: e.stat().st_mtime)
+        for entry in claimed:
+            if entry.is_file():
+                logger.info("Resuming interrupted print job: %s", entry.path)
+                self.submit(entry.path)
+        backlog = sorted(os.scandir(PRINT_DIR), key=lambda e: e.stat().st_mtime)
+        for entry in backlog:
+            if entry.is_file():
+                logger.info("Found unprinted file from before startup: %s", entry.path)
+                self.track(entry.path, closed=True)
+
+    def enqueue(self, file_path):
+        """Claim a ready file from the print directory and submit it."""
+        claimed_path = move_to(file_path, CLAIMED_DIR)
+        if claimed_path is None:
+            logger.debug("File %s no longer exists, skipping", file_path)
+            return
+        logger.debug("Claimed %s as %s", file_path, claimed_path)
+        self.submit(claimed_path)
+
+    def submit(self, claimed_path):
+        """Start preparing a claimed file in the render pool and queue it for printing in arrival order."""
+        # Files flagged "+prof" are sampled while they are prepared and printed
+        profile_id = new_profile_id() if PROFILE_FLAG in os.path.basename(claimed_path).lower() else None
+        with profiled(profile_id):
+            future = render_pool.submit(prepare_print_file, claimed_path)
+        logger.debug("Queued %s for preprocessing", claimed_path)
+        self.print_queue.put((claimed_path, future, profile_id))
+
+    def print_prepared(self):
+        """Hand prepared files to the printer in order while later files are still being prepared."""
+        while True:
+            claimed_path, future, profile_id = self.print_queue.get()
+            try:
+                with profiled(profile_id):
+                    self.process_file(claimed_path, future)
+            except Exception as e:
+                logger.error(f"Unexpected error processing {claimed_path}: {str(e)}")
+                move_to_failed(claimed_path)
+
+    def process_file(self, claimed_path, future):
+        try:
+            with span('hot_folder_prepare_wait'):
+                img = future.result()
+        except Exception as e:
+            logger.error(f"Error preparing file {claimed_path}: {str(e)}")
+            img = None
+        if img is None:
+            # Invalid or unsupported file
+            logger.info("Moving invalid or unprintable file to %s: %s", FAILED_DIR, claimed_path)
+            move_to_failed(claimed_path)
+            return
+        logger.debug("Processing file: %s", claimed_path)
+        # Printing goes through the shared print queue, which holds the job while the printer is offline
+        job = print_queue.submit(print_prepared_image, img, claimed_path, description=os.path.basename(claimed_path))
+        job.wait()
+        result = job.result
+        if result is not None and "Printing was successful" in result.stderr:
+            logger.info("Successfully printed %s, moving to %s", claimed_path, DONE_DIR)
+            move_to(claimed_path, DONE_DIR)
+            prune_dir(DONE_DIR, DONE_KEEP)
         else:
-            logger.debug(f"File {file_path} no longer exists, skipping")
+            logger.error(f"Failed to print {claimed_path}, moving to {FAILED_DIR} for review")
+            move_to_failed(claimed_path)
 
 def watch_print_directory():
     event_handler = PrintHandler()
     observer = Observer()
     observer.schedule(event_handler, PRINT_DIR, recursive=False)
     observer.start()
-    logger.info(f"Started watching {PRINT_DIR}")
+    logger.info("Started watching %s", PRINT_DIR)
+    event_handler.recover()
     try:
         while True:
             time.sleep(1)
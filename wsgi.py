@@ -0,0 +1,8 @@
+"""
+Production entry point. Web workers run this app under gunicorn (see gunicorn.conf.py) and
+hand printing to the print service process, started separately with: python app.py --service
+"""
+from app import create_app
+from label_printer.config import SERVICE_ADDRESS
+
+app = create_app(SERVICE_ADDRESS)